@@ -0,0 +1,29 @@
+"""Add precomputed features to patient
+
+Revision ID: 3f1c9a7d2e4b
+Revises: b6a93e4b05e1
+Create Date: 2026-10-16 14:02:37.112094+00:00
+
+"""
+from typing import Sequence
+from typing import Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c9a7d2e4b'
+down_revision: Union[str, Sequence[str], None] = 'b6a93e4b05e1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # NOTE: existing rows are left NULL, run scripts/backfill_features.py to populate them
+    op.add_column('mpi_patient', sa.Column('features', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('mpi_patient', 'features')
@@ -0,0 +1,28 @@
+"""Add version to algorithm
+
+Revision ID: 8d2e5b7c4a19
+Revises: 3f1c9a7d2e4b
+Create Date: 2026-10-16 15:21:48.530217+00:00
+
+"""
+from typing import Sequence
+from typing import Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '8d2e5b7c4a19'
+down_revision: Union[str, Sequence[str], None] = '3f1c9a7d2e4b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('algorithm', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('algorithm', 'version')
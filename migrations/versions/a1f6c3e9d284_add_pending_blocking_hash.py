@@ -0,0 +1,36 @@
+"""Add pending blocking hash
+
+Revision ID: a1f6c3e9d284
+Revises: e4c8b2d6f391
+Create Date: 2026-10-16 21:24:08.513907+00:00
+
+"""
+from typing import Sequence
+from typing import Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'a1f6c3e9d284'
+down_revision: Union[str, Sequence[str], None] = 'e4c8b2d6f391'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # NOTE: the Patients already pending aren't blocking candidates until they're indexed
+    op.create_table('mpi_pending_blocking_hash',
+    sa.Column('hash', sa.BigInteger(), nullable=False),
+    sa.Column('patient_id', sa.BigInteger().with_variant(sa.INTEGER(), 'sqlite'), nullable=False),
+    sa.ForeignKeyConstraint(['patient_id'], ['mpi_patient.id'], ),
+    sa.PrimaryKeyConstraint('hash', 'patient_id')
+    )
+    op.create_index(op.f('ix_mpi_pending_blocking_hash_patient_id'), 'mpi_pending_blocking_hash', ['patient_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_mpi_pending_blocking_hash_patient_id'), table_name='mpi_pending_blocking_hash')
+    op.drop_table('mpi_pending_blocking_hash')
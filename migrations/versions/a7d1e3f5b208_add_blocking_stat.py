@@ -0,0 +1,33 @@
+"""Add blocking value statistics table
+
+Revision ID: a7d1e3f5b208
+Revises: f2a8c6d4e157
+Create Date: 2026-10-16 22:15:48.391207+00:00
+
+"""
+from typing import Sequence
+from typing import Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7d1e3f5b208'
+down_revision: Union[str, Sequence[str], None] = 'f2a8c6d4e157'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # NOTE: the table starts empty, run scripts/refresh_blocking_stats.py to populate it
+    op.create_table('mpi_blocking_stat',
+    sa.Column('hash', sa.BigInteger(), autoincrement=False, nullable=False),
+    sa.Column('count', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('hash')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('mpi_blocking_stat')
@@ -0,0 +1,33 @@
+"""Add stop values to blocking stat
+
+Revision ID: b3e9f1a6c524
+Revises: a7d1e3f5b208
+Create Date: 2026-10-16 23:02:19.560431+00:00
+
+"""
+from typing import Sequence
+from typing import Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3e9f1a6c524'
+down_revision: Union[str, Sequence[str], None] = 'a7d1e3f5b208'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        'mpi_blocking_stat',
+        sa.Column('stop', sa.Boolean(), server_default=sa.false(), nullable=False),
+    )
+    op.add_column('mpi_blocking_stat', sa.Column('value', sa.String(length=20), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('mpi_blocking_stat', 'value')
+    op.drop_column('mpi_blocking_stat', 'stop')
@@ -0,0 +1,33 @@
+"""Add pending_index to patient
+
+Revision ID: c41e7a2f9b63
+Revises: 8d2e5b7c4a19
+Create Date: 2026-10-16 18:40:12.402117+00:00
+
+"""
+from typing import Sequence
+from typing import Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41e7a2f9b63'
+down_revision: Union[str, Sequence[str], None] = '8d2e5b7c4a19'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        'mpi_patient',
+        sa.Column('pending_index', sa.Boolean(), server_default=sa.false(), nullable=False),
+    )
+    op.create_index(op.f('ix_mpi_patient_pending_index'), 'mpi_patient', ['pending_index'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_mpi_patient_pending_index'), table_name='mpi_patient')
+    op.drop_column('mpi_patient', 'pending_index')
@@ -0,0 +1,30 @@
+"""Add created at to blocking change
+
+Revision ID: c7d2e5a9f814
+Revises: a1f6c3e9d284
+Create Date: 2026-10-16 22:14:37.602184+00:00
+
+"""
+from typing import Sequence
+from typing import Union
+
+import sqlalchemy as sa
+from alembic import op
+
+from recordlinker.models.base import TZDateTime
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7d2e5a9f814'
+down_revision: Union[str, Sequence[str], None] = 'a1f6c3e9d284'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('mpi_blocking_change', sa.Column('created_at', TZDateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('mpi_blocking_change', 'created_at')
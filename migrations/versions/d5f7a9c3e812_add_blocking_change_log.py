@@ -0,0 +1,33 @@
+"""Add blocking change log
+
+Revision ID: d5f7a9c3e812
+Revises: b3e9f1a6c524
+Create Date: 2026-10-16 09:14:37.206185+00:00
+
+"""
+from typing import Sequence
+from typing import Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5f7a9c3e812'
+down_revision: Union[str, Sequence[str], None] = 'b3e9f1a6c524'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('mpi_blocking_change',
+    sa.Column('id', sa.BigInteger().with_variant(sa.INTEGER(), 'sqlite'), autoincrement=True, nullable=False),
+    sa.Column('patient_id', sa.BigInteger(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sqlite_autoincrement=True
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('mpi_blocking_change')
@@ -0,0 +1,30 @@
+"""Add refreshed at to blocking stat
+
+Revision ID: e4c8b2d6f391
+Revises: d5f7a9c3e812
+Create Date: 2026-10-16 21:02:43.918254+00:00
+
+"""
+from typing import Sequence
+from typing import Union
+
+import sqlalchemy as sa
+from alembic import op
+
+from recordlinker.models.base import TZDateTime
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4c8b2d6f391'
+down_revision: Union[str, Sequence[str], None] = 'd5f7a9c3e812'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('mpi_blocking_stat', sa.Column('refreshed_at', TZDateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('mpi_blocking_stat', 'refreshed_at')
@@ -0,0 +1,37 @@
+"""Add compact blocking hash table
+
+Revision ID: e9b3d5a1c772
+Revises: c41e7a2f9b63
+Create Date: 2026-10-16 20:11:05.718342+00:00
+
+"""
+from typing import Sequence
+from typing import Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'e9b3d5a1c772'
+down_revision: Union[str, Sequence[str], None] = 'c41e7a2f9b63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # NOTE: the table starts empty, run scripts/backfill_blocking_hashes.py to populate
+    # it before setting BLOCKING_STORAGE=hash
+    op.create_table('mpi_blocking_hash',
+    sa.Column('hash', sa.BigInteger(), nullable=False),
+    sa.Column('patient_id', sa.BigInteger().with_variant(sa.INTEGER(), 'sqlite'), nullable=False),
+    sa.ForeignKeyConstraint(['patient_id'], ['mpi_patient.id'], ),
+    sa.PrimaryKeyConstraint('hash', 'patient_id')
+    )
+    op.create_index(op.f('ix_mpi_blocking_hash_patient_id'), 'mpi_blocking_hash', ['patient_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_mpi_blocking_hash_patient_id'), table_name='mpi_blocking_hash')
+    op.drop_table('mpi_blocking_hash')
@@ -0,0 +1,64 @@
+"""Partition blocking values by blocking key
+
+Revision ID: f2a8c6d4e157
+Revises: e9b3d5a1c772
+Create Date: 2026-10-16 21:42:37.204119+00:00
+
+"""
+from typing import Sequence
+from typing import Union
+
+import sqlalchemy as sa
+from alembic import op
+
+from recordlinker import models
+from recordlinker.config import settings
+from recordlinker.models import partitioning
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2a8c6d4e157'
+down_revision: Union[str, Sequence[str], None] = 'e9b3d5a1c772'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def is_partitioned(bind: sa.Connection, table: str) -> bool:
+    """Check if the blocking value table is already partitioned."""
+    if bind.dialect.name == 'postgresql':
+        query = "SELECT relkind = 'p' FROM pg_class WHERE relname = :name"
+        name = table
+    else:
+        query = "SELECT COUNT(*) FROM sys.partition_schemes WHERE name = :name"
+        name = f'ps_{table}'
+    return bool(bind.execute(sa.text(query), {'name': name}).scalar())
+
+
+def convert(partitioned: bool) -> None:
+    """Convert the blocking value table to, or from, a partitioned table."""
+    bind = op.get_bind()
+    if not settings.blocking_partitioning or bind.dialect.name not in partitioning.DIALECTS:
+        return
+    # the table names include the DB_TABLE_PREFIX setting
+    table = models.BlockingValue.__tablename__
+    if is_partitioned(bind, table) == partitioned:
+        return
+    if bind.dialect.name == 'postgresql':
+        statements = partitioning.postgresql_convert(
+            table, models.Patient.__tablename__, partitioned
+        )
+    else:
+        pk_name = sa.inspect(bind).get_pk_constraint(table)['name']
+        statements = partitioning.mssql_convert(table, pk_name, partitioned)
+    for statement in statements:
+        op.execute(statement)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # NOTE: only applies when BLOCKING_PARTITIONING is enabled, on PostgreSQL and SQL Server
+    convert(partitioned=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    convert(partitioned=False)
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+"""
+scripts/backfill_features.py
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Script to populate the precomputed comparison features for all Patient records
+in the MPI that are missing them (e.g. records inserted before the features
+column was added).  The script can be safely interrupted and restarted.
+
+    - `./scripts/backfill_features.py --batch-size 5000`
+"""
+
+import argparse
+import sys
+
+from recordlinker import database
+from recordlinker.database import mpi_service as service
+
+
+def main() -> None:
+    """
+    Main entry point for the script.
+    """
+    parser = argparse.ArgumentParser(description="Backfill precomputed Patient features")
+    parser.add_argument(
+        "--batch-size", type=int, default=1000, help="The number of patients to update per batch"
+    )
+
+    args = parser.parse_args()
+
+    with database.get_session_manager() as session:
+        total = service.backfill_patient_features(session, batch_size=args.batch_size)
+    print(f"Backfilled features for {total} patients", file=sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
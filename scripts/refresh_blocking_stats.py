@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+"""
+scripts/refresh_blocking_stats.py
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Script to rebuild the blocking value statistics, used to plan blocking queries
+when `BLOCKING_STATS` or `MAX_BLOCKING_CANDIDATES` is set, and to flag stop values
+when `BLOCKING_STOP_VALUE_RATIO` is set.  The statistics aren't updated as records
+are linked, so unless `BLOCKING_STATS_REFRESH_INTERVAL` is set, the script should
+be run periodically (e.g. nightly, or after a large seeding job).
+
+    - `./scripts/refresh_blocking_stats.py --min-count 100`
+"""
+
+import argparse
+import sys
+
+from recordlinker import database
+from recordlinker.database import mpi_service as service
+
+
+def main() -> None:
+    """
+    Main entry point for the script.
+    """
+    parser = argparse.ArgumentParser(description="Refresh blocking value statistics")
+    parser.add_argument(
+        "--min-count",
+        type=int,
+        default=100,
+        help="The minimum number of patients sharing a value for it to be stored",
+    )
+
+    args = parser.parse_args()
+
+    with database.get_session_manager() as session:
+        total = service.refresh_blocking_stats(session, min_count=args.min_count)
+    print(f"Refreshed {total} blocking value statistics", file=sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
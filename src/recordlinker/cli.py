@@ -0,0 +1,578 @@
+"""
+recordlinker.cli
+~~~~~~~~~~~~~~~~
+
+This module contains the `recordlinker` command line interface, used to run
+record linkage directly against the database without the HTTP layer.
+
+    - `recordlinker link records.ndjson --output results.ndjson --batch-size 500`
+    - `recordlinker link records.csv --output results.ndjson --checkpoint link.ckpt`
+    - `recordlinker link records.ndjson --output results.ndjson --workers 16`
+    - `recordlinker load clusters.ndjson --output persons.ndjson --checkpoint load.ckpt`
+    - `recordlinker build-index --output /var/lib/recordlinker/blocking.idx`
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import itertools
+import json
+import os
+import pathlib
+import sys
+import typing
+
+import pydantic
+from sqlalchemy import orm
+
+from recordlinker import database
+from recordlinker import models
+from recordlinker import schemas
+from recordlinker.config import settings
+from recordlinker.database import algorithm_service
+from recordlinker.database import blocking_index
+from recordlinker.database import mpi_service
+from recordlinker.linking import compute
+from recordlinker.linking import indexer
+from recordlinker.linking import skip_values
+from recordlinker.linking.link import link_stream_chunk
+
+# Mapping of the flat CSV columns to the identifier types they represent
+CSV_IDENTIFIER_COLUMNS: dict[str, str] = {
+    "ssn": "SS",
+    "mrn": "MR",
+    "drivers_license": "DL",
+}
+
+# The per-process state of a link worker, populated by init_worker
+_WORKER: dict[str, typing.Any] = {}
+
+
+class CLIError(Exception):
+    """
+    Error raised when the command line arguments are invalid.
+    """
+
+    pass
+
+
+def csv_row_to_data(row: dict[str, str]) -> dict[str, typing.Any]:
+    """
+    Convert a flat CSV row into the nested PIIRecord data format.  The column
+    names are case-insensitive, and empty values are ignored.
+
+    :param row: The CSV row, keyed by column name
+    :returns: A dictionary that can be validated as a PIIRecord
+    """
+    row = {k.strip().lower(): v.strip() for k, v in row.items() if k and v and v.strip()}
+    data: dict[str, typing.Any] = {
+        "external_id": row.get("external_id"),
+        "birth_date": row.get("birth_date"),
+        "sex": row.get("sex"),
+    }
+    if "family" in row or "given" in row:
+        name: dict[str, typing.Any] = {"family": row.get("family", "")}
+        if "given" in row:
+            name["given"] = row["given"].split()
+        if "suffix" in row:
+            name["suffix"] = [row["suffix"]]
+        data["name"] = [name]
+    address: dict[str, typing.Any] = {
+        k: row[k] for k in ("city", "state", "postal_code", "county") if k in row
+    }
+    if "line" in row:
+        address["line"] = [row["line"]]
+    if address:
+        data["address"] = [address]
+    data["telecom"] = [{"value": row[k], "system": k} for k in ("phone", "email") if k in row]
+    if "race" in row:
+        data["race"] = [row["race"]]
+    data["identifiers"] = [
+        {"type": _type, "value": row[col]}
+        for col, _type in CSV_IDENTIFIER_COLUMNS.items()
+        if col in row
+    ]
+    return data
+
+
+def read_records(
+    fobj: typing.TextIO, fmt: str, start: int = 0
+) -> typing.Iterator[tuple[int, schemas.PIIRecord | str]]:
+    """
+    Read PIIRecords from an input file, yielding a tuple of the 1-based record
+    number and either the parsed record or the error message if it is invalid.
+
+    :param fobj: The input file object
+    :param fmt: The input format, either "ndjson" or "csv"
+    :param start: The number of records to skip, without parsing them
+    :returns: An iterator of (line, record or error) tuples
+    """
+    rows: typing.Iterable[typing.Any]
+    if fmt == "csv":
+        rows = csv.DictReader(fobj)
+    else:
+        rows = (line for line in fobj if line.strip())
+    for line, row in enumerate(itertools.islice(rows, start, None), start=start + 1):
+        try:
+            if isinstance(row, dict):
+                yield line, schemas.PIIRecord.model_validate(csv_row_to_data(row))
+            else:
+                yield line, schemas.PIIRecord.model_validate_json(row)
+        except pydantic.ValidationError as exc:
+            yield line, str(exc)
+
+
+def read_checkpoint(path: pathlib.Path | None) -> int:
+    """
+    Read the number of committed records from a checkpoint file, or 0 if the
+    checkpoint does not exist yet.
+    """
+    if path is None or not path.exists():
+        return 0
+    return int(path.read_text().strip() or 0)
+
+
+def write_checkpoint(path: pathlib.Path | None, offset: int) -> None:
+    """
+    Atomically write the number of committed records to a checkpoint file.
+    """
+    if path is None:
+        return
+    tmp = path.with_name(f"{path.name}.tmp")
+    tmp.write_text(str(offset))
+    os.replace(tmp, path)
+
+
+def run_link(
+    session: orm.Session,
+    algorithm: schemas.Algorithm,
+    records: typing.Iterable[tuple[int, schemas.PIIRecord | str]],
+    output: typing.TextIO,
+    batch_size: int = 1000,
+    checkpoint: pathlib.Path | None = None,
+) -> int:
+    """
+    Link all the records in batches.  Each batch is committed before its results
+    are written to the output and the checkpoint is advanced to the last record
+    in the batch, so an interrupted run can be resumed from the checkpoint.
+
+    A run that is interrupted after a commit, but before the checkpoint is written,
+    replays that batch when resumed.  So when there is a checkpoint, the records in
+    the first batch with an external_id that is already in the MPI are reported as
+    errors rather than linked again.  Records without an external_id are linked at
+    least once, and may be linked twice.
+
+    :param session: The database session
+    :param algorithm: The algorithm to link the records with
+    :param records: An iterable of (line, record or error) tuples
+    :param output: The file object to write the NDJSON results to
+    :param batch_size: The number of records to commit per batch
+    :param checkpoint: An optional path to the checkpoint file
+    :returns: The number of records processed
+    """
+    total = 0
+    iterator = iter(records)
+    while chunk := list(itertools.islice(iterator, batch_size)):
+        replay = checkpoint is not None and total == 0
+        for result in link_stream_chunk(session, algorithm, chunk, skip_existing=replay):
+            output.write(result.model_dump_json(exclude_none=True) + "\n")
+        output.flush()
+        write_checkpoint(checkpoint, chunk[-1][0])
+        total += len(chunk)
+    return total
+
+
+def read_clusters(
+    fobj: typing.TextIO, start: int = 0
+) -> typing.Iterator[tuple[int, schemas.Cluster | str]]:
+    """
+    Read Person clusters from an NDJSON input file, yielding a tuple of the 1-based
+    cluster number and either the parsed cluster or the error message if it is invalid.
+
+    :param fobj: The input file object
+    :param start: The number of clusters to skip, without parsing them
+    :returns: An iterator of (line, cluster or error) tuples
+    """
+    rows = (line for line in fobj if line.strip())
+    for line, row in enumerate(itertools.islice(rows, start, None), start=start + 1):
+        try:
+            yield line, schemas.Cluster.model_validate_json(row)
+        except pydantic.ValidationError as exc:
+            yield line, str(exc)
+
+
+def run_load(
+    session: orm.Session,
+    clusters: typing.Iterable[tuple[int, schemas.Cluster | str]],
+    output: typing.TextIO,
+    batch_size: int = 100,
+    checkpoint: pathlib.Path | None = None,
+) -> int:
+    """
+    Seed all the clusters in batches, using the fastest insert method supported by
+    the database (COPY on PostgreSQL).  Each batch is committed before the reference
+    ids are written to the output and the checkpoint is advanced.
+
+    :param session: The database session
+    :param clusters: An iterable of (line, cluster or error) tuples
+    :param output: The file object to write the NDJSON results to
+    :param batch_size: The number of clusters to commit per batch
+    :param checkpoint: An optional path to the checkpoint file
+    :returns: The number of clusters processed
+    """
+    total = 0
+    iterator = iter(clusters)
+    while chunk := list(itertools.islice(iterator, batch_size)):
+        valid = [(line, c) for line, c in chunk if isinstance(c, schemas.Cluster)]
+        persons = mpi_service.seed_clusters(session, [c for _, c in valid], commit=True)
+        results = dict(zip((line for line, _ in valid), persons))
+        for line, cluster in chunk:
+            if line in results:
+                row = {"line": line, "result": results[line].model_dump(mode="json")}
+            else:
+                row = {"line": line, "error": cluster}
+            output.write(json.dumps(row) + "\n")
+        output.flush()
+        write_checkpoint(checkpoint, chunk[-1][0])
+        total += len(chunk)
+    return total
+
+
+def init_worker(db_uri: str, algorithm: schemas.Algorithm) -> None:
+    """
+    Initialize a link worker process with its own database engine.
+    """
+    _WORKER["session_maker"] = database.create_sessionmaker(auto_migrate=False, db_uri=db_uri)
+    _WORKER["algorithm"] = algorithm
+
+
+def link_shard(
+    chunk: list[tuple[int, schemas.PIIRecord | str]], batch_size: int, replay: bool = False
+) -> list[tuple[int, str]]:
+    """
+    Link a shard of records in a worker process, committing every `batch_size`
+    records.  The results are returned as serialized JSON, to keep the cost of
+    sending them back to the parent process low.
+
+    :param chunk: A list of (line, record or error) tuples
+    :param batch_size: The number of records to commit per batch
+    :param replay: Whether the shard may have been committed by an interrupted run,
+      if so the records with an external_id already in the MPI are skipped
+    :returns: A list of (line, JSON result) tuples
+    """
+    results: list[tuple[int, str]] = []
+    with _WORKER["session_maker"]() as session:
+        for idx in range(0, len(chunk), batch_size):
+            batch = chunk[idx : idx + batch_size]
+            for result in link_stream_chunk(
+                session, _WORKER["algorithm"], batch, skip_existing=replay
+            ):
+                results.append((result.line, result.model_dump_json(exclude_none=True)))
+    return results
+
+
+def blocking_groups(
+    record: schemas.PIIRecord, algorithm: schemas.Algorithm
+) -> typing.Iterator[tuple[int, tuple[models.BlockingKey, ...], tuple[str, ...]]]:
+    """
+    Yield the groups of blocking values a record can be blocked with in any pass of
+    the algorithm.  A pass skips the keys a record has no values for, as long as
+    the log odds of the missing keys are within the allowed proportion (see
+    `BlockData._blocking_query`), so a group is yielded for every combination of
+    values of every subset of the pass keys the pass could run with.  Two records
+    that can block together in a pass always yield a group in common.
+
+    :param record: The record to block
+    :param algorithm: The algorithm the record is linked with
+    :returns: An iterator of (pass index, keys, values) tuples
+    """
+    context = algorithm.algorithm_context
+    record = skip_values.remove_skip_values(record, context.skip_values)
+    allowed = context.advanced.max_missing_allowed_proportion
+    for idx, algorithm_pass in enumerate(algorithm.passes):
+        key_odds = mpi_service.BlockData._ordered_odds(algorithm_pass.blocking_keys, context)
+        total_odds = sum(key_odds.values())
+        if total_odds == 0:
+            continue
+        values = {key: sorted(record.blocking_keys(key)) for key in key_odds}
+        present = [key for key in key_odds if values[key]]
+        for size in range(1, len(present) + 1):
+            for keys in itertools.combinations(present, size):
+                missing_odds = sum(odds for key, odds in key_odds.items() if key not in keys)
+                if missing_odds / total_odds > allowed:
+                    continue
+                for group in itertools.product(*(values[key] for key in keys)):
+                    yield idx, keys, group
+
+
+def shard_records(
+    chunk: list[tuple[int, schemas.PIIRecord | str]],
+    algorithm: schemas.Algorithm,
+    shards: int,
+) -> list[list[tuple[int, schemas.PIIRecord | str]]]:
+    """
+    Split the records into shards, so that records that can block together in any
+    pass of the algorithm, directly or through other records in the chunk, are
+    always in the same shard.  The connected components of the records are assigned
+    largest first to the shard with the fewest records, so the split only depends on
+    the records in the chunk.  Records that could not be parsed are their own
+    component, and each shard is kept in input order.
+
+    :param chunk: A list of (line, record or error) tuples
+    :param algorithm: The algorithm the records are linked with
+    :param shards: The number of shards to split the records into
+    :returns: A list of `shards` lists of (line, record or error) tuples
+    """
+    parent = list(range(len(chunk)))
+
+    def find(idx: int) -> int:
+        while parent[idx] != idx:
+            parent[idx] = parent[parent[idx]]
+            idx = parent[idx]
+        return idx
+
+    # The first record seen with each group of blocking values
+    seen: dict[tuple, int] = {}
+    for idx, (_, record) in enumerate(chunk):
+        if not isinstance(record, schemas.PIIRecord):
+            continue
+        for group in blocking_groups(record, algorithm):
+            parent[find(idx)] = find(seen.setdefault(group, idx))
+    components: dict[int, list[int]] = {}
+    for idx in range(len(chunk)):
+        components.setdefault(find(idx), []).append(idx)
+    result: list[list[int]] = [[] for _ in range(shards)]
+    for component in sorted(components.values(), key=lambda c: (-len(c), c[0])):
+        min(result, key=len).extend(component)
+    return [[chunk[idx] for idx in sorted(shard)] for shard in result]
+
+
+def run_link_parallel(
+    executor: concurrent.futures.Executor,
+    records: typing.Iterable[tuple[int, schemas.PIIRecord | str]],
+    output: typing.TextIO,
+    workers: int,
+    algorithm: schemas.Algorithm,
+    batch_size: int = 1000,
+    checkpoint: pathlib.Path | None = None,
+) -> int:
+    """
+    Link all the records using a pool of worker processes.  The records are read
+    in rounds of `batch_size * workers` records, and each round is split into one
+    shard per worker with `shard_records`, so records that could block together in
+    any pass, directly or through other records in the round, are linked in order
+    by the same worker.  The results of a round
+    are written in input order and the checkpoint is advanced once every shard in
+    the round has been committed.  As with `run_link`, when there is a checkpoint the
+    first round skips the records with an external_id that is already in the MPI.
+
+    :param executor: The pool of workers, initialized with `init_worker`
+    :param records: An iterable of (line, record or error) tuples
+    :param output: The file object to write the NDJSON results to
+    :param workers: The number of shards to split each round into
+    :param algorithm: The algorithm the workers link the records with
+    :param batch_size: The number of records each worker commits per batch
+    :param checkpoint: An optional path to the checkpoint file
+    :returns: The number of records processed
+    """
+    total = 0
+    iterator = iter(records)
+    while chunk := list(itertools.islice(iterator, batch_size * workers)):
+        shards = shard_records(chunk, algorithm, workers)
+        replay = checkpoint is not None and total == 0
+        futures = [
+            executor.submit(link_shard, shard, batch_size, replay) for shard in shards if shard
+        ]
+        results = sorted(itertools.chain.from_iterable(f.result() for f in futures))
+        for _, result in results:
+            output.write(result + "\n")
+        output.flush()
+        write_checkpoint(checkpoint, chunk[-1][0])
+        total += len(chunk)
+    return total
+
+
+def link_command(args: argparse.Namespace) -> None:
+    """
+    Run the `link` subcommand.
+    """
+    fmt = args.format or ("csv" if args.input.suffix.lower() == ".csv" else "ndjson")
+    if args.batch_size < 1:
+        raise CLIError("--batch-size must be a positive integer")
+    if args.workers < 1:
+        raise CLIError("--workers must be a positive integer")
+    if args.checkpoint is None and args.output.exists() and args.output.stat().st_size:
+        raise CLIError(f"{args.output} already exists, use --checkpoint to resume a run")
+
+    offset = read_checkpoint(args.checkpoint)
+    session = database.SessionMaker()
+    try:
+        algorithm = algorithm_service.get_cached_algorithm(session, args.algorithm)
+        if algorithm is None:
+            raise CLIError(f"No algorithm found: {args.algorithm or 'default'}")
+        if args.workers == 1:
+            with open(args.input, newline="") as infile, open(args.output, "a") as outfile:
+                total = run_link(
+                    session,
+                    algorithm,
+                    read_records(infile, fmt, start=offset),
+                    outfile,
+                    batch_size=args.batch_size,
+                    checkpoint=args.checkpoint,
+                )
+    finally:
+        session.close()
+    if args.workers > 1:
+        with (
+            concurrent.futures.ProcessPoolExecutor(
+                max_workers=args.workers,
+                initializer=init_worker,
+                initargs=(settings.db_uri, algorithm),
+            ) as executor,
+            open(args.input, newline="") as infile,
+            open(args.output, "a") as outfile,
+        ):
+            total = run_link_parallel(
+                executor,
+                read_records(infile, fmt, start=offset),
+                outfile,
+                args.workers,
+                algorithm,
+                batch_size=args.batch_size,
+                checkpoint=args.checkpoint,
+            )
+    print(f"Linked {total} records, starting after record {offset}", file=sys.stdout)
+
+
+def load_command(args: argparse.Namespace) -> None:
+    """
+    Run the `load` subcommand.
+    """
+    if args.batch_size < 1:
+        raise CLIError("--batch-size must be a positive integer")
+    if args.checkpoint is None and args.output.exists() and args.output.stat().st_size:
+        raise CLIError(f"{args.output} already exists, use --checkpoint to resume a run")
+
+    offset = read_checkpoint(args.checkpoint)
+    with (
+        database.SessionMaker() as session,
+        open(args.input) as infile,
+        open(args.output, "a") as outfile,
+    ):
+        total = run_load(
+            session,
+            read_clusters(infile, start=offset),
+            outfile,
+            batch_size=args.batch_size,
+            checkpoint=args.checkpoint,
+        )
+    print(f"Loaded {total} clusters, starting after cluster {offset}", file=sys.stdout)
+
+
+def build_index_command(args: argparse.Namespace) -> None:
+    """
+    Run the `build-index` subcommand.
+    """
+    output = args.output or settings.blocking_index_snapshot
+    if not output:
+        raise CLIError("--output is required when BLOCKING_INDEX_SNAPSHOT is not set")
+
+    with database.SessionMaker() as session:
+        # the processes that map the new snapshot no longer need the changes it includes
+        total = blocking_index.build_snapshot(session, str(output), prune=True)
+        session.commit()
+    print(f"Wrote {total} blocking values to {output}", file=sys.stdout)
+
+
+def parser() -> argparse.ArgumentParser:
+    """
+    Build the argument parser for the command line interface.
+    """
+    parser = argparse.ArgumentParser(prog="recordlinker", description="Record Linker tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    link_parser = subparsers.add_parser(
+        "link", help="Link a file of PII records against the MPI database"
+    )
+    link_parser.add_argument("input", type=pathlib.Path, help="The NDJSON or CSV input file")
+    link_parser.add_argument(
+        "--output", type=pathlib.Path, required=True, help="The NDJSON file to write results to"
+    )
+    link_parser.add_argument(
+        "--format",
+        choices=["ndjson", "csv"],
+        default=None,
+        help="The input format, defaults to the file extension",
+    )
+    link_parser.add_argument(
+        "--algorithm", default=None, help="The algorithm label, defaults to the default algorithm"
+    )
+    link_parser.add_argument(
+        "--batch-size", type=int, default=1000, help="The number of records to commit per batch"
+    )
+    link_parser.add_argument(
+        "--checkpoint",
+        type=pathlib.Path,
+        default=None,
+        help=(
+            "A file to record progress in, used to resume an interrupted run. Records are "
+            "linked at least once: on resume, records in the first batch with an external_id "
+            "already in the MPI are skipped, but records without one may be linked twice"
+        ),
+    )
+    link_parser.add_argument(
+        "--workers", type=int, default=1, help="The number of worker processes to link with"
+    )
+    link_parser.set_defaults(func=link_command)
+
+    load_parser = subparsers.add_parser(
+        "load", help="Seed a file of Person clusters into the MPI database"
+    )
+    load_parser.add_argument(
+        "input", type=pathlib.Path, help="The NDJSON input file, one cluster per line"
+    )
+    load_parser.add_argument(
+        "--output", type=pathlib.Path, required=True, help="The NDJSON file to write results to"
+    )
+    load_parser.add_argument(
+        "--batch-size", type=int, default=100, help="The number of clusters to commit per batch"
+    )
+    load_parser.add_argument(
+        "--checkpoint",
+        type=pathlib.Path,
+        default=None,
+        help="A file to record progress in, used to resume an interrupted run",
+    )
+    load_parser.set_defaults(func=load_command)
+
+    index_parser = subparsers.add_parser(
+        "build-index", help="Build the blocking index snapshot from the MPI database"
+    )
+    index_parser.add_argument(
+        "--output",
+        type=pathlib.Path,
+        default=None,
+        help="The snapshot file to write, defaults to the BLOCKING_INDEX_SNAPSHOT setting",
+    )
+    index_parser.set_defaults(func=build_index_command)
+    return parser
+
+
+def main(argv: typing.Sequence[str] | None = None) -> None:
+    """
+    Main entry point for the command line interface.
+    """
+    args = parser().parse_args(argv)
+    try:
+        args.func(args)
+    except CLIError as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        # flush the pending Patients and release the compute workers before exiting
+        indexer.stop_indexer()
+        compute.shutdown_executor()
+
+
+if __name__ == "__main__":
+    main()
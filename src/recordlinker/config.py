@@ -23,6 +23,14 @@ class Settings(pydantic_settings.BaseSettings):
     )
 
     db_uri: str = pydantic.Field(description="The URI for the MPI database")
+    async_db_uri: typing.Optional[str] = pydantic.Field(
+        description=(
+            "The URI for the MPI database using an async driver, e.g. "
+            "postgresql+asyncpg://... When set, the /link and /match endpoints use an "
+            "async database session, so waiting on the database doesn't hold a worker thread."
+        ),
+        default=None,
+    )
     db_table_prefix: str = pydantic.Field(
         description="The prefix for all database tables",
         default="",
@@ -61,6 +69,152 @@ class Settings(pydantic_settings.BaseSettings):
         ),
         default="assets/initial_algorithms.json",
     )
+    max_cluster_size: typing.Optional[int] = pydantic.Field(
+        description=(
+            "The maximum number of Patients in a Person cluster that are compared to an "
+            "incoming record in each pass. Larger clusters are truncated to the Patients "
+            "that matched the blocking query, then their most recently inserted Patients. "
+            "If unset, every Patient is compared."
+        ),
+        default=None,
+        gt=0,
+    )
+    blocking_stats: bool = pydantic.Field(
+        description=(
+            "Use the blocking value statistics to join the blocking values of each "
+            "pass in order of selectivity, most selective first."
+        ),
+        default=False,
+    )
+    max_blocking_candidates: typing.Optional[int] = pydantic.Field(
+        description=(
+            "The maximum estimated number of Patients a blocking pass can select, based "
+            "on the blocking value statistics. Passes estimated to select more are "
+            "skipped. If unset, no passes are skipped."
+        ),
+        default=None,
+        gt=0,
+    )
+    blocking_stop_value_ratio: typing.Optional[float] = pydantic.Field(
+        description=(
+            "Blocking values shared by more than this many times the average number of "
+            "Patients per value of their blocking key are stop values, and treated as "
+            "missing when blocking. If unset, there are no stop values."
+        ),
+        default=None,
+        gt=1,
+    )
+    blocking_stats_refresh_interval: typing.Optional[float] = pydantic.Field(
+        description=(
+            "The number of seconds between rebuilds of the blocking value statistics, "
+            "and stop values, by a background thread in the application. If unset, the "
+            "statistics are only rebuilt by scripts/refresh_blocking_stats.py."
+        ),
+        default=None,
+        gt=0,
+    )
+    blocking_index: bool = pydantic.Field(
+        description=(
+            "Keep an index of the blocking values in memory, in each application "
+            "process, and use it to find the candidates in the blocking step of linkage."
+        ),
+        default=False,
+    )
+    blocking_index_snapshot: typing.Optional[str] = pydantic.Field(
+        description=(
+            "The path of a snapshot file for the blocking index. The snapshot is memory "
+            "mapped, and shared by the application processes, rather than each loading the "
+            "index from the database. It's built on first use if it doesn't exist."
+        ),
+        default=None,
+    )
+    blocking_index_refresh_interval: float = pydantic.Field(
+        description=(
+            "The number of seconds between reads of the blocking values inserted since "
+            "the blocking index was loaded, including those inserted by other processes."
+        ),
+        default=1.0,
+        ge=0,
+    )
+    blocking_index_change_retention: float = pydantic.Field(
+        description=(
+            "The number of seconds the blocking value changes are kept in the change log "
+            "before they're pruned by `recordlinker build-index`. A process that hasn't "
+            "caught up with the log in this time reloads its blocking index, and the "
+            "changes missing from the log, as their transaction hasn't committed, are "
+            "waited on for half of this time."
+        ),
+        default=3600.0,
+        gt=0,
+    )
+    compute_executor: typing.Literal["none", "thread", "process"] = pydantic.Field(
+        description=(
+            "The executor the CPU bound scoring stage of linkage is dispatched to. "
+            "If 'none', scoring runs in the thread handling the request."
+        ),
+        default="none",
+    )
+    compute_pool_size: int = pydantic.Field(
+        description="The number of workers in the compute executor",
+        default=4,
+        gt=0,
+    )
+    compute_queue_depth: int = pydantic.Field(
+        description=(
+            "The number of scoring jobs that can wait for a free compute worker. "
+            "Requests beyond this are rejected with a 503 response."
+        ),
+        default=64,
+        ge=0,
+    )
+    blocking_storage: typing.Literal["value", "hash"] = pydantic.Field(
+        description=(
+            "The table blocking values are stored in. Either 'value', the blocking key "
+            "and value as written, or 'hash', a compact 64-bit hash of the key and value."
+        ),
+        default="value",
+    )
+    blocking_partitioning: bool = pydantic.Field(
+        description=(
+            "Partition the blocking value table by blocking key, on PostgreSQL and "
+            "SQL Server. This is applied when the tables are created or migrated."
+        ),
+        default=False,
+    )
+    deferred_indexing: bool = pydantic.Field(
+        description=(
+            "Write the blocking values of Patients inserted by the link endpoints in a "
+            "background worker, rather than before the link response is returned."
+        ),
+        default=False,
+    )
+    deferred_index_max_pending: int = pydantic.Field(
+        description=(
+            "The maximum number of Patients waiting on the background worker, once "
+            "reached the blocking values are written before the link response is returned"
+        ),
+        default=10000,
+        gt=0,
+    )
+    deferred_index_batch_size: int = pydantic.Field(
+        description="The number of pending Patients the background worker indexes per batch",
+        default=500,
+        gt=0,
+    )
+    deferred_index_interval: float = pydantic.Field(
+        description="The number of seconds the background worker waits between checks",
+        default=1.0,
+        gt=0,
+    )
+    algorithm_cache_ttl: float = pydantic.Field(
+        description=(
+            "The number of seconds a cached algorithm is used before checking the "
+            "database for a newer version. If the value is 0, the version is checked "
+            "on every request."
+        ),
+        default=5,
+        ge=0,
+    )
     api_root_path: str = pydantic.Field(
         description="The root path for the API",
         default="/api",
@@ -17,9 +17,11 @@ from sqlalchemy import func
 from sqlalchemy import inspect
 from sqlalchemy import orm
 from sqlalchemy import schema
+from sqlalchemy.ext import asyncio as sa_asyncio
 
 from recordlinker import models
 from recordlinker.config import settings
+from recordlinker.database import algorithm_service
 from recordlinker.utils.path import rel_path
 from recordlinker.utils.path import repo_root
 
@@ -47,16 +49,19 @@ def tables() -> set[schema.Table]:
     return tables
 
 
-def create_sessionmaker(auto_migrate: bool = True) -> orm.sessionmaker:
+def create_sessionmaker(
+    auto_migrate: bool = True, db_uri: typing.Optional[str] = None
+) -> orm.sessionmaker:
     """
-    Create a new sessionmaker for the database connection.
+    Create a new sessionmaker for the database connection, using the configured
+    `db_uri` unless another URI is given.
     """
     kwargs: dict[str, typing.Any] = {}
     if settings.connection_pool_size is not None:
         kwargs["pool_size"] = settings.connection_pool_size
     if settings.connection_pool_max_overflow is not None:
         kwargs["max_overflow"] = settings.connection_pool_max_overflow
-    engine = sa_engine.create_engine(settings.db_uri, **kwargs)
+    engine = sa_engine.create_engine(db_uri or settings.db_uri, **kwargs)
     if auto_migrate:
         repo: pathlib.Path | None = repo_root()
         if repo is None:
@@ -82,6 +87,24 @@ def create_sessionmaker(auto_migrate: bool = True) -> orm.sessionmaker:
     return orm.sessionmaker(bind=engine)
 
 
+def create_async_sessionmaker() -> typing.Optional[sa_asyncio.async_sessionmaker]:
+    """
+    Create a new async sessionmaker for the database connection, or None if
+    `async_db_uri` is not configured.  The tables are expected to have already
+    been created by `create_sessionmaker`.
+    """
+    if not settings.async_db_uri:
+        return None
+    kwargs: dict[str, typing.Any] = {}
+    if settings.connection_pool_size is not None:
+        kwargs["pool_size"] = settings.connection_pool_size
+    if settings.connection_pool_max_overflow is not None:
+        kwargs["max_overflow"] = settings.connection_pool_max_overflow
+    engine = sa_asyncio.create_async_engine(settings.async_db_uri, **kwargs)
+    # don't expire the objects on commit, as they can't be lazily refreshed afterwards
+    return sa_asyncio.async_sessionmaker(bind=engine, expire_on_commit=False)
+
+
 def get_session() -> typing.Iterator[orm.Session]:
     """
     Get a new session from the sessionmaker.
@@ -97,6 +120,20 @@ def get_session() -> typing.Iterator[orm.Session]:
             session.close()
 
 
+async def get_async_session() -> typing.AsyncIterator[sa_asyncio.AsyncSession]:
+    """
+    Get a new async session from the async sessionmaker.
+    """
+    assert AsyncSessionMaker is not None, "async_db_uri is not configured"
+    async with AsyncSessionMaker() as session:
+        try:
+            yield session
+            await session.commit()
+        except Exception as exc:
+            await session.rollback()
+            raise exc
+
+
 @contextlib.contextmanager
 def get_test_session() -> typing.Iterator[orm.Session]:
     """
@@ -112,7 +149,10 @@ def get_test_session() -> typing.Iterator[orm.Session]:
         # Tear down the session and drop the schema
         session.close()
         models.Base.metadata.drop_all(engine, tables=tables())
+        # the algorithms were dropped with the tables, so don't keep serving them
+        algorithm_service.clear_algorithm_cache()
 
 
 SessionMaker = create_sessionmaker(auto_migrate=settings.auto_migrate)
+AsyncSessionMaker = create_async_sessionmaker()
 get_session_manager = contextlib.contextmanager(get_session)
@@ -5,14 +5,36 @@ recordlinker.linking.algorithm_service
 This module provides the data access functions to the algorithm config tables
 """
 
+import dataclasses
+import threading
+import time
 import typing
 
 from sqlalchemy import delete
+from sqlalchemy import event
 from sqlalchemy import orm
 from sqlalchemy import select
 
 from recordlinker import models
 from recordlinker import schemas
+from recordlinker.config import settings
+
+
+@dataclasses.dataclass(frozen=True)
+class CachedAlgorithm:
+    """
+    A validated algorithm, along with the database version it was loaded from
+    and the last time that version was confirmed to be current.
+    """
+
+    algorithm: schemas.Algorithm
+    version: tuple[int, int] | None
+    checked_at: float
+
+
+# cached algorithms keyed by label, with None used for the default algorithm
+_CACHE: dict[str | None, CachedAlgorithm] = {}
+_LOCK = threading.Lock()
 
 
 def list_algorithms(session: orm.Session) -> typing.Sequence[models.Algorithm]:
@@ -56,6 +78,84 @@ def get_algorithm(session: orm.Session, label: str) -> models.Algorithm | None:
     return None
 
 
+def algorithm_version(session: orm.Session, label: str | None) -> tuple[int, int] | None:
+    """
+    Get the id and version of an algorithm, a cheap query used to check if a
+    cached algorithm is stale.
+
+    :param session: The database session
+    :param label: The algorithm label, or None for the default algorithm
+    :returns: the id and version of the algorithm, or None if not found
+    """
+    query = select(models.Algorithm.id, models.Algorithm.version)
+    if label:
+        query = query.where(models.Algorithm.label == label)
+    else:
+        query = query.where(models.Algorithm.is_default == True)  # noqa: E712
+    row = session.execute(query).first()
+    return (row[0], row[1]) if row else None
+
+
+def get_cached_algorithm(session: orm.Session, label: str | None) -> schemas.Algorithm | None:
+    """
+    Get a validated algorithm by its label, or the default algorithm if no label
+    is provided.  Algorithms are cached in memory, and within the ALGORITHM_CACHE_TTL
+    window are returned without querying the database.  After that window, the
+    version of the algorithm is checked and it is only reloaded if it has changed.
+
+    NOTE: The returned algorithm is shared across requests, don't modify it.
+
+    :param session: The database session
+    :param label: The algorithm label, or None for the default algorithm
+    :returns: the validated algorithm, or None if not found
+    """
+    now = time.monotonic()
+    cached = _CACHE.get(label)
+    if cached and now - cached.checked_at < settings.algorithm_cache_ttl:
+        return cached.algorithm
+    version = algorithm_version(session, label)
+    if cached and version is not None and version == cached.version:
+        _CACHE[label] = dataclasses.replace(cached, checked_at=now)
+        return cached.algorithm
+    obj = get_algorithm(session, label) if label else default_algorithm(session)
+    if obj is None:
+        return None
+    algorithm = schemas.Algorithm.model_validate(obj)
+    with _LOCK:
+        _CACHE[label] = CachedAlgorithm(algorithm, version, now)
+    return algorithm
+
+
+def clear_algorithm_cache() -> None:
+    """
+    Remove all the algorithms from the in-process cache.
+    """
+    with _LOCK:
+        _CACHE.clear()
+
+
+def _clear_algorithm_cache_on_commit(session: orm.Session) -> None:
+    """
+    Clear the algorithm cache once the session's transaction is committed.  Clearing
+    it any earlier would let a concurrent request re-cache the old algorithm, which
+    would then be served until the ALGORITHM_CACHE_TTL window ran out.
+
+    :param session: The database session that changed the algorithms
+    """
+    session.info["clear_algorithm_cache"] = True
+
+
+@event.listens_for(orm.Session, "after_commit")
+def _after_commit(session: orm.Session) -> None:
+    if session.info.pop("clear_algorithm_cache", False):
+        clear_algorithm_cache()
+
+
+@event.listens_for(orm.Session, "after_rollback")
+def _after_rollback(session: orm.Session) -> None:
+    session.info.pop("clear_algorithm_cache", None)
+
+
 def load_algorithm(
     session: orm.Session,
     data: schemas.Algorithm,
@@ -80,7 +180,10 @@ def load_algorithm(
         setattr(obj, key, value)
     if created:
         session.add(obj)
+    else:
+        obj.version = (obj.version or 0) + 1
     session.flush()
+    _clear_algorithm_cache_on_commit(session)
 
     if commit:
         session.commit()
@@ -96,6 +199,7 @@ def delete_algorithm(session: orm.Session, obj: models.Algorithm, commit: bool =
     :param commit: Commit the transaction
     """
     session.delete(obj)
+    _clear_algorithm_cache_on_commit(session)
     if commit:
         session.commit()
 
@@ -108,5 +212,6 @@ def clear_algorithms(session: orm.Session, commit: bool = False) -> None:
     :param commit: Commit the transaction
     """
     session.execute(delete(models.Algorithm))
+    _clear_algorithm_cache_on_commit(session)
     if commit:
         session.commit()
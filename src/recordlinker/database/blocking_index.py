@@ -0,0 +1,752 @@
+"""
+recordlinker.database.blocking_index
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+This module provides the optional in-memory blocking index, enabled with the
+`blocking_index` setting.  It maps the `blocking_hash` of every stored blocking
+value to a sorted array of the Patient ids that have it, so the blocking step of
+linkage is answered with set intersections in the app process, and the database
+is only queried to fetch the candidate Patients.
+
+The bulk of the index is a read-only snapshot file, built from the blocking
+table (see `build_snapshot` and the `recordlinker build-index` command), that is
+memory-mapped rather than read, so every application process on a host shares
+a single copy of it in the page cache.  On top of the snapshot each process
+keeps a small delta in memory:
+
+    - the current blocking values of the Patients inserted, updated or deleted
+      since the snapshot was built, by any process, read periodically from the
+      change log (see `models.BlockingChange`)
+    - the blocking values inserted and deleted by this process
+
+Without a snapshot file the whole index is loaded into the memory of each process.
+"""
+
+import array
+import bisect
+import datetime
+import heapq
+import itertools
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import typing
+
+from sqlalchemy import delete
+from sqlalchemy import engine
+from sqlalchemy import func
+from sqlalchemy import insert
+from sqlalchemy import orm
+from sqlalchemy import select
+from sqlalchemy.sql import expression
+
+from recordlinker import models
+from recordlinker.config import settings
+from recordlinker.utils.datetime import now_utc
+
+LOGGER = logging.getLogger(__name__)
+
+# The header of a snapshot file: the format version, the highest Patient id and
+# change log id loaded, the number of hashes, the number of Patient ids and the
+# number of change log gaps.  The header is followed by four arrays of 64-bit
+# integers, in native byte order, so they can be used in place: the Patient ids
+# of every posting, packed together; the sorted hashes; the offset of each hash's
+# posting in the Patient ids, with a final offset marking the end of the last
+# posting; and the first and last id of each gap, see `BlockingIndex.catch_up`.
+SNAPSHOT_MAGIC = b"RLBIDX04"
+SNAPSHOT_HEADER = struct.Struct("=8sqqQQQ")
+SNAPSHOT_ITEMSIZE = 8
+
+# The maximum number of Patient ids whose blocking values are read per query when
+# catching up, the ids are rendered inline
+CATCH_UP_BATCH = 10000
+
+
+def stored_hashes(
+    session: orm.Session, *where: expression.ColumnElement[bool]
+) -> typing.Iterator[tuple[int, int]]:
+    """
+    Yield the Patient id and blocking hash of the stored blocking values, read
+    from the table set by the `blocking_storage` setting.
+
+    :param session: The database session
+    :param where: Optional conditions on the `patient_id` column of the table
+    """
+    if settings.blocking_storage == "hash":
+        hash_query = select(models.BlockingHash.patient_id, models.BlockingHash.hash).where(*where)
+        for patient_id, hash_ in session.execute(hash_query).yield_per(10000):
+            yield patient_id, hash_
+        return
+    keys_by_id = {k.id: k for k in models.BlockingKey}
+    query = select(
+        models.BlockingValue.patient_id,
+        models.BlockingValue.blockingkey,
+        models.BlockingValue.value,
+    ).where(*where)
+    for patient_id, key_id, value in session.execute(query).yield_per(10000):
+        yield patient_id, models.blocking_hash(keys_by_id[key_id], value)
+
+
+def record_changes(session: orm.Session, patient_ids: typing.Iterable[int | None]) -> None:
+    """
+    Log that the blocking values of Patients were written, so the blocking index of
+    every process replaces their postings when it next catches up.  Nothing is
+    logged when the `blocking_index` setting is disabled, so it must be enabled in
+    every process that writes to the MPI.
+
+    :param session: The database session
+    :param patient_ids: The ids of the Patients, None marks that the MPI was reset
+    """
+    if not settings.blocking_index:
+        return
+    rows = [{"patient_id": patient_id} for patient_id in patient_ids]
+    if rows:
+        session.execute(insert(models.BlockingChange), rows)
+
+
+def last_change(session: orm.Session) -> int:
+    """
+    Return the id of the latest change in the change log, or 0 if it's empty.
+    """
+    return session.scalar(select(func.max(models.BlockingChange.id))) or 0
+
+
+def prune_changes(session: orm.Session, through: int, before: datetime.datetime) -> int:
+    """
+    Delete the changes up to and including an id, and written before a time, from
+    the change log.  The latest change is always kept, so the log is never empty
+    once written to.  A process whose index hasn't caught up to the deleted changes
+    yet reloads its index, see `BlockingIndex.stale`.
+
+    :param session: The database session
+    :param through: The id of the last change to delete
+    :param before: The time the deleted changes must be written before
+    :return: The number of changes deleted
+    """
+    column = models.BlockingChange.id
+    stmt = delete(models.BlockingChange).where(
+        column <= through,
+        column < select(func.max(column)).scalar_subquery(),
+        expression.or_(
+            models.BlockingChange.created_at.is_(None),
+            models.BlockingChange.created_at < before,
+        ),
+    )
+    result = typing.cast(engine.CursorResult, session.execute(stmt))
+    return result.rowcount
+
+
+def missing_ids(ids: typing.Iterable[int], after: int) -> list[tuple[int, int]]:
+    """
+    Return the first and last id of each range of ids missing from a set of ids,
+    from the one after an id to the highest of them.
+    """
+    ranges: list[tuple[int, int]] = []
+    previous = after
+    for id_ in sorted(ids):
+        if id_ > previous + 1:
+            ranges.append((previous + 1, id_ - 1))
+        previous = max(previous, id_)
+    return ranges
+
+
+def patient_id_column() -> typing.Any:
+    """
+    Return the `patient_id` column of the table set by the `blocking_storage` setting.
+    """
+    if settings.blocking_storage == "hash":
+        return models.BlockingHash.patient_id
+    return models.BlockingValue.patient_id
+
+
+class MappedSnapshot:
+    """
+    A read-only, memory-mapped blocking index snapshot file.  Lookups use binary
+    search over the mapped hashes, and return a view of the mapped Patient ids, so
+    nothing is copied into the memory of the process.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Map a snapshot file, see `BlockingIndex.save`.
+
+        :raises ValueError: If the file is not a blocking index snapshot
+        """
+        self.path = path
+        with open(path, "rb") as fobj:
+            size = os.fstat(fobj.fileno()).st_size
+            if size < SNAPSHOT_HEADER.size:
+                raise ValueError(f"invalid blocking index snapshot: {path}")
+            self._mmap = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.watermark, self.change_watermark, hashes, ids, gaps = (
+            SNAPSHOT_HEADER.unpack_from(self._mmap)
+        )
+        if magic != SNAPSHOT_MAGIC or size != SNAPSHOT_HEADER.size + SNAPSHOT_ITEMSIZE * (
+            ids + 2 * hashes + 1 + 2 * gaps
+        ):
+            raise ValueError(f"invalid blocking index snapshot: {path}")
+        view = memoryview(self._mmap)
+        offset = SNAPSHOT_HEADER.size
+        self.ids = view[offset : offset + ids * SNAPSHOT_ITEMSIZE].cast("q")
+        offset += ids * SNAPSHOT_ITEMSIZE
+        self.hashes = view[offset : offset + hashes * SNAPSHOT_ITEMSIZE].cast("q")
+        offset += hashes * SNAPSHOT_ITEMSIZE
+        self.offsets = view[offset : offset + (hashes + 1) * SNAPSHOT_ITEMSIZE].cast("q")
+        offset += (hashes + 1) * SNAPSHOT_ITEMSIZE
+        bounds = view[offset:].cast("q")
+        self.gaps: list[tuple[int, int]] = list(zip(bounds[::2], bounds[1::2]))
+
+    def __len__(self) -> int:
+        """
+        Return the number of distinct blocking hashes in the snapshot.
+        """
+        return len(self.hashes)
+
+    @property
+    def size(self) -> int:
+        """
+        Return the size of the mapped file in bytes.
+        """
+        return len(self._mmap)
+
+    def get(self, hash_: int) -> memoryview | None:
+        """
+        Return the sorted Patient ids with a blocking hash, or None if there are none.
+        """
+        idx = bisect.bisect_left(self.hashes, hash_)
+        if idx == len(self.hashes) or self.hashes[idx] != hash_:
+            return None
+        return self.ids[self.offsets[idx] : self.offsets[idx + 1]]
+
+
+class BlockingIndex:
+    """
+    An inverted index of blocking hashes to the sorted ids of the Patients that
+    have them.  The ids are stored in compact arrays of 64-bit integers, rather
+    than Python sets, and lookups use binary search.  All access is synchronized,
+    as the sync routes are served from a thread pool.
+
+    The index is either loaded entirely into memory, or is a mapped snapshot plus
+    an in-memory delta.  Neither is changed when a Patient is removed, e.g. when
+    it's updated or deleted, instead the Patient is recorded as removed and its
+    postings there are ignored; if it's added again its current postings are kept
+    apart, with its hashes, so they can be replaced by the next change.
+    """
+
+    def __init__(self, snapshot: MappedSnapshot | None = None) -> None:
+        self._snapshot = snapshot
+        self._postings: dict[int, array.array] = {}
+        self._removed: set[int] = set()
+        # The current postings of the removed Patients, and their hashes
+        self._changed: dict[int, array.array] = {}
+        self._changed_hashes: dict[int, list[int]] = {}
+        # The hashes of the new Patients added by this process, until their change
+        # is read from the log
+        self._added: dict[int, list[int]] = {}
+        self._lock = threading.RLock()
+        # The highest Patient id loaded from the database
+        self.watermark: int = snapshot.watermark if snapshot is not None else 0
+        # The highest change log id read from the database, and the ranges of the
+        # lower ids that weren't committed when it was read, with the monotonic
+        # time they were found
+        self.change_watermark: int = snapshot.change_watermark if snapshot is not None else 0
+        now = time.monotonic()
+        self._gaps: list[tuple[int, int, float]] = [
+            (first, last, now) for first, last in (snapshot.gaps if snapshot is not None else ())
+        ]
+        # The monotonic time of the last catch up with the database
+        self.refreshed: float = 0.0
+
+    def __len__(self) -> int:
+        """
+        Return the number of distinct blocking hashes in the index.
+        """
+        with self._lock:
+            snapshot = self._snapshot
+            count = len(snapshot) if snapshot is not None else 0
+            for postings in (self._postings, self._changed):
+                count += sum(
+                    1
+                    for h in postings
+                    if (snapshot is None or snapshot.get(h) is None)
+                    and (postings is self._postings or h not in self._postings)
+                )
+            return count
+
+    @staticmethod
+    def _contains(ids: typing.Sequence[int], patient_id: int) -> bool:
+        """
+        Check if a sorted array of Patient ids contains the given id.
+        """
+        idx = bisect.bisect_left(ids, patient_id)
+        return idx < len(ids) and ids[idx] == patient_id
+
+    @staticmethod
+    def _discard(postings: dict[int, array.array], patient_id: int, hash_: int) -> None:
+        """
+        Remove a Patient id from the sorted postings of a blocking hash.
+        """
+        ids = postings.get(hash_)
+        if ids is None:
+            return
+        idx = bisect.bisect_left(ids, patient_id)
+        if idx < len(ids) and ids[idx] == patient_id:
+            del ids[idx]
+        if not ids:
+            del postings[hash_]
+
+    @classmethod
+    def _insert(cls, postings: dict[int, array.array], patient_id: int, hash_: int) -> None:
+        """
+        Insert a Patient id into the sorted postings of a blocking hash.
+        """
+        ids = postings.setdefault(hash_, array.array("q"))
+        if not ids or patient_id > ids[-1]:
+            # Patient ids are mostly added in increasing order
+            ids.append(patient_id)
+        elif not cls._contains(ids, patient_id):
+            ids.insert(bisect.bisect_left(ids, patient_id), patient_id)
+
+    def add(self, patient_id: int, hashes: typing.Iterable[int]) -> None:
+        """
+        Add a Patient to the postings of its blocking hashes.  If the Patient was
+        removed, the hashes replace those it was last added with, so they must be
+        all of its hashes.  Otherwise the hashes are kept until the change that
+        added them is read from the log, see `catch_up`.
+        """
+        with self._lock:
+            if patient_id not in self._removed:
+                hashes = list(hashes)
+                self._added.setdefault(patient_id, []).extend(hashes)
+            self._add(patient_id, hashes)
+
+    def _add(self, patient_id: int, hashes: typing.Iterable[int]) -> None:
+        """
+        Add a Patient to the postings of its blocking hashes, see `add`.
+        """
+        if patient_id in self._removed:
+            self.remove(patient_id)
+            hashes = self._changed_hashes[patient_id] = list(hashes)
+            for hash_ in hashes:
+                self._insert(self._changed, patient_id, hash_)
+            return
+        for hash_ in hashes:
+            self._insert(self._postings, patient_id, hash_)
+
+    def remove(self, patient_id: int) -> None:
+        """
+        Remove a Patient from the postings of all its blocking hashes.
+        """
+        with self._lock:
+            self._removed.add(patient_id)
+            for hash_ in self._changed_hashes.pop(patient_id, ()):
+                self._discard(self._changed, patient_id, hash_)
+
+    def clear(self) -> None:
+        """
+        Remove all the postings from the index, including the snapshot.
+        """
+        with self._lock:
+            self._snapshot = None
+            self._postings.clear()
+            self._removed.clear()
+            self._changed.clear()
+            self._changed_hashes.clear()
+            self._added.clear()
+            self.watermark = 0
+
+    def _lookup(self, hashes: typing.Iterable[int]) -> list[tuple[typing.Sequence[int], bool]]:
+        """
+        Return the postings of the blocking hashes, and whether each one needs the
+        removed Patients to be ignored.
+        """
+        postings: list[tuple[typing.Sequence[int], bool]] = []
+        for hash_ in hashes:
+            if hash_ in self._postings:
+                postings.append((self._postings[hash_], True))
+            if self._snapshot is not None and (ids := self._snapshot.get(hash_)) is not None:
+                postings.append((ids, True))
+            if hash_ in self._changed:
+                postings.append((self._changed[hash_], False))
+        return postings
+
+    def candidates(self, lookups: typing.Iterable[typing.Sequence[int]]) -> set[int]:
+        """
+        Return the ids of the Patients that have at least one of the blocking hashes
+        in every lookup.  The lookup with the fewest Patients is expanded first, and
+        the remaining lookups are only used to check membership.
+
+        :param lookups: The blocking hashes of each blocking key
+        :return: The matching Patient ids
+        """
+        with self._lock:
+            removed = self._removed
+            postings = [self._lookup(hashes) for hashes in lookups]
+            if not postings:
+                return set()
+            postings.sort(key=lambda arrays: sum(len(ids) for ids, _ in arrays))
+            result: set[int] = set()
+            for ids, filtered in postings[0]:
+                if filtered and removed:
+                    result.update(p for p in ids if p not in removed)
+                else:
+                    result.update(ids)
+            for arrays in postings[1:]:
+                result = {
+                    p
+                    for p in result
+                    if any(
+                        self._contains(ids, p) and not (filtered and p in removed)
+                        for ids, filtered in arrays
+                    )
+                }
+                if not result:
+                    break
+            return result
+
+    @staticmethod
+    def _pending_changes(session: orm.Session, change_watermark: int) -> list[tuple[int, int]]:
+        """
+        Return the ranges of the change log ids, up to the watermark, that are missing
+        from the log, as their transaction hasn't committed yet.  Only the gaps
+        between the changes written in the last half of the `blocking_index_change_retention`
+        are returned, older gaps are assumed to be rolled back.
+        """
+        cutoff = now_utc() - datetime.timedelta(
+            seconds=settings.blocking_index_change_retention / 2
+        )
+        query = (
+            select(models.BlockingChange.id)
+            .where(
+                models.BlockingChange.id <= change_watermark,
+                models.BlockingChange.created_at >= cutoff,
+            )
+            .order_by(models.BlockingChange.id)
+        )
+        ids = list(session.scalars(query))
+        return missing_ids(ids[1:], ids[0]) if ids else []
+
+    def load(self, session: orm.Session) -> int:
+        """
+        Load the index into memory from all the stored blocking values.
+
+        :param session: The database session
+        :return: The number of blocking values loaded
+        """
+        # read the change log first, so no change made while loading is missed
+        change_watermark = last_change(session)
+        gaps = self._pending_changes(session, change_watermark)
+        postings: dict[int, array.array] = {}
+        watermark: int = 0
+        count: int = 0
+        for patient_id, hash_ in stored_hashes(session):
+            postings.setdefault(hash_, array.array("q")).append(patient_id)
+            watermark = max(watermark, patient_id)
+            count += 1
+        for hash_, ids in postings.items():
+            # the rows aren't read in order, as sorting the whole table is expensive
+            postings[hash_] = array.array("q", sorted(set(ids)))
+        now = time.monotonic()
+        with self._lock:
+            self._snapshot = None
+            self._postings = postings
+            self._removed = set()
+            self._changed = {}
+            self._changed_hashes = {}
+            self._added = {}
+            self.watermark = watermark
+            self.change_watermark = change_watermark
+            self._gaps = [(first, last, now) for first, last in gaps]
+            self.refreshed = now
+        LOGGER.info("loaded blocking index", extra={"count": count, **self.memory_usage()})
+        return count
+
+    @staticmethod
+    def _pruned(first: int | None, change_watermark: int, gaps: typing.Iterable[int]) -> bool:
+        """
+        Check if changes after a watermark, or in the gaps starting at the given ids,
+        could have been pruned from a change log starting at the first id.
+        """
+        if first is None:
+            return False
+        return first > change_watermark + 1 or any(g < first for g in gaps)
+
+    def stale(self, session: orm.Session) -> bool:
+        """
+        Check if changes the index hasn't caught up to were pruned from the change
+        log, see `prune_changes`, in which case the index needs to be reloaded.
+        """
+        first = session.scalar(select(func.min(models.BlockingChange.id)))
+        return self._pruned(first, self.change_watermark, (g for g, _, _ in self._gaps))
+
+    def _reload(self, session: orm.Session) -> None:
+        """
+        Reload the index, mapping the snapshot file again if it has been rebuilt
+        since it was mapped, otherwise loading the index into memory.
+        """
+        if self._snapshot is not None and os.path.exists(self._snapshot.path):
+            snapshot = MappedSnapshot(self._snapshot.path)
+            first = session.scalar(select(func.min(models.BlockingChange.id)))
+            gaps = (g for g, _ in snapshot.gaps)
+            if not self._pruned(first, snapshot.change_watermark, gaps):
+                now = time.monotonic()
+                with self._lock:
+                    self._snapshot = snapshot
+                    self._postings = {}
+                    self._removed = set()
+                    self._changed = {}
+                    self._changed_hashes = {}
+                    self._added = {}
+                    self.watermark = snapshot.watermark
+                    self.change_watermark = snapshot.change_watermark
+                    self._gaps = [(first, last, now) for first, last in snapshot.gaps]
+                return
+        self.load(session)
+
+    def _fill_gaps(self, ids: typing.Sequence[int], now: float) -> list[tuple[int, int, float]]:
+        """
+        Return the gaps in the change log after reading the changes with the given
+        ids, sorted: the known gaps are split around the ids read in them, new gaps
+        are added below the highest id, and gaps older than half the
+        `blocking_index_change_retention` are dropped, as rolled back.
+        """
+        ids = sorted(ids)
+        gaps: list[tuple[int, int, float]] = []
+        for first, last, found in self._gaps:
+            start = first
+            for id_ in ids[bisect.bisect_left(ids, first) : bisect.bisect_right(ids, last)]:
+                if id_ > start:
+                    gaps.append((start, id_ - 1, found))
+                start = id_ + 1
+            if start <= last:
+                gaps.append((start, last, found))
+        gaps.extend((first, last, now) for first, last in missing_ids(ids, self.change_watermark))
+        expired = now - settings.blocking_index_change_retention / 2
+        if dropped := sum(1 for _, _, found in gaps if found < expired):
+            LOGGER.info("blocking index change gaps expired", extra={"count": dropped})
+        return sorted(g for g in gaps if g[2] >= expired)
+
+    def catch_up(self, session: orm.Session) -> int:
+        """
+        Replace the postings of the Patients whose blocking values were written since
+        the index was loaded, by any process, with their current blocking values.
+
+        The change log is read in id order, but an id is assigned when a change is
+        written, and a transaction can commit after changes with higher ids, e.g. a
+        large batch of inserts.  So the ids missing below the highest one read are
+        kept as gaps, and read again on each catch up, until they are committed or
+        they expire.
+
+        :param session: The database session
+        :return: The number of blocking values read
+        """
+        if self.stale(session):
+            LOGGER.warning("blocking index changes were pruned, reloading the index")
+            self._reload(session)
+        column = models.BlockingChange.id
+        query = select(column, models.BlockingChange.patient_id).where(
+            expression.or_(
+                column > self.change_watermark,
+                *(column.between(first, last) for first, last, _ in self._gaps),
+            )
+        )
+        changes = session.execute(query).all()
+        if any(patient_id is None for _, patient_id in changes):
+            # the MPI was reset, so none of the postings are current
+            LOGGER.info("blocking index reset, reloading the index")
+            return self.load(session)
+        changed: dict[int, list[int]] = {p: [] for _, p in changes if p is not None}
+        patient_ids = list(changed)
+        for idx in range(0, len(patient_ids), CATCH_UP_BATCH):
+            # render the ids inline, as there can be more than the driver's parameter limit
+            batch = patient_ids[idx : idx + CATCH_UP_BATCH]
+            clause = patient_id_column().in_(
+                expression.bindparam(None, batch, expanding=True, literal_execute=True)
+            )
+            for patient_id, hash_ in stored_hashes(session, clause):
+                changed[patient_id].append(hash_)
+        now = time.monotonic()
+        with self._lock:
+            for patient_id, hashes in changed.items():
+                if (added := self._added.pop(patient_id, None)) is not None:
+                    # replace the postings this process added the new Patient with
+                    for hash_ in added:
+                        self._discard(self._postings, patient_id, hash_)
+                elif patient_id <= self.watermark:
+                    # the Patient may already be loaded, so its postings are replaced
+                    self.remove(patient_id)
+                self._add(patient_id, hashes)
+            self.watermark = max([self.watermark, *changed])
+            self._gaps = self._fill_gaps([c for c, _ in changes], now)
+            self.change_watermark = max([self.change_watermark, *(c for c, _ in changes)])
+            self.refreshed = now
+        return sum(len(h) for h in changed.values())
+
+    def refresh(self, session: orm.Session, interval: float) -> None:
+        """
+        Catch up with the database, if it's been more than interval seconds since
+        the last time.
+        """
+        if time.monotonic() - self.refreshed >= interval:
+            self.catch_up(session)
+
+    def memory_usage(self) -> dict[str, int]:
+        """
+        Return the number of hashes and Patient ids in the index, an estimate of
+        the bytes used to store them in the memory of this process, and the bytes
+        of the mapped snapshot, which are shared with other processes.
+        """
+        with self._lock:
+            snapshot = self._snapshot
+            delta = (self._postings, self._changed)
+            return {
+                "hashes": len(self),
+                "postings": sum(len(ids) for d in delta for ids in d.values())
+                + (len(snapshot.ids) if snapshot is not None else 0),
+                "bytes": sum(
+                    sys.getsizeof(d) + sum(sys.getsizeof(ids) for ids in d.values()) for d in delta
+                )
+                + sys.getsizeof(self._changed_hashes)
+                + sys.getsizeof(self._removed),
+                "mapped_bytes": snapshot.size if snapshot is not None else 0,
+            }
+
+    def _merged(self) -> typing.Iterator[tuple[int, typing.Sequence[int]]]:
+        """
+        Yield the blocking hashes of the index, in order, and their sorted Patient
+        ids, merging the snapshot and the delta.
+        """
+        snapshot = self._snapshot
+        hashes: list[typing.Iterable[int]] = [sorted(self._postings.keys() | self._changed.keys())]
+        if snapshot is not None:
+            hashes.append(snapshot.hashes)
+        previous: int | None = None
+        for hash_ in heapq.merge(*hashes):
+            if hash_ == previous:
+                # a hash in both the snapshot and the delta, already merged
+                continue
+            previous = hash_
+            base = itertools.chain(
+                self._postings.get(hash_, ()),
+                (snapshot.get(hash_) or ()) if snapshot is not None else (),
+            )
+            ids = {p for p in base if p not in self._removed}
+            ids.update(self._changed.get(hash_, ()))
+            if ids:
+                yield hash_, sorted(ids)
+
+    def save(self, path: str) -> None:
+        """
+        Write a snapshot of the index to a file, see `SNAPSHOT_HEADER`.  The file is
+        written to a temporary path and renamed, so a reader never sees a partial
+        snapshot, and the processes that have mapped the old file aren't affected.
+        """
+        tmp = f"{path}.{os.getpid()}.tmp"
+        hashes = array.array("q")
+        offsets = array.array("q", [0])
+        with self._lock, open(tmp, "wb") as fobj:
+            fobj.write(b"\0" * SNAPSHOT_HEADER.size)
+            for hash_, ids in self._merged():
+                array.array("q", ids).tofile(fobj)
+                hashes.append(hash_)
+                offsets.append(offsets[-1] + len(ids))
+            hashes.tofile(fobj)
+            offsets.tofile(fobj)
+            array.array("q", [b for first, last, _ in self._gaps for b in (first, last)]).tofile(
+                fobj
+            )
+            fobj.seek(0)
+            fobj.write(
+                SNAPSHOT_HEADER.pack(
+                    SNAPSHOT_MAGIC,
+                    self.watermark,
+                    self.change_watermark,
+                    len(hashes),
+                    offsets[-1],
+                    len(self._gaps),
+                )
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def from_snapshot(cls, path: str) -> "BlockingIndex":
+        """
+        Map an index from a snapshot file, see `save`.
+
+        :raises ValueError: If the file is not a blocking index snapshot
+        """
+        return cls(MappedSnapshot(path))
+
+
+def build_snapshot(session: orm.Session, path: str, prune: bool = False) -> int:
+    """
+    Build a blocking index snapshot file from all the stored blocking values.
+
+    :param session: The database session
+    :param path: The path of the snapshot file, replaced if it exists
+    :param prune: Whether to delete the changes the snapshot includes from the change
+      log, once they are older than the `blocking_index_change_retention`, so the
+      processes that haven't caught up to them yet can still read them.  The caller
+      must commit the session
+    :return: The number of blocking values in the snapshot
+    """
+    index = BlockingIndex()
+    count = index.load(session)
+    index.save(path)
+    if prune:
+        # keep the changes from the first gap, as they may be committed later
+        through = min([index.change_watermark, *(first - 1 for first, _, _ in index._gaps)])
+        before = now_utc() - datetime.timedelta(seconds=settings.blocking_index_change_retention)
+        prune_changes(session, through, before)
+    return count
+
+
+_INDEX: BlockingIndex | None = None
+_LOCK = threading.Lock()
+
+
+def current() -> BlockingIndex | None:
+    """
+    Return the blocking index, if it has been loaded.
+    """
+    return _INDEX
+
+
+def get_index(session: orm.Session) -> BlockingIndex | None:
+    """
+    Get the blocking index, loading it on first use, and catching up with the
+    database if the `blocking_index_refresh_interval` has passed.  The index is
+    mapped from the `blocking_index_snapshot` file, which is built first if it
+    doesn't exist; without the setting it's loaded into memory from the blocking
+    table.  Returns None when the `blocking_index` setting is disabled.
+    """
+    global _INDEX
+    if not settings.blocking_index:
+        return None
+    with _LOCK:
+        if _INDEX is None:
+            path = settings.blocking_index_snapshot
+            if path:
+                if not os.path.exists(path):
+                    build_snapshot(session, path)
+                index = BlockingIndex.from_snapshot(path)
+                LOGGER.info("mapped blocking index snapshot", extra=index.memory_usage())
+            else:
+                index = BlockingIndex()
+                index.load(session)
+            _INDEX = index
+    _INDEX.refresh(session, settings.blocking_index_refresh_interval)
+    return _INDEX
+
+
+def reset_index() -> None:
+    """
+    Discard the blocking index, it will be loaded again on next use.
+    """
+    global _INDEX
+    with _LOCK:
+        _INDEX = None
@@ -5,28 +5,94 @@ recordlinker.linking.mpi_service
 This module provides the data access functions to the MPI tables
 """
 
+import contextlib
+import datetime
+import io
 import itertools
+import json
 import logging
 import math
 import random
+import time
 import typing
 import uuid
 
 from sqlalchemy import bindparam
+from sqlalchemy import event
 from sqlalchemy import exists
+from sqlalchemy import func
 from sqlalchemy import insert
 from sqlalchemy import literal
 from sqlalchemy import orm
 from sqlalchemy import select
+from sqlalchemy import text
+from sqlalchemy import types as sqltypes
+from sqlalchemy import update
+from sqlalchemy.ext import asyncio as sa_asyncio
 from sqlalchemy.sql import expression
 
 from recordlinker import models
 from recordlinker import schemas
+from recordlinker.config import settings
+from recordlinker.utils.datetime import now_utc
 
+from . import blocking_index
 from . import get_random_function
 
 LOGGER = logging.getLogger(__name__)
 
+# A blocking value as stored in the database, see BlockData._token
+BlockingToken = str | int
+
+# The number of pending Patients last counted by this process, plus the Patients
+# it has deferred since, and when they were counted, see count_pending_patients
+_PENDING_COUNT: int = 0
+_PENDING_COUNTED: float = -math.inf
+
+# The minimum number of rows before insert_blocking_values switches to COPY on
+# PostgreSQL, below this the overhead of building the COPY stream isn't worth it
+COPY_MIN_ROWS = 1000
+
+
+class BlockingEstimates(typing.NamedTuple):
+    """
+    The statistics of the blocking values of an incoming record, used to plan
+    the blocking queries, see `BlockData._estimated_counts`.
+    """
+
+    # The estimated number of Patients sharing the record's values, by key
+    counts: dict[models.BlockingKey, int]
+    # The blocking hashes of the record's values that are stop values
+    stop_values: set[int]
+
+
+@contextlib.contextmanager
+def _timed_sql(session: orm.Session, profile: schemas.PassProfile | None) -> typing.Iterator[None]:
+    """
+    Add the time spent executing SQL statements on the session's connection, while
+    the context is active, to the `sql_seconds` of a pass profile.  Does nothing
+    when no profile is given.
+    """
+    if profile is None:
+        yield
+        return
+    connection = session.connection()
+    started: list[float] = []
+
+    def before(*args: typing.Any) -> None:
+        started.append(time.perf_counter())
+
+    def after(*args: typing.Any) -> None:
+        profile.sql_seconds += time.perf_counter() - started.pop()
+
+    event.listen(connection, "before_cursor_execute", before)
+    event.listen(connection, "after_cursor_execute", after)
+    try:
+        yield
+    finally:
+        event.remove(connection, "before_cursor_execute", before)
+        event.remove(connection, "after_cursor_execute", after)
+
 
 class BlockData:
     @classmethod
@@ -71,7 +137,9 @@ class BlockData:
 
     @classmethod
     def _filter_incorrect_match(
-        cls, patient: models.Patient, blocking_values: dict[models.BlockingKey, list[str]]
+        cls,
+        patient_values: dict[models.BlockingKey, set[BlockingToken]],
+        blocking_values: dict[models.BlockingKey, list[BlockingToken]],
     ) -> bool:
         """
         Filter out patient records that have conflicting blocking values with the incoming
@@ -79,12 +147,11 @@ class BlockData:
         however when both records have values, verify that there is overlap between
         the values.  Return False if the records are not in agreement.
 
-        :param patient: models.Patient
+        :param patient_values: The stored blocking values of the patient, by key
         :param blocking_values: dict
         :return: bool
         """
         agree_count: int = 0
-        mpi_record: schemas.PIIRecord = schemas.PIIRecord.from_patient(patient)
         for key, incoming_vals in blocking_values.items():
             if not incoming_vals:
                 # The incoming record has no value for this blocking key, thus there
@@ -92,8 +159,8 @@ class BlockData:
                 # the two records are still in agreement and continue
                 agree_count += 1
                 continue
-            # Calculate the blocking values for the patient
-            patient_vals = mpi_record.blocking_keys(key)
+            # Get the stored blocking values for the patient
+            patient_vals = patient_values.get(key)
             if not patient_vals:
                 # The patient record has no value for this blocking key, thus there
                 # is no reason to compare.  We can increment the counter to indicate
@@ -111,51 +178,314 @@ class BlockData:
         return agree_count == len(blocking_values)
 
     @classmethod
-    def get(
+    def _token(cls, key: models.BlockingKey, value: str) -> BlockingToken:
+        """
+        Return the form a blocking value is stored in, either the value itself or
+        its hash, depending on the `blocking_storage` setting.
+        """
+        if settings.blocking_storage == "hash":
+            return models.blocking_hash(key, value)
+        return value
+
+    @classmethod
+    def _estimated_counts(
         cls,
         session: orm.Session,
         record: schemas.PIIRecord,
+        keys: typing.Iterable[models.BlockingKey],
+    ) -> BlockingEstimates:
+        """
+        Estimate the number of Patients that share the blocking values of the record,
+        for each blocking key, using the BlockingStat table.  Values without a
+        statistic are rare, and counted as 0.  Stop values, see
+        `refresh_blocking_stats`, are treated as missing and not counted.
+
+        :param session: The database session
+        :param record: The PIIRecord to match
+        :param keys: The BlockingKeys to estimate counts for
+        :return: The estimated number of Patients, by key, and the stop values
+        """
+        result = BlockingEstimates(counts={}, stop_values=set())
+        hashes: dict[int, models.BlockingKey] = {}
+        for key in keys:
+            result.counts[key] = 0
+            for value in record.blocking_keys(key):
+                hashes[models.blocking_hash(key, value)] = key
+        if hashes:
+            query = select(
+                models.BlockingStat.hash, models.BlockingStat.count, models.BlockingStat.stop
+            ).where(models.BlockingStat.hash.in_(list(hashes)))
+            for hash_, count, stop in session.execute(query):
+                if stop:
+                    result.stop_values.add(hash_)
+                else:
+                    result.counts[hashes[hash_]] += count
+        return result
+
+    @classmethod
+    def _stored_blocking_values(
+        cls,
+        session: orm.Session,
+        patient_ids: expression.Select,
+        keys: typing.Iterable[models.BlockingKey],
+    ) -> dict[int, dict[models.BlockingKey, set[BlockingToken]]]:
+        """
+        Retrieve the stored BlockingValues for the blocking keys of all the Patients
+        selected by the patient_ids subquery.  This lets us compare blocking values
+        without deserializing the Patient data.
+
+        :param session: The database session
+        :param patient_ids: A query selecting the Patient IDs to retrieve values for
+        :param keys: The BlockingKeys to retrieve values for
+        :return: A dictionary of Patient IDs to their blocking values, by key
+        """
+        keys_by_id: dict[int, models.BlockingKey] = {k.id: k for k in keys}
+        result: dict[int, dict[models.BlockingKey, set[BlockingToken]]] = {}
+        if not keys_by_id:
+            return result
+        if settings.blocking_storage == "hash":
+            # the key of a hash is in its high bits, so select the range of each key
+            hash_query = select(models.BlockingHash.patient_id, models.BlockingHash.hash).where(
+                models.BlockingHash.patient_id.in_(patient_ids),
+                expression.or_(
+                    *(
+                        models.BlockingHash.hash.between(*models.blocking_hash_range(k))
+                        for k in keys_by_id.values()
+                    )
+                ),
+            )
+            for patient_id, hash_ in session.execute(hash_query):
+                key = keys_by_id[hash_ >> models.BLOCKING_HASH_VALUE_BITS]
+                result.setdefault(patient_id, {}).setdefault(key, set()).add(hash_)
+            return result
+        query = select(
+            models.BlockingValue.patient_id,
+            models.BlockingValue.blockingkey,
+            models.BlockingValue.value,
+        ).where(
+            models.BlockingValue.patient_id.in_(patient_ids),
+            models.BlockingValue.blockingkey.in_(list(keys_by_id)),
+        )
+        for patient_id, key_id, value in session.execute(query):
+            result.setdefault(patient_id, {}).setdefault(keys_by_id[key_id], set()).add(value)
+        return result
+
+    @classmethod
+    def _hash(cls, key: models.BlockingKey, token: BlockingToken) -> int:
+        """
+        Return the blocking hash of a blocking value in the form it is stored in.
+        """
+        return token if isinstance(token, int) else models.blocking_hash(key, token)
+
+    @classmethod
+    def _pending_query(
+        cls, blocking_values: dict[models.BlockingKey, list[BlockingToken]]
+    ) -> expression.Select | None:
+        """
+        Build the query that selects the IDs and Person IDs of the Patients that are
+        still pending indexing, see `insert_patient(defer_index=True)`, and match the
+        incoming blocking values.  Their BlockingValues are not written yet, so they
+        are matched on their rows in the PendingBlockingHash table instead, which is
+        joined once per blocking key like the BlockingHash table.  None is returned
+        when deferred indexing is disabled.
+
+        :param blocking_values: The incoming blocking values, by key
+        :return: The query, or None
+        """
+        if not settings.deferred_indexing:
+            return None
+        query = select(models.Patient.id, models.Patient.person_id).where(
+            models.Patient.person_id.is_not(None)
+        )
+        joined = False
+        for idx, (key, tokens) in enumerate(blocking_values.items()):
+            if not tokens:
+                continue
+            alias = orm.aliased(models.PendingBlockingHash, name=f"ph{idx}")
+            query = query.join(
+                alias,
+                expression.and_(
+                    models.Patient.id == alias.patient_id,
+                    alias.hash.in_([cls._hash(key, t) for t in tokens]),
+                ),
+            )
+            joined = True
+        return query if joined else None
+
+    @classmethod
+    def _stored_pending_values(
+        cls,
+        session: orm.Session,
+        patient_ids: expression.Select,
+        blocking_values: dict[models.BlockingKey, list[BlockingToken]],
+    ) -> dict[int, dict[models.BlockingKey, set[BlockingToken]]]:
+        """
+        Retrieve the pending blocking hashes of the Patients selected by the patient_ids
+        subquery, in the same form as `_stored_blocking_values`.  Only hashes are
+        stored for pending Patients, so the hashes of incoming values are mapped back
+        to the values, and any other hash is kept as is, which never matches.
+
+        :param session: The database session
+        :param patient_ids: A query selecting the Patient IDs to retrieve values for
+        :param blocking_values: The incoming blocking values, by key
+        :return: A dictionary of Patient IDs to their blocking values, by key
+        """
+        keys_by_id = {k.id: k for k in blocking_values}
+        tokens = {cls._hash(k, t): t for k, vals in blocking_values.items() for t in vals}
+        result: dict[int, dict[models.BlockingKey, set[BlockingToken]]] = {}
+        query = select(
+            models.PendingBlockingHash.patient_id, models.PendingBlockingHash.hash
+        ).where(models.PendingBlockingHash.patient_id.in_(patient_ids))
+        for patient_id, hash_ in session.execute(query):
+            if key := keys_by_id.get(hash_ >> models.BLOCKING_HASH_VALUE_BITS):
+                result.setdefault(patient_id, {}).setdefault(key, set()).add(
+                    tokens.get(hash_, hash_)
+                )
+        return result
+
+    @classmethod
+    def _cluster_window(
+        cls, matched: typing.Any, *partition_by: typing.Any
+    ) -> tuple[typing.Any, typing.Any]:
+        """
+        Return the window columns used to cap the size of Person clusters.  Patients
+        are ranked within their cluster with the ones that matched the blocking query
+        first, so they are never dropped in favour of the rest of the cluster, then
+        from most to least recently inserted.  The rank and the total size of the
+        cluster are returned.
+
+        :param matched: A column that is 1 for the Patients that matched the blocking
+          query, and 0 for the rest of their cluster
+        :param partition_by: The columns that identify a cluster
+        :return: A tuple of the rank and cluster size columns
+        """
+        return (
+            func.row_number()
+            .over(partition_by=partition_by, order_by=(matched.desc(), models.Patient.id.desc()))
+            .label("rank"),
+            func.count().over(partition_by=partition_by).label("size"),
+        )
+
+    @classmethod
+    def _log_truncated(
+        cls,
+        truncated: dict[int, int],
+        max_cluster_size: int,
+        label: str | None = None,
+    ) -> None:
+        """
+        Log the Person clusters that were truncated to the maximum cluster size.
+
+        :param truncated: A dictionary of Person IDs to their full cluster size
+        :param max_cluster_size: The maximum number of Patients compared per cluster
+        :param label: The label of the algorithm pass
+        """
+        for person_id, size in truncated.items():
+            LOGGER.info(
+                "truncated person cluster",
+                extra={
+                    "person_id": person_id,
+                    "cluster_size": size,
+                    "max_cluster_size": max_cluster_size,
+                    "algorithm.pass_label": label,
+                },
+            )
+
+    @classmethod
+    def _blocking_query(
+        cls,
+        record: schemas.PIIRecord,
         algorithm_pass: schemas.AlgorithmPass,
         context: schemas.AlgorithmContext,
-    ) -> typing.Sequence[models.Patient]:
+        estimates: BlockingEstimates | None = None,
+        max_candidates: int | None = None,
+        index: blocking_index.BlockingIndex | None = None,
+        profile: schemas.PassProfile | None = None,
+    ) -> tuple[expression.Select | None, dict[models.BlockingKey, list[BlockingToken]]]:
         """
-        Get all of the matching Patients for the given data using the provided
-        blocking keys defined in the algorithm_pass. Also, get all the
-        remaining Patient records in the Person clusters identified in
-        blocking to calculate Belongingness Ratio.
+        Build the query that selects the distinct Person IDs of all the Patients
+        matching the blocking keys defined in the algorithm_pass.  If the record is
+        missing too many blocking values, or the pass is estimated to select more
+        than max_candidates Patients, None is returned in place of the query to
+        indicate this pass should be skipped.  The incoming blocking values are
+        returned in the form they are stored in, see `_token`.
 
-        :param session: The database session
         :param record: The PIIRecord to match
         :param algorithm_pass: The AlgorithmPass to use
         :param context: The AlgorithmContext
-        :return: The matching Patients
+        :param estimates: The estimated number of Patients matching the record, by
+          key, see `_estimated_counts`.  When given, stop values are treated as
+          missing, and with the `blocking_stats` setting enabled the keys are
+          joined most selective first.
+        :param max_candidates: The maximum estimated number of Patients to select
+        :param index: The in-memory blocking index, when given the matching Patients
+          are found in the index, and the query selects them by id rather than
+          joining the blocking table
+        :param profile: When given, the keys used and skipped, and the reason the
+          pass is skipped (if it is), are recorded in the profile
+        :return: A tuple of the blocking query and the incoming blocking values
         """
         # Create the base query
         base: expression.Select = expression.select(models.Patient.person_id).distinct()
         # Get an ordered dict of blocking keys and their log odds
         key_odds = cls._ordered_odds(algorithm_pass.blocking_keys, context)
+        if estimates is not None and settings.blocking_stats:
+            # Join the most selective keys first, ties are kept in log odds order
+            key_odds = dict(
+                sorted(key_odds.items(), key=lambda item: estimates.counts[item[0]])
+            )
         # Total log odds from all blocking keys
         total_odds = sum(key_odds.values())
         # Total log odds for keys with missing values
         missing_odds: float = 0
         # Blocking key values
-        blocking_values: dict[models.BlockingKey, list[str]] = {}
+        blocking_values: dict[models.BlockingKey, list[BlockingToken]] = {}
+        # Blocking hashes to look up in the in-memory index, by key
+        lookups: list[list[int]] = []
         # Build the join criteria, we are joining the Blocking Value table
         # multiple times, once for each Blocking Key.  If a Patient record
         # has a matching Blocking Value for all the Blocking Keys, then it
         # is considered a match.
         for idx, (key, log_odds) in enumerate(key_odds.items()):
             # Get all the possible values from the data for this key
-            blocking_values[key] = [v for v in record.blocking_keys(key)]
+            values = record.blocking_keys(key)
+            has_values = bool(values)
+            if estimates is not None and estimates.stop_values:
+                values = cls._remove_stop_values(
+                    key, values, estimates.stop_values, algorithm_pass.resolved_label
+                )
+            blocking_values[key] = [cls._token(key, v) for v in values]
             if not blocking_values[key]:
+                if profile is not None:
+                    profile.skipped_keys[key.value] = "stop values" if has_values else "missing"
                 # Add the missing log odds to the total and check if we should abort
                 missing_odds += log_odds
                 if not cls._should_continue_blocking(
                     total_odds, missing_odds, context.advanced.max_missing_allowed_proportion
                 ):
-                    return []
+                    if profile is not None:
+                        profile.skipped = "missing blocking values"
+                    return None, blocking_values
                 # This key doesn't have values, skip the joining query
                 continue
+            if profile is not None:
+                profile.blocking_keys.append(key.value)
+            if index is not None:
+                # The index is keyed by hash, regardless of how the values are stored
+                lookups.append([models.blocking_hash(key, v) for v in values])
+                continue
+            if settings.blocking_storage == "hash":
+                # The key is encoded in the hash, so an equality join on the hash
+                # column is all that is needed
+                hash_alias = orm.aliased(models.BlockingHash, name=f"bh{idx}")
+                base = base.join(
+                    hash_alias,
+                    expression.and_(
+                        models.Patient.id == hash_alias.patient_id,
+                        hash_alias.hash.in_(blocking_values[key]),
+                    ),
+                )
+                continue
             # Create a dynamic alias for the Blocking Value table using the index
             # this is necessary since we are potentially joining the same table
             # multiple times with different conditions
@@ -171,13 +501,400 @@ class BlockData:
                     alias.value.in_(blocking_values[key]),
                 ),
             )
+        if lookups and index is not None:
+            # Select the Persons of the matching Patients, the ids are rendered inline
+            # as there can be more than the database allows as bound parameters
+            patient_ids = sorted(index.candidates(lookups))
+            base = base.where(
+                models.Patient.id.in_(
+                    expression.bindparam(
+                        None, patient_ids, expanding=True, literal_execute=True
+                    )
+                )
+            )
+        if estimates is not None and (max_candidates or profile is not None):
+            # A Patient must match every key, so the least common key bounds the pass
+            estimate = min(
+                (estimates.counts[k] for k, v in blocking_values.items() if v), default=0
+            )
+            if profile is not None:
+                profile.estimated_candidates = estimate
+            if max_candidates and estimate > max_candidates:
+                if profile is not None:
+                    profile.skipped = "too many candidates"
+                LOGGER.info(
+                    "skipping blocking query: too many candidates",
+                    extra={
+                        "estimate": estimate,
+                        "max_candidates": max_candidates,
+                        "algorithm.pass_label": algorithm_pass.resolved_label,
+                    },
+                )
+                return None, blocking_values
+        return base, blocking_values
+
+    @classmethod
+    def _remove_stop_values(
+        cls,
+        key: models.BlockingKey,
+        values: set[str],
+        stop_values: set[int],
+        label: str | None = None,
+    ) -> set[str]:
+        """
+        Remove the stop values from the incoming blocking values of a key, so a
+        placeholder value (e.g. a 1900-01-01 birthdate) is treated as missing
+        rather than selecting every Patient sharing it.
+
+        :param key: The BlockingKey of the values
+        :param values: The incoming blocking values
+        :param stop_values: The blocking hashes of the stop values
+        :param label: The label of the algorithm pass
+        :return: The values that aren't stop values
+        """
+        result = {v for v in values if models.blocking_hash(key, v) not in stop_values}
+        if removed := len(values) - len(result):
+            # NOTE: the values aren't logged, as they are PII
+            LOGGER.info(
+                "ignoring blocking stop values",
+                extra={"blocking_key": key.value, "count": removed, "algorithm.pass_label": label},
+            )
+        return result
 
-        # Using the subquery of unique Patient IDs, select all the Patients
-        expr = expression.select(models.Patient).where(models.Patient.person_id.in_(base))
-        # Execute the query and collect all the Patients in matching Person clusters
-        patients: typing.Sequence[models.Patient] = session.execute(expr).scalars().all()
+    @classmethod
+    def _estimates(
+        cls,
+        session: orm.Session,
+        record: schemas.PIIRecord,
+        keys: typing.Iterable[models.BlockingKey],
+        max_candidates: int | None,
+    ) -> BlockingEstimates | None:
+        """
+        Return the estimated counts used to plan the blocking queries, or None when
+        the `blocking_stats` and `blocking_stop_value_ratio` settings and max_candidates
+        are all unset.
+        """
+        if not (settings.blocking_stats or settings.blocking_stop_value_ratio or max_candidates):
+            return None
+        return cls._estimated_counts(session, record, keys)
+
+    @classmethod
+    def get(
+        cls,
+        session: orm.Session,
+        record: schemas.PIIRecord,
+        algorithm_pass: schemas.AlgorithmPass,
+        context: schemas.AlgorithmContext,
+        max_cluster_size: int | None = None,
+        max_candidates: int | None = None,
+        profile: schemas.PassProfile | None = None,
+    ) -> typing.Sequence[models.Patient]:
+        """
+        Get all of the matching Patients for the given data using the provided
+        blocking keys defined in the algorithm_pass. Also, get all the
+        remaining Patient records in the Person clusters identified in
+        blocking to calculate Belongingness Ratio.
+
+        :param session: The database session
+        :param record: The PIIRecord to match
+        :param algorithm_pass: The AlgorithmPass to use
+        :param context: The AlgorithmContext
+        :param max_cluster_size: The maximum number of Patients to return per Person
+          cluster, the Patients that matched the blocking query are kept first, then
+          the most recently inserted ones
+        :param max_candidates: Skip the pass if it's estimated to select more than
+          this many Patients, see `_estimated_counts`
+        :param profile: When given, the blocking decisions, the time spent executing
+          SQL and the number of Persons and Patients hydrated and filtered are
+          recorded in the profile
+        :return: The matching Patients
+        """
+        with _timed_sql(session, profile):
+            return cls._get(
+                session, record, algorithm_pass, context, max_cluster_size, max_candidates, profile
+            )
+
+    @classmethod
+    def _get(
+        cls,
+        session: orm.Session,
+        record: schemas.PIIRecord,
+        algorithm_pass: schemas.AlgorithmPass,
+        context: schemas.AlgorithmContext,
+        max_cluster_size: int | None,
+        max_candidates: int | None,
+        profile: schemas.PassProfile | None,
+    ) -> typing.Sequence[models.Patient]:
+        """
+        Get all of the matching Patients for a pass, see `get`.
+        """
+        estimates = cls._estimates(session, record, algorithm_pass.blocking_keys, max_candidates)
+        base, blocking_values = cls._blocking_query(
+            record,
+            algorithm_pass,
+            context,
+            estimates,
+            max_candidates,
+            blocking_index.get_index(session),
+            profile,
+        )
+        if base is None:
+            return []
+        pending = cls._pending_query(blocking_values)
+        person_ids: expression.Select | expression.CompoundSelect = base
+        matched_ids: expression.Select | expression.CompoundSelect = base.with_only_columns(
+            models.Patient.id
+        )
+        if pending is not None:
+            # Include the clusters of pending Patients that aren't indexed yet
+            person_ids = expression.union(
+                base, pending.with_only_columns(models.Patient.person_id)
+            )
+            matched_ids = expression.union(
+                matched_ids, pending.with_only_columns(models.Patient.id)
+            )
+        patient_ids: expression.Select
+        patients: typing.Sequence[models.Patient]
+        if max_cluster_size:
+            # Rank the Patients in each Person cluster, and only select the top ranked
+            matched = expression.case((models.Patient.id.in_(matched_ids), 1), else_=0)
+            rank, size = cls._cluster_window(matched, models.Patient.person_id)
+            ranked = (
+                expression.select(models.Patient.id.label("patient_id"), rank, size)
+                .where(models.Patient.person_id.in_(person_ids))
+                .subquery("ranked")
+            )
+            expr = (
+                expression.select(models.Patient, ranked.c.size)
+                .join(ranked, models.Patient.id == ranked.c.patient_id)
+                .where(ranked.c.rank <= max_cluster_size)
+                .options(orm.joinedload(models.Patient.person))
+            )
+            rows = session.execute(expr).all()
+            patients = [p for p, _ in rows]
+            cls._log_truncated(
+                {p.person_id: n for p, n in rows if n > max_cluster_size},
+                max_cluster_size,
+                algorithm_pass.resolved_label,
+            )
+            patient_ids = expression.select(ranked.c.patient_id).where(
+                ranked.c.rank <= max_cluster_size
+            )
+        else:
+            # Using the subquery of unique Patient IDs, select all the Patients
+            expr = (
+                expression.select(models.Patient)
+                .where(models.Patient.person_id.in_(person_ids))
+                .options(orm.joinedload(models.Patient.person))
+            )
+            # Execute the query and collect all the Patients in matching Person clusters
+            patients = session.execute(expr).scalars().all()
+            patient_ids = expression.select(models.Patient.id).where(
+                models.Patient.person_id.in_(person_ids)
+            )
+        if not patients:
+            return []
+        # Get the stored blocking values for all the Patients in matching Person clusters
+        stored = cls._stored_blocking_values(session, patient_ids, blocking_values.keys())
+        if pending is not None:
+            stored.update(cls._stored_pending_values(session, patient_ids, blocking_values))
         # Remove any Patient records that have incorrect blocking value matches
-        return [p for p in patients if cls._filter_incorrect_match(p, blocking_values)]
+        result = [
+            p
+            for p in patients
+            if cls._filter_incorrect_match(stored.get(p.id, {}), blocking_values)
+        ]
+        if profile is not None:
+            profile.persons = len({p.person_id for p in patients})
+            profile.patients = len(patients)
+            profile.filtered = len(patients) - len(result)
+        return result
+
+    @classmethod
+    def get_multi(
+        cls,
+        session: orm.Session,
+        record: schemas.PIIRecord,
+        algorithm_passes: typing.Sequence[schemas.AlgorithmPass],
+        context: schemas.AlgorithmContext,
+        max_cluster_size: int | None = None,
+        max_candidates: int | None = None,
+    ) -> dict[str, list[models.Patient]]:
+        """
+        Get all of the matching Patients for every pass in a single round-trip.
+        The blocking query of each pass is tagged with the index of the pass and
+        combined with a UNION ALL, so the Person clusters that overlap between
+        passes are only fetched and hydrated once.  The stored blocking values of
+        the candidates are then fetched for all passes in one additional query.
+        The results are the same as calling `get` once per pass.
+
+        :param session: The database session
+        :param record: The PIIRecord to match
+        :param algorithm_passes: The AlgorithmPasses to use
+        :param context: The AlgorithmContext
+        :param max_cluster_size: The maximum number of Patients to return per Person
+          cluster in each pass, the Patients that matched the blocking query are kept
+          first, then the most recently inserted ones
+        :param max_candidates: Skip the passes estimated to select more than this
+          many Patients, see `_estimated_counts`
+        :return: A dictionary of pass labels to the matching Patients for that pass
+        """
+        result: dict[str, list[models.Patient]] = {
+            p.resolved_label: [] for p in algorithm_passes
+        }
+        # Estimate the counts for the keys of every pass at once
+        estimates = cls._estimates(
+            session, record, {k for p in algorithm_passes for k in p.blocking_keys}, max_candidates
+        )
+        index = blocking_index.get_index(session)
+        queries: list[expression.Select] = []
+        # The ids of the Patients matching each pass, rather than their Persons
+        matched_queries: list[expression.Select] = []
+        blocking_values: dict[int, dict[models.BlockingKey, list[BlockingToken]]] = {}
+        active: list[int] = []
+        for idx, algorithm_pass in enumerate(algorithm_passes):
+            base, blocking_values[idx] = cls._blocking_query(
+                record, algorithm_pass, context, estimates, max_candidates, index
+            )
+            if base is not None:
+                active.append(idx)
+                pass_idx = expression.literal(idx, sqltypes.Integer).label("pass_idx")
+                queries.append(base.add_columns(pass_idx))
+                matched_queries.append(
+                    base.with_only_columns(models.Patient.id.label("patient_id"), pass_idx)
+                )
+        if not queries:
+            return result
+
+        pending_queries: list[expression.Select] = []
+        for idx in active:
+            if (pending := cls._pending_query(blocking_values[idx])) is not None:
+                # Include the clusters of pending Patients that aren't indexed yet
+                pass_idx = expression.literal(idx, sqltypes.Integer).label("pass_idx")
+                pending_queries.append(
+                    pending.with_only_columns(models.Patient.person_id, pass_idx)
+                )
+                matched_queries.append(
+                    pending.with_only_columns(models.Patient.id.label("patient_id"), pass_idx)
+                )
+        # Tag each unique Person ID with the index of the pass(es) it was blocked in,
+        # the pending clusters may overlap with the indexed ones, so they are deduplicated
+        combine = expression.union if pending_queries else expression.union_all
+        blocked = combine(*queries, *pending_queries).subquery("blocked")
+        patient_ids: expression.Select
+        if max_cluster_size:
+            # Rank the Patients in each Person cluster of each pass, and only select
+            # the top ranked
+            matched_ids = combine(*matched_queries).subquery("matched")
+            matched = expression.case((matched_ids.c.patient_id.is_not(None), 1), else_=0)
+            rank, size = cls._cluster_window(
+                matched, blocked.c.pass_idx, models.Patient.person_id
+            )
+            ranked = (
+                expression.select(
+                    models.Patient.id.label("patient_id"), blocked.c.pass_idx, rank, size
+                )
+                .join(blocked, models.Patient.person_id == blocked.c.person_id)
+                .outerjoin(
+                    matched_ids,
+                    expression.and_(
+                        matched_ids.c.patient_id == models.Patient.id,
+                        matched_ids.c.pass_idx == blocked.c.pass_idx,
+                    ),
+                )
+                .subquery("ranked")
+            )
+            expr = (
+                expression.select(models.Patient, ranked.c.pass_idx, ranked.c.size)
+                .join(ranked, models.Patient.id == ranked.c.patient_id)
+                .where(ranked.c.rank <= max_cluster_size)
+                .order_by(ranked.c.pass_idx, models.Patient.id)
+                .options(orm.joinedload(models.Patient.person))
+            )
+            sized_rows = session.execute(expr).all()
+            rows = [(p, idx) for p, idx, _ in sized_rows]
+            truncated: dict[int, dict[int, int]] = {}
+            for patient, idx, n in sized_rows:
+                if n > max_cluster_size:
+                    truncated.setdefault(idx, {})[patient.person_id] = n
+            for idx, clusters in truncated.items():
+                cls._log_truncated(
+                    clusters, max_cluster_size, algorithm_passes[idx].resolved_label
+                )
+            patient_ids = expression.select(ranked.c.patient_id).where(
+                ranked.c.rank <= max_cluster_size
+            )
+        else:
+            expr = (
+                expression.select(models.Patient, blocked.c.pass_idx)
+                .join(blocked, models.Patient.person_id == blocked.c.person_id)
+                .order_by(blocked.c.pass_idx, models.Patient.id)
+                .options(orm.joinedload(models.Patient.person))
+            )
+            # The session identity map guarantees each Patient is only hydrated once,
+            # even when it is returned for multiple passes
+            rows = [(p, idx) for p, idx in session.execute(expr)]
+            patient_ids = expression.select(models.Patient.id).join(
+                blocked, models.Patient.person_id == blocked.c.person_id
+            )
+        if not rows:
+            return result
+        # Get the stored blocking values for all the Patients in matching Person clusters
+        stored = cls._stored_blocking_values(
+            session,
+            patient_ids,
+            {k for vals in blocking_values.values() for k in vals},
+        )
+        if pending_queries:
+            merged: dict[models.BlockingKey, list[BlockingToken]] = {}
+            for idx in active:
+                for key, vals in blocking_values[idx].items():
+                    merged.setdefault(key, []).extend(vals)
+            stored.update(cls._stored_pending_values(session, patient_ids, merged))
+        for patient, idx in rows:
+            # Remove any Patient records that have incorrect blocking value matches
+            if cls._filter_incorrect_match(stored.get(patient.id, {}), blocking_values[idx]):
+                result[algorithm_passes[idx].resolved_label].append(patient)
+        return result
+
+    @classmethod
+    async def get_async(
+        cls,
+        session: sa_asyncio.AsyncSession,
+        record: schemas.PIIRecord,
+        algorithm_pass: schemas.AlgorithmPass,
+        context: schemas.AlgorithmContext,
+        max_cluster_size: int | None = None,
+        max_candidates: int | None = None,
+    ) -> typing.Sequence[models.Patient]:
+        """
+        Async variant of `get`, the queries are awaited so the event loop is free
+        while waiting on the database.  The Person of each Patient is eagerly
+        loaded, so the results can be used outside of the session greenlet.
+        """
+        return await session.run_sync(
+            lambda s: cls.get(s, record, algorithm_pass, context, max_cluster_size, max_candidates)
+        )
+
+    @classmethod
+    async def get_multi_async(
+        cls,
+        session: sa_asyncio.AsyncSession,
+        record: schemas.PIIRecord,
+        algorithm_passes: typing.Sequence[schemas.AlgorithmPass],
+        context: schemas.AlgorithmContext,
+        max_cluster_size: int | None = None,
+        max_candidates: int | None = None,
+    ) -> dict[str, list[models.Patient]]:
+        """
+        Async variant of `get_multi`, the queries are awaited so the event loop is
+        free while waiting on the database.
+        """
+        return await session.run_sync(
+            lambda s: cls.get_multi(
+                s, record, algorithm_passes, context, max_cluster_size, max_candidates
+            )
+        )
 
 
 def insert_patient(
@@ -187,6 +904,7 @@ def insert_patient(
     external_patient_id: typing.Optional[str] = None,
     external_person_id: typing.Optional[str] = None,
     commit: bool = True,
+    defer_index: bool = False,
 ) -> models.Patient:
     """
     Insert a new patient record into the database.
@@ -197,12 +915,20 @@ def insert_patient(
     :param external_patient_id: Optional external patient ID
     :param external_person_id: Optional external person ID
     :param commit: Whether to commit the transaction
+    :param defer_index: Whether to mark the Patient as pending, rather than inserting
+        its BlockingValues, so they can be inserted later by `index_pending_patients`.
+        Once `deferred_index_max_pending` Patients are pending, the BlockingValues
+        are inserted anyway.
 
     :returns: The inserted Patient record
     """
+    global _PENDING_COUNT
 
     patient = models.Patient(
-        person=person, data=record.to_data(), external_patient_id=external_patient_id
+        person=person,
+        data=record.to_data(),
+        features=record.to_features(),
+        external_patient_id=external_patient_id,
     )
 
     if external_person_id is not None:
@@ -211,16 +937,53 @@ def insert_patient(
 
     # create a new Patient record
     session.add(patient)
-    session.flush()
-
-    # insert blocking values
-    insert_blocking_values(session, [patient], commit=False)
+    if defer_index and (
+        count_pending_patients(session, max_age=settings.deferred_index_interval)
+        < settings.deferred_index_max_pending
+    ):
+        patient.pending_index = True
+        session.flush()
+        # store the hashes of the blocking values, so the Patient can still be blocked
+        session.execute(
+            insert(models.PendingBlockingHash), _blocking_hash_rows(patient.id, record)
+        )
+        _PENDING_COUNT += 1
+    else:
+        session.flush()
+        # insert blocking values
+        insert_blocking_values(session, [patient], commit=False)
 
     if commit:
         session.commit()
     return patient
 
 
+async def insert_patient_async(
+    session: sa_asyncio.AsyncSession,
+    record: schemas.PIIRecord,
+    person: typing.Optional[models.Person] = None,
+    external_patient_id: typing.Optional[str] = None,
+    external_person_id: typing.Optional[str] = None,
+    commit: bool = True,
+    defer_index: bool = False,
+) -> models.Patient:
+    """
+    Async variant of `insert_patient`, the inserts are awaited so the event loop
+    is free while waiting on the database.
+    """
+    return await session.run_sync(
+        lambda s: insert_patient(
+            s,
+            record,
+            person,
+            external_patient_id,
+            external_person_id,
+            commit=commit,
+            defer_index=defer_index,
+        )
+    )
+
+
 def bulk_insert_patients(
     session: orm.Session,
     records: typing.Sequence[schemas.PIIRecord],
@@ -239,9 +1002,6 @@ def bulk_insert_patients(
 
     :returns: The inserted Patient records
     """
-    if session.get_bind().dialect.name == "mysql":
-        raise ValueError("Bulk insert not supported for MySQL")
-
     if not records:
         return []
 
@@ -253,6 +1013,7 @@ def bulk_insert_patients(
         {
             "person_id": person and person.id,
             "data": record.to_data(),
+            "features": record.to_features(),
             "external_patient_id": record.external_id,
             "external_person_id": external_person_id,
             "external_person_source": "IRIS" if external_person_id else None,
@@ -260,9 +1021,28 @@ def bulk_insert_patients(
         for record in records
     ]
 
-    patients: typing.Sequence[models.Patient] = session.scalars(
-        insert(models.Patient).returning(models.Patient, sort_by_parameter_order=True), pat_data
-    ).all()
+    patients: typing.Sequence[models.Patient]
+    if not session.get_bind().dialect.insert_returning:
+        # MySQL doesn't support INSERT ... RETURNING, so generate the reference ids
+        # up front, let the driver batch the rows into multi-row INSERT statements
+        # and then read the Patients back in a single SELECT
+        ref_ids = [uuid.uuid4() for _ in pat_data]
+        session.execute(
+            insert(models.Patient),
+            [{**row, "reference_id": ref_id} for row, ref_id in zip(pat_data, ref_ids)],
+        )
+        by_ref = {
+            p.reference_id: p
+            for p in session.scalars(
+                select(models.Patient).where(models.Patient.reference_id.in_(ref_ids))
+            )
+        }
+        patients = [by_ref[ref_id] for ref_id in ref_ids]
+    else:
+        patients = session.scalars(
+            insert(models.Patient).returning(models.Patient, sort_by_parameter_order=True),
+            pat_data,
+        ).all()
 
     insert_blocking_values(session, patients, records=records, commit=False)
 
@@ -271,6 +1051,257 @@ def bulk_insert_patients(
     return patients
 
 
+def supports_copy(session: orm.Session) -> bool:
+    """
+    Check if the session is bound to a PostgreSQL database, using the psycopg2
+    driver, which supports streaming rows with `COPY FROM STDIN`.
+    """
+    dialect = session.get_bind().dialect
+    return dialect.name == "postgresql" and dialect.driver == "psycopg2"
+
+
+def _copy_csv_field(value: typing.Any) -> str:
+    """
+    Encode a value as a CSV field for `COPY FROM STDIN`.  None is written as an
+    unquoted empty field, which COPY reads as NULL, and every other value is
+    quoted, so empty strings are kept as empty strings.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, dict):
+        value = json.dumps(value)
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+class CopyReader(io.TextIOBase):
+    """
+    A read-only file object that encodes rows as CSV lines for `COPY FROM STDIN`
+    as they are read.  The driver reads the file in small chunks, so only the rows
+    of the current chunk are held in memory, rather than the whole COPY payload.
+    """
+
+    def __init__(self, rows: typing.Iterable[typing.Sequence[typing.Any]]):
+        self._lines = (",".join(_copy_csv_field(v) for v in row) + "\n" for row in rows)
+        self._buffer = ""
+
+    def readable(self) -> bool:
+        """
+        The reader is always readable.
+        """
+        return True
+
+    def read(self, size: int | None = -1) -> str:
+        """
+        Read up to `size` characters, or all the remaining rows if `size` is negative.
+        """
+        parts, length = [self._buffer], len(self._buffer)
+        while size is None or size < 0 or length < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            parts.append(line)
+            length += len(line)
+        data = "".join(parts)
+        if size is None or size < 0:
+            size = len(data)
+        self._buffer = data[size:]
+        return data[:size]
+
+
+def copy_rows(
+    session: orm.Session,
+    table: typing.Any,
+    columns: typing.Sequence[str],
+    rows: typing.Iterable[typing.Sequence[typing.Any]],
+) -> None:
+    """
+    Stream rows into a table with `COPY FROM STDIN`, using the connection of the
+    current session transaction.  The rows are encoded as they are sent, so they
+    can be a generator.  Only supported on PostgreSQL with psycopg2.
+
+    :param session: The database session
+    :param table: The Table to copy the rows into
+    :param columns: The names of the columns in each row
+    :param rows: The rows to copy, each a sequence of values in column order
+    """
+    quote = session.get_bind().dialect.identifier_preparer.quote
+    stmt = "COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(
+        quote(table.name), ", ".join(quote(c) for c in columns)
+    )
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(stmt, CopyReader(rows))
+    finally:
+        cursor.close()
+
+
+def _next_ids(session: orm.Session, table: typing.Any, count: int) -> list[int]:
+    """
+    Pre-allocate `count` primary keys from the id sequence of a PostgreSQL table.
+    """
+    if count == 0:
+        return []
+    stmt = text(
+        "SELECT nextval(pg_get_serial_sequence(:table, 'id')) FROM generate_series(1, :count)"
+    )
+    return list(session.execute(stmt, {"table": table.name, "count": count}).scalars())
+
+
+def copy_seed_clusters(
+    session: orm.Session,
+    clusters: typing.Sequence[schemas.Cluster],
+    commit: bool = True,
+) -> list[schemas.PersonCluster]:
+    """
+    Insert Person clusters into the database by streaming the Person, Patient and
+    blocking rows with `COPY FROM STDIN`.  The primary keys are pre-allocated
+    from the table sequences and the reference ids are generated up front, so the
+    reference mapping can be returned without reading the rows back.  Only
+    supported on PostgreSQL with psycopg2, see `supports_copy`.
+
+    :param session: The database session
+    :param clusters: The clusters to insert, each cluster becomes a new Person
+    :param commit: Whether to commit the transaction
+
+    :returns: The reference ids of the inserted Persons and Patients
+    """
+    if not supports_copy(session):
+        raise ValueError("COPY is only supported for PostgreSQL with psycopg2")
+
+    person_ids = iter(_next_ids(session, models.Person.__table__, len(clusters)))
+    patient_ids = iter(
+        _next_ids(session, models.Patient.__table__, sum(len(c.records) for c in clusters))
+    )
+    persons: list[tuple] = []
+    # the ids of each Patient, its rows are only built as they are streamed
+    patients: list[tuple[int, int, uuid.UUID, schemas.Cluster, schemas.PIIRecord]] = []
+    results: list[schemas.PersonCluster] = []
+    for cluster in clusters:
+        person_id, person_ref = next(person_ids), uuid.uuid4()
+        persons.append((person_id, person_ref))
+        refs: list[schemas.PatientRef] = []
+        for record in cluster.records:
+            patient_id, patient_ref = next(patient_ids), uuid.uuid4()
+            patients.append((patient_id, person_id, patient_ref, cluster, record))
+            refs.append(
+                schemas.PatientRef(
+                    patient_reference_id=patient_ref, external_patient_id=record.external_id
+                )
+            )
+        results.append(
+            schemas.PersonCluster(
+                person_reference_id=person_ref,
+                external_person_id=cluster.external_person_id,
+                patients=refs,
+            )
+        )
+
+    copy_rows(session, models.Person.__table__, ["id", "reference_id"], persons)
+    copy_rows(
+        session,
+        models.Patient.__table__,
+        [
+            "id",
+            "person_id",
+            "data",
+            "features",
+            "external_patient_id",
+            "external_person_id",
+            "external_person_source",
+            "reference_id",
+        ],
+        (
+            (
+                patient_id,
+                person_id,
+                record.to_data(),
+                record.to_features(),
+                record.external_id,
+                cluster.external_person_id,
+                "IRIS" if cluster.external_person_id else None,
+                patient_ref,
+            )
+            for patient_id, person_id, patient_ref, cluster, record in patients
+        ),
+    )
+    values = (
+        v for patient_id, _, _, _, record in patients for v in blocking_rows(patient_id, record)
+    )
+    first = next(values, None)
+    if first is not None:
+        columns = list(first)
+        copy_rows(
+            session,
+            blocking_table().__table__,
+            columns,
+            ([v[c] for c in columns] for v in itertools.chain([first], values)),
+        )
+    if (index := blocking_index.current()) is not None:
+        for patient_id, _, _, _, record in patients:
+            index.add(patient_id, [models.blocking_hash(k, v) for k, v in record.blocking_values()])
+    if settings.blocking_index:
+        # log the inserts, so the blocking index of every process adds the Patients
+        created_at = now_utc().replace(tzinfo=None)
+        copy_rows(
+            session,
+            models.BlockingChange.__table__,
+            ["patient_id", "created_at"],
+            ((patient_id, created_at) for patient_id, _, _, _, _ in patients),
+        )
+
+    if commit:
+        session.commit()
+    return results
+
+
+def seed_clusters(
+    session: orm.Session,
+    clusters: typing.Sequence[schemas.Cluster],
+    commit: bool = True,
+) -> list[schemas.PersonCluster]:
+    """
+    Insert Person clusters into the database, using the fastest method supported
+    by the database dialect.  PostgreSQL streams the rows with COPY, and all other
+    dialects use a bulk insert per cluster.
+
+    :param session: The database session
+    :param clusters: The clusters to insert, each cluster becomes a new Person
+    :param commit: Whether to commit the transaction
+
+    :returns: The reference ids of the inserted Persons and Patients
+    """
+    if supports_copy(session):
+        return copy_seed_clusters(session, clusters, commit=commit)
+
+    results: list[schemas.PersonCluster] = []
+    for cluster in clusters:
+        person = models.Person()
+        patients = bulk_insert_patients(
+            session,
+            cluster.records,
+            person,
+            external_person_id=cluster.external_person_id,
+            commit=False,
+        )
+        results.append(
+            schemas.PersonCluster(
+                person_reference_id=person.reference_id,
+                external_person_id=cluster.external_person_id,
+                patients=[
+                    schemas.PatientRef(
+                        patient_reference_id=p.reference_id,
+                        external_patient_id=p.external_patient_id,
+                    )
+                    for p in patients
+                ],
+            )
+        )
+
+    if commit:
+        session.commit()
+    return results
+
+
 def update_patient(
     session: orm.Session,
     patient: models.Patient,
@@ -296,8 +1327,11 @@ def update_patient(
 
     if record:
         patient.data = record.to_data()
+        patient.features = record.to_features()
         delete_blocking_values_for_patient(session, patient, commit=False)
         insert_blocking_values(session, [patient], commit=False)
+        # the new BlockingValues are written, so the Patient is no longer pending
+        patient.pending_index = False
 
     if person:
         patient.person = person
@@ -311,6 +1345,39 @@ def update_patient(
     return patient
 
 
+def blocking_table() -> type[models.BlockingValue] | type[models.BlockingHash]:
+    """
+    Return the model blocking values are stored in, based on the `blocking_storage`
+    setting.
+    """
+    return models.BlockingHash if settings.blocking_storage == "hash" else models.BlockingValue
+
+
+def _blocking_hash_rows(patient_id: int, record: schemas.PIIRecord) -> list[dict[str, typing.Any]]:
+    """
+    Return the BlockingHash rows for a Patient.
+    """
+    # distinct values can collide, but the hash is part of the primary key
+    hashes = {models.blocking_hash(key, val) for key, val in record.blocking_values()}
+    return [{"hash": h, "patient_id": patient_id} for h in sorted(hashes)]
+
+
+def blocking_rows(patient_id: int, record: schemas.PIIRecord) -> list[dict[str, typing.Any]]:
+    """
+    Return the rows to insert into the blocking table for a Patient.
+
+    :param patient_id: The id of the Patient
+    :param record: The PIIRecord of the Patient
+    :returns: A list of rows, keyed by column name
+    """
+    if settings.blocking_storage == "hash":
+        return _blocking_hash_rows(patient_id, record)
+    return [
+        {"patient_id": patient_id, "blockingkey": key.id, "value": val}
+        for key, val in record.blocking_values()
+    ]
+
+
 def insert_blocking_values(
     session: orm.Session,
     patients: typing.Sequence[models.Patient],
@@ -331,23 +1398,92 @@ def insert_blocking_values(
     if records is not None and len(patients) != len(records):
         raise ValueError("Patients and records must be the same length")
 
-    data: list[dict] = []
+    index = blocking_index.current()
+    data: list[dict[str, typing.Any]] = []
     for idx, patient in enumerate(patients):
         record = records[idx] if records else schemas.PIIRecord.from_patient(patient)
-        for key, val in record.blocking_values():
-            data.append({"patient_id": patient.id, "blockingkey": key.id, "value": val})
+        data.extend(blocking_rows(patient.id, record))
+        if index is not None:
+            index.add(patient.id, [models.blocking_hash(k, v) for k, v in record.blocking_values()])
     if not data:
         return
 
-    if session.get_bind().dialect.name == "mysql":
-        # MySQL doesn't support bulk inserts, thus we need to insert
-        # each row individually
-        session.add_all([models.BlockingValue(**d) for d in data])
+    table = blocking_table()
+    if len(data) >= COPY_MIN_ROWS and supports_copy(session):
+        # For large batches on PostgreSQL, stream the rows with COPY
+        columns = list(data[0])
+        copy_rows(session, table.__table__, columns, ([d[c] for c in columns] for d in data))
     else:
-        # For all other dialects, we can use a bulk insert to improve performance
-        session.execute(insert(models.BlockingValue), data)
+        # For all other dialects, use a bulk insert to improve performance, the
+        # MySQL driver batches these into multi-row INSERT statements
+        session.execute(insert(table), data)
+    # log the inserts, so the blocking index of every process adds the Patients
+    blocking_index.record_changes(session, [p.id for p in patients])
+    if commit:
+        session.commit()
+
+
+def count_pending_patients(session: orm.Session, max_age: float = 0.0) -> int:
+    """
+    Count the Patients that are pending indexing, up to `deferred_index_max_pending`.
+    The count is cached for max_age seconds, in between the Patients deferred by
+    this process are added to it, so the count is an estimate when multiple
+    processes defer Patients.  Once the cached count reaches the maximum, the
+    Patients are counted again, as they may have been indexed since.
+
+    :param session: The database session
+    :param max_age: The maximum age, in seconds, of a cached count to return
+    :returns: The number of pending Patients, capped at the maximum
+    """
+    global _PENDING_COUNT, _PENDING_COUNTED
+    cached = _PENDING_COUNT < settings.deferred_index_max_pending
+    if cached and time.monotonic() - _PENDING_COUNTED < max_age:
+        return _PENDING_COUNT
+    pending = (
+        select(models.Patient.id)
+        .where(models.Patient.pending_index.is_(True))
+        .limit(settings.deferred_index_max_pending)
+        .subquery()
+    )
+    _PENDING_COUNT = session.execute(select(func.count()).select_from(pending)).scalar_one()
+    _PENDING_COUNTED = time.monotonic()
+    return _PENDING_COUNT
+
+
+def index_pending_patients(
+    session: orm.Session, batch_size: int = 500, commit: bool = True
+) -> int:
+    """
+    Insert the BlockingValues for a batch of Patients that are pending indexing,
+    and clear their pending marker.  The pending Patients are locked, skipping any
+    already locked, so multiple workers can index concurrently.
+
+    :param session: The database session
+    :param batch_size: The maximum number of Patients to index
+    :param commit: Whether to commit the transaction
+
+    :returns: The number of Patients indexed
+    """
+    query = (
+        select(models.Patient)
+        .where(models.Patient.pending_index.is_(True))
+        .order_by(models.Patient.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    patients = session.scalars(query).all()
+    if not patients:
+        return 0
+    insert_blocking_values(session, patients, commit=False)
+    for patient in patients:
+        patient.pending_index = False
+    session.query(models.PendingBlockingHash).filter(
+        models.PendingBlockingHash.patient_id.in_([p.id for p in patients])
+    ).delete()
+    session.flush()
     if commit:
         session.commit()
+    return len(patients)
 
 
 def delete_blocking_values_for_patient(
@@ -362,14 +1498,247 @@ def delete_blocking_values_for_patient(
 
     :returns: None
     """
-    session.query(models.BlockingValue).filter(
-        models.BlockingValue.patient_id == patient.id
-    ).delete()
+    if (index := blocking_index.current()) is not None:
+        index.remove(patient.id)
+    # log the change, so the other processes replace the Patient's postings
+    blocking_index.record_changes(session, [patient.id])
+    # delete from both layouts, so no rows are left behind after switching layouts,
+    # and the hashes of a Patient that is still pending
+    for table in (models.BlockingValue, models.BlockingHash, models.PendingBlockingHash):
+        session.query(table).filter(table.patient_id == patient.id).delete()
 
     if commit:
         session.commit()
 
 
+def backfill_patient_features(
+    session: orm.Session, batch_size: int = 1000, commit: bool = True
+) -> int:
+    """
+    Compute and store the precomputed features for all Patients that are missing them.
+    The Patients are processed in batches, ordered by id, committing after each batch
+    so an interrupted backfill can be restarted without losing progress.
+
+    :param session: The database session
+    :param batch_size: The number of Patients to update per batch
+    :param commit: Whether to commit the transaction after each batch
+
+    :returns: The number of Patients updated
+    """
+    total: int = 0
+    cursor: int = 0
+    while True:
+        query = (
+            select(models.Patient.id, models.Patient.data)
+            .where(models.Patient.features.is_(None), models.Patient.id > cursor)
+            .order_by(models.Patient.id)
+            .limit(batch_size)
+        )
+        rows = session.execute(query).all()
+        if not rows:
+            break
+        session.execute(
+            update(models.Patient),
+            [
+                {"id": _id, "features": schemas.PIIRecord.from_data(data).to_features()}
+                for _id, data in rows
+            ],
+        )
+        total += len(rows)
+        cursor = rows[-1][0]
+        if commit:
+            session.commit()
+        LOGGER.info("backfilled patient features", extra={"count": total, "cursor": cursor})
+    return total
+
+
+def backfill_blocking_hashes(
+    session: orm.Session, batch_size: int = 1000, commit: bool = True
+) -> int:
+    """
+    Compute and store the BlockingHashes for all indexed Patients that are missing
+    them, used to populate the hash table before switching the `blocking_storage`
+    setting to "hash".  The Patients are processed in batches, ordered by id,
+    committing after each batch so an interrupted backfill can be restarted
+    without losing progress.
+
+    :param session: The database session
+    :param batch_size: The number of Patients to update per batch
+    :param commit: Whether to commit the transaction after each batch
+
+    :returns: The number of Patients updated
+    """
+    total: int = 0
+    cursor: int = 0
+    while True:
+        query = (
+            select(models.Patient.id, models.Patient.data)
+            .where(
+                models.Patient.id > cursor,
+                models.Patient.pending_index.is_(False),
+                ~exists().where(models.BlockingHash.patient_id == models.Patient.id),
+            )
+            .order_by(models.Patient.id)
+            .limit(batch_size)
+        )
+        rows = session.execute(query).all()
+        if not rows:
+            break
+        data = [
+            row
+            for _id, data in rows
+            for row in _blocking_hash_rows(_id, schemas.PIIRecord.from_data(data))
+        ]
+        if data:
+            session.execute(insert(models.BlockingHash), data)
+        total += len(rows)
+        cursor = rows[-1][0]
+        if commit:
+            session.commit()
+        LOGGER.info("backfilled blocking hashes", extra={"count": total, "cursor": cursor})
+    return total
+
+
+def _average_blocking_counts(session: orm.Session) -> dict[models.BlockingKey, float]:
+    """
+    Return the average number of Patients per distinct blocking value, by key, read
+    from the table set by the `blocking_storage` setting.
+    """
+    result: dict[models.BlockingKey, float] = {}
+    if settings.blocking_storage == "hash":
+        for key in models.BlockingKey:
+            hash_query = select(
+                func.count(), func.count(models.BlockingHash.hash.distinct())
+            ).where(models.BlockingHash.hash.between(*models.blocking_hash_range(key)))
+            total, distinct = session.execute(hash_query).one()
+            if distinct:
+                result[key] = total / distinct
+        return result
+    keys_by_id = {k.id: k for k in models.BlockingKey}
+    query = select(
+        models.BlockingValue.blockingkey,
+        func.count(),
+        func.count(models.BlockingValue.value.distinct()),
+    ).group_by(models.BlockingValue.blockingkey)
+    for key_id, total, distinct in session.execute(query):
+        result[keys_by_id[key_id]] = total / distinct
+    return result
+
+
+def _blocking_hash_value(session: orm.Session, key: models.BlockingKey, hash_: int) -> str | None:
+    """
+    Recover the blocking value of a hash, from the data of a Patient that has it.
+    """
+    query = (
+        select(models.Patient.data)
+        .join(models.BlockingHash, models.BlockingHash.patient_id == models.Patient.id)
+        .where(models.BlockingHash.hash == hash_)
+        .limit(1)
+    )
+    data = session.execute(query).scalar()
+    if data is None:
+        return None
+    values = schemas.PIIRecord.from_data(data).blocking_keys(key)
+    return next((v for v in values if models.blocking_hash(key, v) == hash_), None)
+
+
+def refresh_blocking_stats(session: orm.Session, min_count: int = 100, commit: bool = True) -> int:
+    """
+    Rebuild the BlockingStat table from the stored blocking values, read from the
+    table set by the `blocking_storage` setting.  Only the values shared by at
+    least min_count Patients are stored, the rest are assumed to be rare.  The
+    statistics aren't updated as Patients are inserted or deleted, as the counts
+    of the most common values would be updated by every insert, so this should
+    be run periodically.
+
+    When the `blocking_stop_value_ratio` setting is set, the values shared by
+    more than that many times the average number of Patients per value of their
+    key are flagged as stop values, and treated as missing when blocking.
+
+    :param session: The database session
+    :param min_count: The minimum number of Patients a value needs to be stored
+    :param commit: Whether to commit the transaction
+
+    :returns: The number of statistics stored
+    """
+    keys_by_id = {k.id: k for k in models.BlockingKey}
+    stats: dict[int, dict[str, typing.Any]] = {}
+    refreshed_at = now_utc()
+    if settings.blocking_storage == "hash":
+        hash_query = (
+            select(models.BlockingHash.hash, func.count())
+            .group_by(models.BlockingHash.hash)
+            .having(func.count() >= min_count)
+        )
+        for hash_, count in session.execute(hash_query):
+            stats[hash_] = {
+                "hash": hash_,
+                "count": count,
+                "stop": False,
+                "value": None,
+                "refreshed_at": refreshed_at,
+            }
+    else:
+        query = (
+            select(models.BlockingValue.blockingkey, models.BlockingValue.value, func.count())
+            .group_by(models.BlockingValue.blockingkey, models.BlockingValue.value)
+            .having(func.count() >= min_count)
+        )
+        for key_id, value, count in session.execute(query):
+            hash_ = models.blocking_hash(keys_by_id[key_id], value)
+            stat = stats.setdefault(
+                hash_,
+                {
+                    "hash": hash_,
+                    "count": 0,
+                    "stop": False,
+                    "value": value,
+                    "refreshed_at": refreshed_at,
+                },
+            )
+            # sum the counts of any values with colliding hashes
+            stat["count"] += count
+    if settings.blocking_stop_value_ratio and stats:
+        averages = _average_blocking_counts(session)
+        for hash_, stat in stats.items():
+            key = keys_by_id[hash_ >> models.BLOCKING_HASH_VALUE_BITS]
+            if stat["count"] > settings.blocking_stop_value_ratio * averages.get(key, 0):
+                stat["stop"] = True
+                if stat["value"] is None:
+                    stat["value"] = _blocking_hash_value(session, key, hash_)
+    session.query(models.BlockingStat).delete()
+    if stats:
+        session.execute(insert(models.BlockingStat), list(stats.values()))
+    if commit:
+        session.commit()
+    return len(stats)
+
+
+def get_blocking_stats_refreshed_at(session: orm.Session) -> datetime.datetime | None:
+    """
+    Return when the BlockingStat table was last rebuilt, see `refresh_blocking_stats`,
+    or None if it's empty.
+
+    :param session: The database session
+
+    :returns: The time of the last refresh
+    """
+    return session.scalar(select(func.max(models.BlockingStat.refreshed_at)))
+
+
+def get_blocking_stop_values(session: orm.Session) -> typing.Sequence[models.BlockingStat]:
+    """
+    Retrieve the blocking stop values, see `refresh_blocking_stats`, ordered from
+    most to least common.
+    """
+    query = (
+        select(models.BlockingStat)
+        .where(models.BlockingStat.stop.is_(True))
+        .order_by(models.BlockingStat.count.desc(), models.BlockingStat.hash)
+    )
+    return session.execute(query).scalars().all()
+
+
 def get_patients_by_reference_ids(
     session: orm.Session, *reference_ids: uuid.UUID
 ) -> list[models.Patient | None]:
@@ -390,6 +1759,21 @@ def get_patients_by_reference_ids(
     return [patients_by_id.get(ref_id) for ref_id in reference_ids]
 
 
+def get_patient_reference_ids_by_external_ids(
+    session: orm.Session, *external_ids: str
+) -> dict[str, uuid.UUID]:
+    """
+    Retrieve the reference ids of the Patients with any of the external patient ids,
+    keyed by external patient id.
+    """
+    if not external_ids:
+        return {}
+    query = select(models.Patient.external_patient_id, models.Patient.reference_id).where(
+        models.Patient.external_patient_id.in_(external_ids)
+    )
+    return {external_id: reference_id for external_id, reference_id in session.execute(query)}
+
+
 def get_person_by_reference_id(
     session: orm.Session, person_reference_id: uuid.UUID
 ) -> models.Person | None:
@@ -455,8 +1839,15 @@ def reset_mpi(session: orm.Session, commit: bool = True):
     Reset the MPI database by deleting all Person and Patient records.
     """
     session.query(models.BlockingValue).delete()
+    session.query(models.BlockingHash).delete()
+    session.query(models.PendingBlockingHash).delete()
+    session.query(models.BlockingStat).delete()
     session.query(models.Patient).delete()
     session.query(models.Person).delete()
+    if (index := blocking_index.current()) is not None:
+        index.clear()
+    # log the reset, so the other processes reload their index
+    blocking_index.record_changes(session, [None])
     if commit:
         session.commit()
 
@@ -0,0 +1,101 @@
+"""
+recordlinker.linking.compute
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+This module manages the executor that the CPU bound scoring stage of linkage is
+dispatched to, so it doesn't hold the GIL in the process serving requests (for
+the process pool), and so the number of scoring jobs waiting is bounded.
+"""
+
+import concurrent.futures
+import threading
+import typing
+
+from recordlinker.config import settings
+
+
+class QueueFullError(Exception):
+    """
+    Error raised when the compute executor already has the maximum number of
+    scoring jobs pending.
+    """
+
+    # The number of seconds a client should wait before retrying
+    retry_after: int = 1
+
+
+class ComputeExecutor:
+    """
+    A bounded wrapper around a thread or process pool.  At most `pool_size` jobs
+    run at once, and at most `queue_depth` more wait for a free worker.  Jobs
+    submitted beyond that are rejected with a QueueFullError, rather than letting
+    the queue, and the latency of every request, grow without bound.
+    """
+
+    def __init__(self, kind: typing.Literal["thread", "process"], pool_size: int, queue_depth: int):
+        self.kind = kind
+        self.pool_size = pool_size
+        self.queue_depth = queue_depth
+        self._executor: concurrent.futures.Executor
+        if kind == "process":
+            self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=pool_size)
+        else:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=pool_size, thread_name_prefix="recordlinker-compute"
+            )
+        self._slots = threading.BoundedSemaphore(pool_size + queue_depth)
+
+    def submit(
+        self, fn: typing.Callable[..., typing.Any], *args: typing.Any
+    ) -> concurrent.futures.Future:
+        """
+        Submit a job to the executor, raising a QueueFullError if there are no free slots.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise QueueFullError("compute queue is full")
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Shutdown the underlying pool.
+        """
+        self._executor.shutdown(wait=wait)
+
+
+_EXECUTOR: ComputeExecutor | None = None
+_LOCK = threading.Lock()
+
+
+def get_executor() -> ComputeExecutor | None:
+    """
+    Get the compute executor, creating it on first use.  Returns None when the
+    `compute_executor` setting is "none", and scoring should run in the caller.
+    """
+    global _EXECUTOR
+    if settings.compute_executor == "none":
+        return None
+    with _LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR = ComputeExecutor(
+                settings.compute_executor,
+                settings.compute_pool_size,
+                settings.compute_queue_depth,
+            )
+        return _EXECUTOR
+
+
+def shutdown_executor() -> None:
+    """
+    Shutdown the compute executor, if it has been created.
+    """
+    global _EXECUTOR
+    with _LOCK:
+        if _EXECUTOR is not None:
+            _EXECUTOR.shutdown()
+            _EXECUTOR = None
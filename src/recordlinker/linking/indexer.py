@@ -0,0 +1,103 @@
+"""
+recordlinker.linking.indexer
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+This module manages the background worker that inserts the BlockingValues of
+Patients linked with the `deferred_indexing` setting enabled.  Those Patients
+are committed with a pending marker, and the worker indexes them in batches, so
+the blocking value inserts aren't part of the link response latency.
+"""
+
+import logging
+import threading
+
+from sqlalchemy import orm
+
+from recordlinker import database
+from recordlinker.config import settings
+from recordlinker.database import mpi_service
+
+LOGGER = logging.getLogger(__name__)
+
+
+class BlockingIndexer(threading.Thread):
+    """
+    A daemon thread that checks for pending Patients every `interval` seconds, and
+    indexes them in batches of `batch_size` until there are none left.
+    """
+
+    def __init__(self, session_maker: orm.sessionmaker, batch_size: int, interval: float):
+        super().__init__(name="recordlinker-indexer", daemon=True)
+        self.session_maker = session_maker
+        self.batch_size = batch_size
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def flush(self) -> int:
+        """
+        Index all the pending Patients, committing after every batch.
+
+        :returns: The number of Patients indexed
+        """
+        total = 0
+        with self.session_maker() as session:
+            while count := mpi_service.index_pending_patients(session, self.batch_size):
+                total += count
+        return total
+
+    def run(self) -> None:
+        """
+        Flush the pending Patients until stopped, including once more after the
+        stop is requested.
+        """
+        while True:
+            stopped = self._stopped.wait(self.interval)
+            try:
+                if count := self.flush():
+                    LOGGER.info("indexed pending patients", extra={"count": count})
+            except Exception:
+                LOGGER.exception("error indexing pending patients")
+            if stopped:
+                return
+
+    def stop(self, wait: bool = True) -> None:
+        """
+        Stop the worker, after it indexes the remaining pending Patients.
+        """
+        self._stopped.set()
+        if wait:
+            self.join()
+
+
+_INDEXER: BlockingIndexer | None = None
+_LOCK = threading.Lock()
+
+
+def get_indexer() -> BlockingIndexer | None:
+    """
+    Get the blocking indexer, starting it on first use.  Returns None when the
+    `deferred_indexing` setting is disabled.
+    """
+    global _INDEXER
+    if not settings.deferred_indexing:
+        return None
+    with _LOCK:
+        if _INDEXER is None:
+            _INDEXER = BlockingIndexer(
+                database.SessionMaker,
+                settings.deferred_index_batch_size,
+                settings.deferred_index_interval,
+            )
+            _INDEXER.start()
+        return _INDEXER
+
+
+def stop_indexer() -> None:
+    """
+    Stop the blocking indexer, if it has been started.
+    """
+    global _INDEXER
+    with _LOCK:
+        if _INDEXER is not None:
+            _INDEXER.stop()
+            _INDEXER = None
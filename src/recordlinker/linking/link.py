@@ -5,19 +5,27 @@ recordlinker.linking.link
 This module is used to run the linkage algorithm using the MPI service
 """
 
+import asyncio
 import collections
 import dataclasses
 import logging
 import statistics
+import time
 import typing
 
 from sqlalchemy import orm
+from sqlalchemy.ext import asyncio as sa_asyncio
 
 from recordlinker import models
 from recordlinker import schemas
+from recordlinker.config import settings
 from recordlinker.database import mpi_service
+from recordlinker.schemas.algorithm import SkipValue
 from recordlinker.utils.mock import MockTracer
 
+from . import compute
+from . import indexer
+from . import plan
 from . import skip_values as sv
 
 LOGGER = logging.getLogger(__name__)
@@ -93,6 +101,40 @@ class LinkResult:
             self._update_score_tracking_row(earned_points, pass_lbl, rms, mmt, cmt, grade, median_features)
 
 
+class PatientRecordCache:
+    """
+    A cache of cleaned PIIRecords, keyed by Patient.id, that lives for a single
+    link call (or a single batch of link calls).  Each candidate Patient returned
+    by blocking is converted into a PIIRecord and cleaned of skip values once,
+    and then reused across all the passes of the algorithm.
+
+    NOTE: The cache assumes the skip values, and the Patient data, don't change
+    for its lifetime.  Don't share a cache across algorithms or transactions.
+    """
+
+    def __init__(self, skip_values: typing.Sequence[SkipValue]):
+        self.skip_values = skip_values
+        self._records: dict[int, schemas.PIIRecord] = {}
+
+    def __len__(self) -> int:
+        """
+        Return the number of cached records.
+        """
+        return len(self._records)
+
+    def get(self, patient: models.Patient) -> schemas.PIIRecord:
+        """
+        Return the cleaned PIIRecord for the Patient, hydrating it on the first call.
+        """
+        record = self._records.get(patient.id)
+        if record is None:
+            record = sv.remove_skip_values(
+                schemas.PIIRecord.from_patient(patient), self.skip_values
+            )
+            self._records[patient.id] = record
+        return record
+
+
 def invoke_evaluator(
     evaluator: schemas.Evaluator,
     record: schemas.PIIRecord,
@@ -168,6 +210,121 @@ def compare(
     return rule_result, feature_scores
 
 
+def compare_batch(
+    record: schemas.PIIRecord,
+    mpi_records: typing.Sequence[schemas.PIIRecord],
+    algorithm_pass: schemas.AlgorithmPass,
+    context: schemas.AlgorithmContext,
+) -> list[typing.Tuple[float, dict[str, float]]]:
+    """
+    Compare the incoming record to every candidate record in a pass at once,
+    evaluating one feature at a time across all the candidates.  The results
+    are identical to calling `compare` once per candidate, in the same order.
+
+    :param record: The new, incoming record, as a PIIRecord data type.
+    :param mpi_records: The candidate records returned by blocking from the MPI.
+    :algorithm_pass: A data structure containing information about the pass of
+      the algorithm in which this comparison is being run.
+    :context: A AlgorithmContext data structure containing data about the algorithm
+    :returns: A list of tuples, one per candidate, in the same format as `compare`.
+    """
+    return compare_compiled(record, mpi_records, plan.compile_pass(algorithm_pass, context))
+
+
+def compare_compiled(
+    record: schemas.PIIRecord,
+    mpi_records: typing.Sequence[schemas.PIIRecord],
+    compiled_pass: plan.CompiledPass,
+    profile: schemas.PassProfile | None = None,
+) -> list[typing.Tuple[float, dict[str, float]]]:
+    """
+    Compare the incoming record to every candidate record in a pass at once,
+    using a pass that has already been compiled.  See `compare_batch`.
+
+    :param record: The new, incoming record, as a PIIRecord data type.
+    :param mpi_records: The candidate records returned by blocking from the MPI.
+    :param compiled_pass: The compiled pass in which this comparison is being run.
+    :param profile: When given, the CPU time of each evaluator is added to the profile
+    :returns: A list of tuples, one per candidate, in the same format as `compare`.
+    """
+    # the per candidate details are only built when they will be logged
+    log = LOGGER.isEnabledFor(logging.INFO)
+    missing_field_weights: list[float] = [0.0] * len(mpi_records)
+    totals: list[float] = [0.0] * len(mpi_records)
+    details: list[dict[str, typing.Any]] = [{} for _ in mpi_records] if log else []
+    feature_scores: list[dict[str, float]] = [{} for _ in mpi_records]
+    for evaluator in compiled_pass.evaluators:
+        log_odds = evaluator.log_odds
+        feature_key = evaluator.feature_key
+        detail_key = evaluator.detail_key
+        started = time.thread_time() if profile is not None else 0.0
+        evaluated = evaluator.batch(record, mpi_records)
+        if profile is not None:
+            profile.feature_seconds[feature_key] = (
+                profile.feature_seconds.get(feature_key, 0.0) + time.thread_time() - started
+            )
+        for idx, result in enumerate(evaluated):
+            if result[1]:
+                # The field was missing, so update the running tally of how much
+                # the candidate is missing overall
+                missing_field_weights[idx] += log_odds
+            totals[idx] += result[0]
+            feature_scores[idx][feature_key] = result[0]
+            if log:
+                details[idx][detail_key] = result
+
+    max_missing_points = compiled_pass.max_missing_points
+    outputs: list[typing.Tuple[float, dict[str, float]]] = []
+    for idx in range(len(mpi_records)):
+        # Make sure this score wasn't just accumulated with missing checks
+        rule_result = totals[idx] if missing_field_weights[idx] <= max_missing_points else 0.0
+        if log:
+            details[idx]["rule.probabilistic_sum.results"] = rule_result
+            LOGGER.info("patient comparison", extra=details[idx])
+        outputs.append((rule_result, feature_scores[idx]))
+    return outputs
+
+
+def compare_cluster(
+    record: schemas.PIIRecord,
+    mpi_records: typing.Sequence[schemas.PIIRecord],
+    compiled_pass: plan.CompiledPass,
+    profile: schemas.PassProfile | None = None,
+) -> list[typing.Tuple[float, dict[str, float]]] | None:
+    """
+    Compare the incoming record to the records in a Person cluster, stopping as
+    soon as the outcome for the cluster is known.  A bare majority of the records
+    are compared first, if they all have identical results the median of the cluster
+    (and of each feature) is fixed, and the remaining records don't need to be
+    compared.  Otherwise if the cluster can't reach the minimum match threshold,
+    even if every remaining record scores the maximum points, it is skipped.
+
+    :param record: The new, incoming record, as a PIIRecord data type.
+    :param mpi_records: The records in the Person cluster.
+    :param compiled_pass: The compiled pass in which this comparison is being run.
+    :param profile: When given, the CPU time of each evaluator, and whether the
+      cluster's median was fixed early, are recorded in the profile
+    :returns: The results of the records that were compared, in the same format as
+      `compare_batch`, or None if the cluster can't be a match.
+    """
+    total = len(mpi_records)
+    quorum = total // 2 + 1
+    compared = compare_compiled(record, mpi_records[:quorum], compiled_pass, profile)
+    if quorum == total:
+        return compared
+    if all(c == compared[0] for c in compared[1:]):
+        if profile is not None:
+            profile.persons_decided_early += 1
+        return compared
+    # the best median possible, if all the remaining records earned every point
+    best_median = statistics.median(
+        [c[0] for c in compared] + [compiled_pass.max_points] * (total - quorum)
+    )
+    if best_median / compiled_pass.max_points < compiled_pass.minimum_match_threshold:
+        return None
+    return compared + compare_compiled(record, mpi_records[quorum:], compiled_pass, profile)
+
+
 def grade_rms(rms: float, mmt: float, cmt: float) -> schemas.MatchGrade:
     """
     Helper function to assign a match-grade (derived from FHIR spec terminology)
@@ -181,137 +338,213 @@ def grade_rms(rms: float, mmt: float, cmt: float) -> schemas.MatchGrade:
     return "certain"
 
 
-def link_record_against_mpi(
+class ClusterScore(typing.NamedTuple):
+    """
+    The score of an incoming record against a single Person cluster in a pass.  A
+    compact tuple, so it's cheap to send back from a compute worker process.
+    """
+
+    median: float
+    rms: float
+    match_grade: schemas.MatchGrade
+    median_features: dict[str, float]
+    compared: int
+
+
+def group_clusters(
+    candidates: dict[str, list[models.Patient]],
+    compiled: plan.CompiledAlgorithm,
+    cache: PatientRecordCache,
+) -> list[dict[models.Person, list[schemas.PIIRecord]]]:
+    """
+    Group the candidate Patients identified in blocking into Person clusters of
+    cleaned PIIRecords, for each pass of the algorithm in order.
+
+    :param candidates: The candidate Patients for each pass, keyed by pass label
+    :param compiled: The compiled execution plan for the algorithm
+    :param cache: The cache of cleaned candidate records
+    :returns: A dictionary of Person to cluster records, for each pass
+    """
+    clusters: list[dict[models.Person, list[schemas.PIIRecord]]] = []
+    for compiled_pass in compiled.passes:
+        # initialize a dictionary to hold the clusters of patients for each person
+        pass_clusters: dict[models.Person, list[schemas.PIIRecord]] = collections.defaultdict(
+            list
+        )
+        # iterate over the patients blocked in this pass, grouping them by person
+        for pat in candidates[compiled_pass.label]:
+            # convert the Patient model into a cleaned PIIRecord for comparison
+            pass_clusters[pat.person].append(cache.get(pat))
+        clusters.append(pass_clusters)
+    return clusters
+
+
+def score_clusters(
     record: schemas.PIIRecord,
-    session: orm.Session,
-    algorithm: schemas.Algorithm,
-    external_person_id: typing.Optional[str] = None,
-    persist: bool = True,
-) -> tuple[models.Patient | None, models.Person | None, list[LinkResult], schemas.MatchGrade]:
+    compiled: plan.CompiledAlgorithm,
+    clusters: list[list[list[schemas.PIIRecord]]],
+    profiles: typing.Sequence[schemas.PassProfile] | None = None,
+) -> list[list[ClusterScore | None]]:
     """
-    Runs record linkage on a single incoming record (extracted from a FHIR
-    bundle) using an existing database as an MPI. Uses a flexible algorithm
-    configuration to allow customization of the exact kind of linkage to
-    run. Linkage is assumed to run using cluster membership (i.e. the new
-    record must match a certain proportion of existing records all assigned
-    to a person in order to match), and if multiple persons are matched,
-    the new record is linked to the person with the strongest membership
-    percentage.
+    Score the incoming record against the Person clusters of each pass.  This is
+    the CPU bound stage of linkage, it doesn't access the database and only takes
+    and returns picklable values, so it can be dispatched to a compute worker
+    process.
+
+    :param record: The incoming record, with its features precomputed
+    :param compiled: The compiled execution plan for the algorithm
+    :param clusters: The cleaned records of each Person cluster, for each pass
+    :param profiles: When given, the scoring of each pass is recorded in its profile,
+      see `explain_record_against_mpi`
+    :returns: The score of each cluster, for each pass, or None if the cluster was
+      skipped by early termination.  If early termination finds a certain match,
+      the remaining passes are omitted.
+    """
+    context: schemas.AlgorithmContext = compiled.context
+    scored: list[list[ClusterScore | None]] = []
+    for idx, (compiled_pass, pass_clusters) in enumerate(zip(compiled.passes, clusters)):
+        profile = profiles[idx] if profiles is not None else None
+        with TRACER.start_as_current_span("link.pass"):
+            with TRACER.start_as_current_span("link.compare"):
+                cluster_results: list[list[typing.Tuple[float, dict[str, float]]] | None]
+                if context.early_termination:
+                    # score each cluster separately, so it can stop early
+                    cluster_results = [
+                        compare_cluster(record, mpi_records, compiled_pass, profile)
+                        for mpi_records in pass_clusters
+                    ]
+                else:
+                    # score the incoming record against every candidate in the pass
+                    # at once, then split the scores back out by Person cluster
+                    compared = iter(
+                        compare_compiled(
+                            record,
+                            [r for mpi_records in pass_clusters for r in mpi_records],
+                            compiled_pass,
+                            profile,
+                        )
+                    )
+                    cluster_results = [
+                        [next(compared) for _ in mpi_records] for mpi_records in pass_clusters
+                    ]
+            pass_scores: list[ClusterScore | None] = []
+            for cluster_result in cluster_results:
+                if cluster_result is None:
+                    # the cluster can't reach the minimum match threshold
+                    pass_scores.append(None)
+                    continue
+                # track the accumulated points so we can eventually find
+                # the median and normalize it
+                log_odds_sums = [r[0] for r in cluster_result]
+                feature_scores_dicts = [r[1] for r in cluster_result]
+                # Calculate median feature contributions from each match
+                median_features = {}
+                for e in compiled_pass.evaluators:
+                    median_features[e.feature_key] = statistics.median(
+                        [fd[e.feature_key] for fd in feature_scores_dicts]
+                    )
+                # Calculate the relative match score for this person cluster
+                cluster_median = statistics.median(log_odds_sums)
+                rms = cluster_median / compiled_pass.max_points
+                match_grade = grade_rms(
+                    rms,
+                    compiled_pass.minimum_match_threshold,
+                    compiled_pass.certain_match_threshold,
+                )
+                pass_scores.append(
+                    ClusterScore(
+                        cluster_median, rms, match_grade, median_features, len(cluster_result)
+                    )
+                )
+            scored.append(pass_scores)
 
-    :param record: The PIIRecord to try to match to
-      other records in the MPI.
-    :param session: The SQLAlchemy session to use for database operations.
-    :param algorithm: An algorithm configuration object
-    :param external_person_id: An optional external identifier for the person
-    :param persist: Whether to save the new patient record to the database
-    :returns: A tuple consisting of a boolean indicating whether a match
-      was found for the new record in the MPI, followed by the ID of the
-      Person entity now associated with the incoming patient (either a
-      new Person ID or the ID of an existing matched Person).
+        if context.early_termination and not context.include_multiple_matches:
+            if any(s is not None and s.match_grade == "certain" for s in pass_scores):
+                # a certain match has been found, and only one will be returned
+                break
+    return scored
+
+
+def grade_clusters(
+    clusters: list[dict[models.Person, list[schemas.PIIRecord]]],
+    scored: list[list[ClusterScore | None]],
+    compiled: plan.CompiledAlgorithm,
+    persist: bool = True,
+) -> tuple[models.Person | None, list[LinkResult], schemas.MatchGrade, dict[str, int]]:
+    """
+    Combine the cluster scores of every pass into the link results for each Person,
+    and grade the final result.
+
+    :param clusters: The Person clusters for each pass, from `group_clusters`
+    :param scored: The cluster scores for each pass, from `score_clusters`
+    :param compiled: The compiled execution plan for the algorithm
+    :param persist: Whether to create a new Person if there is no match
+    :returns: A tuple of the matched Person (if any), the link results, the final
+      match grade and the counts of the records compared and skipped
     """
     # Membership scores need to persist across linkage passes so that we can
     # find the highest scoring match across all passes
     scores: dict[models.Person, LinkResult] = {}
-    # get the algorithm context
-    context: schemas.AlgorithmContext = algorithm.algorithm_context
+    context: schemas.AlgorithmContext = compiled.context
 
     # initialize counters to track evaluation results to log
     result_counts: dict[str, int] = {
         "persons_compared": 0,
+        "persons_skipped": 0,
         "patients_compared": 0,
     }
-    # clean the incoming record
-    cleaned_record: schemas.PIIRecord = sv.remove_skip_values(record, context.skip_values)
-    for idx, algorithm_pass in enumerate(algorithm.passes):
-        with TRACER.start_as_current_span("link.pass"):
-            pass_label = algorithm_pass.label or f"pass_{idx}"
-            minimum_match_threshold, certain_match_threshold = algorithm_pass.possible_match_window
-            # Determine the maximum possible number of log-odds points in this pass
-            max_points: float = sum(
-                [context.get_log_odds(e.feature) or 0.0 for e in algorithm_pass.evaluators]
+    for compiled_pass, pass_clusters, pass_scores in zip(compiled.passes, clusters, scored):
+        pass_label = compiled_pass.label
+        minimum_match_threshold = compiled_pass.minimum_match_threshold
+        certain_match_threshold = compiled_pass.certain_match_threshold
+        for person, score in zip(pass_clusters, pass_scores):
+            assert pass_clusters[person], "Patient cluster should not be empty"
+            if score is None:
+                result_counts["persons_skipped"] += 1
+                continue
+            result_counts["persons_compared"] += 1
+            result_counts["patients_compared"] += score.compared
+
+            LOGGER.info(
+                "cluster statistics",
+                extra={
+                    "median log-odds points accumulated": score.median,
+                    "relative match score": score.rms,
+                    "person.reference_id": str(person.reference_id),
+                    "patients compared in cluster": score.compared,
+                    "algorithm.minimum_match_threshold": minimum_match_threshold,
+                    "algorithm.certain_match_threshold": certain_match_threshold,
+                },
             )
-
-            # initialize a dictionary to hold the clusters of patients for each person
-            clusters: dict[models.Person, list[schemas.PIIRecord]] = collections.defaultdict(list)
-
-            # block on the cleaned_record and the algorithm's blocking criteria, then
-            # iterate over the patients, grouping them by person
-            with TRACER.start_as_current_span("link.block"):
-                # get all candidate Patient records identified in blocking
-                # and the remaining Patient records in their Person clusters
-                pats = mpi_service.BlockData.get(session, cleaned_record, algorithm_pass, context)
-                for pat in pats:
-                    # convert the Patient model into a cleaned PIIRecord for comparison
-                    mpi_record: schemas.PIIRecord = sv.remove_skip_values(
-                        schemas.PIIRecord.from_patient(pat), context.skip_values
+            # The match strength must be above the minimum user threshold in order
+            # for this cluster to be worth remembering
+            if score.rms >= minimum_match_threshold:
+                if person not in scores:
+                    scores[person] = LinkResult(
+                        person,
+                        score.median,
+                        pass_label,
+                        score.rms,
+                        minimum_match_threshold,
+                        certain_match_threshold,
+                        score.match_grade,
+                        score.median_features,
                     )
-                    clusters[pat.person].append(mpi_record)
-
-            # evaluate each Person cluster to see if the incoming record is a match
-            with TRACER.start_as_current_span("link.evaluate"):
-                for person, mpi_records in clusters.items():
-                    assert mpi_records, "Patient cluster should not be empty"
-                    log_odds_sums = []
-                    feature_scores_dicts = []
-                    for mpi_record in mpi_records:
-                        with TRACER.start_as_current_span("link.compare"):
-                            # track the accumulated points so we can eventually find
-                            # the median and normalize it
-                            rule_result, feature_scores = compare(
-                                record,
-                                mpi_record,
-                                algorithm_pass,
-                                context,
-                            )
-                            log_odds_sums.append(rule_result)
-                            feature_scores_dicts.append(feature_scores)
-
-                    result_counts["persons_compared"] += 1
-                    result_counts["patients_compared"] += len(mpi_records)
-                    # Calculate median feature contributions from each match
-                    median_features = {}
-                    for e in algorithm_pass.evaluators:
-                        median_features[str(e.feature)] = statistics.median([fd[str(e.feature)] for fd in feature_scores_dicts])
-                    # Calculate the relative match score for this person cluster
-                    cluster_median = statistics.median(log_odds_sums)
-                    rms = cluster_median / max_points
-                    match_grade = grade_rms(rms, minimum_match_threshold, certain_match_threshold)
-
-                    LOGGER.info(
-                        "cluster statistics",
-                        extra={
-                            "median log-odds points accumulated": cluster_median,
-                            "relative match score": rms,
-                            "person.reference_id": str(person.reference_id),
-                            "patients compared in cluster": len(mpi_records),
-                            "algorithm.minimum_match_threshold": minimum_match_threshold,
-                            "algorithm.certain_match_threshold": certain_match_threshold,
-                        },
-                    )
-                    # The match strength must be above the minimum user threshold in order
-                    # for this cluster to be worth remembering
-                    if rms >= minimum_match_threshold:
-                        if person not in scores:
-                            scores[person] = LinkResult(
-                                person,
-                                cluster_median,
-                                pass_label,
-                                rms,
-                                minimum_match_threshold,
-                                certain_match_threshold,
-                                match_grade,
-                                median_features
-                            )
-                        # Let the dynamic programming table track its own updates
-                        scores[person].check_and_update_score(
-                            cluster_median,
-                            pass_label,
-                            rms,
-                            minimum_match_threshold,
-                            certain_match_threshold,
-                            match_grade,
-                            median_features
-                        )
+                # Let the dynamic programming table track its own updates
+                scores[person].check_and_update_score(
+                    score.median,
+                    pass_label,
+                    score.rms,
+                    minimum_match_threshold,
+                    certain_match_threshold,
+                    score.match_grade,
+                    score.median_features,
+                )
+    if len(scored) < len(compiled.passes):
+        LOGGER.info(
+            "skipping remaining passes",
+            extra={"result.label_of_matching_pass": compiled.passes[len(scored) - 1].label},
+        )
 
     results: list[LinkResult] = sorted(scores.values(), reverse=True, key=lambda x: x.rms)
     certain_results = [x for x in results if x.match_grade == "certain"]
@@ -340,28 +573,72 @@ def link_record_against_mpi(
             # make sure we return all the actual 'certain' matches
             results = certain_results
 
-    patient: typing.Optional[models.Patient] = None
-    if persist:
-        with TRACER.start_as_current_span("insert"):
-            patient = mpi_service.insert_patient(
-                session,
-                record,
-                matched_person,
-                record.external_id,
-                external_person_id,
-                commit=False,
-            )
+    return (matched_person, results, final_grade, result_counts)
+
+
+def _scoring_args(
+    record: schemas.PIIRecord,
+    compiled: plan.CompiledAlgorithm,
+    clusters: list[dict[models.Person, list[schemas.PIIRecord]]],
+) -> tuple[schemas.PIIRecord, plan.CompiledAlgorithm, list[list[list[schemas.PIIRecord]]]]:
+    """
+    Build the picklable arguments to `score_clusters`.
+    """
+    # normalize the incoming feature values once, rather than once per comparison
+    scoring_record: schemas.PIIRecord = record.model_copy().precompute_features()
+    return (scoring_record, compiled, [list(c.values()) for c in clusters])
+
+
+def evaluate_candidates(
+    record: schemas.PIIRecord,
+    candidates: dict[str, list[models.Patient]],
+    compiled: plan.CompiledAlgorithm,
+    cache: PatientRecordCache,
+    persist: bool = True,
+) -> tuple[models.Person | None, list[LinkResult], schemas.MatchGrade, dict[str, int]]:
+    """
+    Score an incoming record against the candidate Patients identified in blocking
+    for each pass of the algorithm, and grade the result.  This stage doesn't
+    access the database, the candidates (and their Persons) must already be loaded.
+    The scoring is dispatched to the compute executor, if one is configured.
+
+    :param record: The PIIRecord to try to match to other records in the MPI.
+    :param candidates: The candidate Patients for each pass, keyed by pass label
+    :param compiled: The compiled execution plan for the algorithm
+    :param cache: The cache of cleaned candidate records
+    :param persist: Whether to create a new Person if there is no match
+    :returns: A tuple of the matched Person (if any), the link results, the final
+      match grade and the counts of the records compared and skipped
+    :raises compute.QueueFullError: If the compute executor is full
+    """
+    clusters = group_clusters(candidates, compiled, cache)
+    with TRACER.start_as_current_span("link.evaluate"):
+        args = _scoring_args(record, compiled, clusters)
+        executor = compute.get_executor()
+        if executor is None:
+            scored = score_clusters(*args)
+        else:
+            scored = executor.submit(score_clusters, *args).result()
+    return grade_clusters(clusters, scored, compiled, persist=persist)
+
 
+def log_link_result(
+    patient: models.Patient | None,
+    matched_person: models.Person | None,
+    results: list[LinkResult],
+    final_grade: schemas.MatchGrade,
+    result_counts: dict[str, int],
+) -> None:
+    """
+    Log the final results of linking a single record.
+    """
     # Put together some strings to report the result, window, and interpretation
     # to the user; we don't save certainly-not grades in the dynamic table
     best_score_str: str = "n/a"
     reference_range: str = "n/a"
     matching_pass_label: str = "n/a"
-    if final_grade == "certain":
-        best_score_str = str(certain_results[0].rms)
-        reference_range = f"({certain_results[0].mmt}, {certain_results[0].cmt})"
-        matching_pass_label = certain_results[0].pass_label
-    elif final_grade == "possible":
+    if final_grade != "certainly-not":
+        # the best certain, or possible, result is always first
         best_score_str = str(results[0].rms)
         reference_range = f"({results[0].mmt}, {results[0].cmt})"
         matching_pass_label = results[0].pass_label
@@ -375,7 +652,334 @@ def link_record_against_mpi(
             "result.label_of_matching_pass": matching_pass_label,
             "result.best_match_reference_window": reference_range,
             "result.count_patients_compared": result_counts["patients_compared"],
+            "result.count_persons_skipped": result_counts["persons_skipped"],
         },
     )
+
+
+def link_record_against_mpi(
+    record: schemas.PIIRecord,
+    session: orm.Session,
+    algorithm: schemas.Algorithm,
+    external_person_id: typing.Optional[str] = None,
+    persist: bool = True,
+    cache: typing.Optional[PatientRecordCache] = None,
+) -> tuple[models.Patient | None, models.Person | None, list[LinkResult], schemas.MatchGrade]:
+    """
+    Runs record linkage on a single incoming record (extracted from a FHIR
+    bundle) using an existing database as an MPI. Uses a flexible algorithm
+    configuration to allow customization of the exact kind of linkage to
+    run. Linkage is assumed to run using cluster membership (i.e. the new
+    record must match a certain proportion of existing records all assigned
+    to a person in order to match), and if multiple persons are matched,
+    the new record is linked to the person with the strongest membership
+    percentage.
+
+    :param record: The PIIRecord to try to match to
+      other records in the MPI.
+    :param session: The SQLAlchemy session to use for database operations.
+    :param algorithm: An algorithm configuration object
+    :param external_person_id: An optional external identifier for the person
+    :param persist: Whether to save the new patient record to the database
+    :param cache: An optional cache of cleaned candidate records, to share across
+      multiple calls using the same algorithm
+    :returns: A tuple consisting of a boolean indicating whether a match
+      was found for the new record in the MPI, followed by the ID of the
+      Person entity now associated with the incoming patient (either a
+      new Person ID or the ID of an existing matched Person).
+    """
+    # get the compiled execution plan and context for the algorithm
+    compiled: plan.CompiledAlgorithm = plan.compile_algorithm(algorithm)
+    context: schemas.AlgorithmContext = compiled.context
+    # cache the cleaned candidate records, so each is only hydrated once across passes
+    cache = cache if cache is not None else PatientRecordCache(context.skip_values)
+    # clean the incoming record
+    cleaned_record: schemas.PIIRecord = sv.remove_skip_values(record, context.skip_values)
+    # block on the cleaned_record and the blocking criteria of every pass in a
+    # single query, getting all candidate Patient records identified in blocking
+    # and the remaining Patient records in their Person clusters
+    with TRACER.start_as_current_span("link.block"):
+        candidates: dict[str, list[models.Patient]] = mpi_service.BlockData.get_multi(
+            session,
+            cleaned_record,
+            compiled.algorithm.passes,
+            context,
+            max_cluster_size=settings.max_cluster_size,
+            max_candidates=settings.max_blocking_candidates,
+        )
+    matched_person, results, final_grade, result_counts = evaluate_candidates(
+        record, candidates, compiled, cache, persist=persist
+    )
+
+    patient: typing.Optional[models.Patient] = None
+    if persist:
+        with TRACER.start_as_current_span("insert"):
+            patient = mpi_service.insert_patient(
+                session,
+                record,
+                matched_person,
+                record.external_id,
+                external_person_id,
+                commit=False,
+                defer_index=settings.deferred_indexing,
+            )
+            # make sure the worker is running to index the pending Patient
+            indexer.get_indexer()
+
+    log_link_result(patient, matched_person, results, final_grade, result_counts)
     # return a tuple indicating whether a match was found and the person ID
     return (patient, matched_person, results, final_grade)
+
+
+async def link_record_against_mpi_async(
+    record: schemas.PIIRecord,
+    session: sa_asyncio.AsyncSession,
+    algorithm: schemas.Algorithm,
+    external_person_id: typing.Optional[str] = None,
+    persist: bool = True,
+    cache: typing.Optional[PatientRecordCache] = None,
+) -> tuple[models.Patient | None, models.Person | None, list[LinkResult], schemas.MatchGrade]:
+    """
+    Async variant of `link_record_against_mpi`.  The blocking queries and the
+    Patient insert are awaited, so the event loop is free to serve other requests
+    while waiting on the database.  The scoring is run in a worker thread, or on
+    the compute executor if one is configured, for the same reason.  The results
+    are the same as the sync variant.
+
+    :param record: The PIIRecord to try to match to other records in the MPI.
+    :param session: The async SQLAlchemy session to use for database operations.
+    :param algorithm: An algorithm configuration object
+    :param external_person_id: An optional external identifier for the person
+    :param persist: Whether to save the new patient record to the database
+    :param cache: An optional cache of cleaned candidate records
+    :returns: A tuple in the same format as returned by `link_record_against_mpi`.
+    """
+    compiled: plan.CompiledAlgorithm = plan.compile_algorithm(algorithm)
+    context: schemas.AlgorithmContext = compiled.context
+    cache = cache if cache is not None else PatientRecordCache(context.skip_values)
+    cleaned_record: schemas.PIIRecord = sv.remove_skip_values(record, context.skip_values)
+    with TRACER.start_as_current_span("link.block"):
+        candidates: dict[str, list[models.Patient]] = await mpi_service.BlockData.get_multi_async(
+            session,
+            cleaned_record,
+            compiled.algorithm.passes,
+            context,
+            max_cluster_size=settings.max_cluster_size,
+            max_candidates=settings.max_blocking_candidates,
+        )
+    clusters = group_clusters(candidates, compiled, cache)
+    with TRACER.start_as_current_span("link.evaluate"):
+        args = _scoring_args(record, compiled, clusters)
+        executor = compute.get_executor()
+        # score off the event loop, so it's free to serve other requests
+        if executor is None:
+            scored = await asyncio.to_thread(score_clusters, *args)
+        else:
+            scored = await asyncio.wrap_future(executor.submit(score_clusters, *args))
+    matched_person, results, final_grade, result_counts = grade_clusters(
+        clusters, scored, compiled, persist=persist
+    )
+
+    patient: typing.Optional[models.Patient] = None
+    if persist:
+        with TRACER.start_as_current_span("insert"):
+            patient = await mpi_service.insert_patient_async(
+                session,
+                record,
+                matched_person,
+                record.external_id,
+                external_person_id,
+                commit=False,
+                defer_index=settings.deferred_indexing,
+            )
+            # make sure the worker is running to index the pending Patient
+            indexer.get_indexer()
+
+    log_link_result(patient, matched_person, results, final_grade, result_counts)
+    return (patient, matched_person, results, final_grade)
+
+
+def explain_record_against_mpi(
+    record: schemas.PIIRecord,
+    session: orm.Session,
+    algorithm: schemas.Algorithm,
+) -> tuple[models.Person | None, list[LinkResult], schemas.MatchGrade, schemas.MatchProfile]:
+    """
+    Runs record linkage on a single incoming record without saving it, like
+    `link_record_against_mpi` with persist=False, and profiles each pass of the
+    algorithm: the blocking keys used and skipped, the SQL time, the number of
+    Persons and Patients hydrated and filtered, the CPU time of each evaluator and
+    the early termination decisions.
+
+    To attribute the time to each pass, the blocking query of each pass is run on
+    its own, rather than combined into a single round-trip, and the scoring is run
+    in this thread, rather than dispatched to the compute executor.  The results
+    are the same.
+
+    :param record: The PIIRecord to try to match to other records in the MPI.
+    :param session: The SQLAlchemy session to use for database operations.
+    :param algorithm: An algorithm configuration object
+    :returns: A tuple of the matched Person (if any), the link results, the final
+      match grade and the profile of the match
+    """
+    started = time.perf_counter()
+    compiled: plan.CompiledAlgorithm = plan.compile_algorithm(algorithm)
+    context: schemas.AlgorithmContext = compiled.context
+    cache = PatientRecordCache(context.skip_values)
+    cleaned_record: schemas.PIIRecord = sv.remove_skip_values(record, context.skip_values)
+    profiles = [schemas.PassProfile(label=p.label) for p in compiled.passes]
+    candidates: dict[str, list[models.Patient]] = {}
+    for compiled_pass, profile in zip(compiled.passes, profiles):
+        blocking_started = time.perf_counter()
+        candidates[compiled_pass.label] = list(
+            mpi_service.BlockData.get(
+                session,
+                cleaned_record,
+                compiled_pass.algorithm_pass,
+                context,
+                max_cluster_size=settings.max_cluster_size,
+                max_candidates=settings.max_blocking_candidates,
+                profile=profile,
+            )
+        )
+        profile.blocking_seconds = time.perf_counter() - blocking_started
+    clusters = group_clusters(candidates, compiled, cache)
+    scoring_started = time.thread_time()
+    scored = score_clusters(*_scoring_args(record, compiled, clusters), profiles=profiles)
+    scoring_seconds = time.thread_time() - scoring_started
+    for profile, pass_scores in zip(profiles, scored):
+        for score in pass_scores:
+            if score is None:
+                profile.persons_skipped += 1
+                continue
+            profile.persons_compared += 1
+            profile.patients_compared += score.compared
+    for profile in profiles[len(scored) :]:
+        profile.skipped = "certain match in an earlier pass"
+    matched_person, results, final_grade, _ = grade_clusters(
+        clusters, scored, compiled, persist=False
+    )
+    return (
+        matched_person,
+        results,
+        final_grade,
+        schemas.MatchProfile(
+            passes=profiles,
+            scoring_seconds=scoring_seconds,
+            total_seconds=time.perf_counter() - started,
+        ),
+    )
+
+
+def link_records_against_mpi(
+    records: typing.Sequence[schemas.PIIRecord],
+    session: orm.Session,
+    algorithm: schemas.Algorithm,
+    external_person_ids: typing.Optional[typing.Sequence[typing.Optional[str]]] = None,
+    persist: bool = True,
+) -> list[tuple[models.Patient | None, models.Person | None, list[LinkResult], schemas.MatchGrade]]:
+    """
+    Runs record linkage on a batch of incoming records using an existing database
+    as an MPI. The records are linked in input order within the same session, and
+    each persisted Patient is flushed before the next record is blocked, so record
+    k can link to a Person created by any record j<k in the same batch. The
+    algorithm is resolved once by the caller and shared by the whole batch, as is
+    the cache of cleaned candidate records.
+
+    NOTE: The blocking isn't batched, each record still runs its own blocking
+    queries, as a record must be blocked after the Patients of the records before
+    it are flushed.  A batch saves the per-request overhead, not the per-record
+    database round-trips.
+
+    :param records: The PIIRecords to try to match to other records in the MPI.
+    :param session: The SQLAlchemy session to use for database operations.
+    :param algorithm: An algorithm configuration object
+    :param external_person_ids: An optional list of external person identifiers,
+      one per record
+    :param persist: Whether to save the new patient records to the database
+    :returns: A list of link results, in the same order as the input records, each
+      in the same format as returned by `link_record_against_mpi`.
+    """
+    if external_person_ids is not None and len(external_person_ids) != len(records):
+        raise ValueError("Records and external person ids must be the same length")
+
+    results = []
+    # share the cleaned candidate records across the whole batch
+    cache = PatientRecordCache(algorithm.algorithm_context.skip_values)
+    with TRACER.start_as_current_span("link.batch"):
+        for idx, record in enumerate(records):
+            results.append(
+                link_record_against_mpi(
+                    record,
+                    session,
+                    algorithm,
+                    external_person_id=external_person_ids[idx] if external_person_ids else None,
+                    persist=persist,
+                    cache=cache,
+                )
+            )
+    LOGGER.info(
+        "batch linkage results",
+        extra={
+            "batch.size": len(records),
+            "batch.certain": sum(1 for r in results if r[3] == "certain"),
+            "batch.possible": sum(1 for r in results if r[3] == "possible"),
+            "batch.cached_records": len(cache),
+        },
+    )
+    return results
+
+
+def link_stream_chunk(
+    session: orm.Session,
+    algorithm: schemas.Algorithm,
+    chunk: list[tuple[int, schemas.PIIRecord | str]],
+    skip_existing: bool = False,
+) -> list[schemas.LinkStreamResult]:
+    """
+    Link and commit a chunk of streamed records, returning a result for each line.
+
+    :param session: The SQLAlchemy session to use for database operations.
+    :param algorithm: An algorithm configuration object
+    :param chunk: A list of (line, record or error) tuples, the error is the reason
+      the line could not be parsed
+    :param skip_existing: Skip the records with an external_id that is already on a
+      Patient in the MPI, so a chunk that was committed but never acknowledged can
+      be replayed without linking its records twice
+    :returns: A list of results, one for each line in the chunk
+    """
+    existing: dict[str, typing.Any] = {}
+    if skip_existing:
+        external_ids = [
+            r.external_id for _, r in chunk if isinstance(r, schemas.PIIRecord) and r.external_id
+        ]
+        existing = mpi_service.get_patient_reference_ids_by_external_ids(session, *external_ids)
+    records = [
+        r for _, r in chunk if isinstance(r, schemas.PIIRecord) and r.external_id not in existing
+    ]
+    try:
+        linked = iter(link_records_against_mpi(records, session, algorithm, persist=True))
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    results: list[schemas.LinkStreamResult] = []
+    for line, record in chunk:
+        if not isinstance(record, schemas.PIIRecord):
+            # the line could not be parsed, the record is the error message
+            results.append(schemas.LinkStreamResult(line=line, error=record))
+            continue
+        if record.external_id in existing:
+            error = f"already linked as patient {existing[record.external_id]}"
+            results.append(schemas.LinkStreamResult(line=line, error=error))
+            continue
+        patient, person, matches, match_grade = next(linked)
+        assert patient is not None, "Patient should always be created"
+        response = schemas.LinkResponse(
+            match_grade=match_grade,
+            patient_reference_id=patient.reference_id,
+            person_reference_id=(person and person.reference_id),
+            results=[schemas.LinkResult(**r.__dict__) for r in matches],
+        )
+        results.append(schemas.LinkStreamResult(line=line, result=response))
+    return results
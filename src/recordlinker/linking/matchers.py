@@ -45,6 +45,15 @@ class FeatureFunc(enum.Enum):
             self._callable = getattr(sys.modules[__name__], self.value.lower())
         return self._callable
 
+    def batch_callable(self) -> typing.Callable:
+        """
+        Returns the batch callable associated with the FeatureFunc, which compares
+        one incoming record against many MPI records in a single call.
+        """
+        if not hasattr(self, "_batch_callable"):
+            self._batch_callable = getattr(sys.modules[__name__], f"batch_{self.value.lower()}")
+        return self._batch_callable
+
 
 def compare_probabilistic_exact_match(
     record: PIIRecord,
@@ -79,8 +88,8 @@ def compare_probabilistic_exact_match(
     :return: A tuple containing: a float of the score the feature comparison
       earned, and a boolean indicating whether one of the Fields was missing.
     """
-    incoming_record_fields = list(record.feature_iter(key, prepend_suffix=prepend_suffix))
-    mpi_record_fields = list(mpi_record.feature_iter(key, prepend_suffix=prepend_suffix))
+    incoming_record_fields = record.feature_values(key, prepend_suffix=prepend_suffix)
+    mpi_record_fields = mpi_record.feature_values(key, prepend_suffix=prepend_suffix)
     if len(incoming_record_fields) == 0 or len(mpi_record_fields) == 0:
         # Return early if a field is missing, and log that was the case
         return (missing_field_points_proportion * log_odds, True)
@@ -131,8 +140,8 @@ def compare_probabilistic_fuzzy_match(
     :return: A tuple containing: a float of the score the feature comparison
       earned, and a boolean indicating whether one of the Fields was missing.
     """
-    incoming_record_fields = list(record.feature_iter(key, prepend_suffix=True))
-    mpi_record_fields = list(mpi_record.feature_iter(key, prepend_suffix=True))
+    incoming_record_fields = record.feature_values(key, prepend_suffix=True)
+    mpi_record_fields = mpi_record.feature_values(key, prepend_suffix=True)
     if len(incoming_record_fields) == 0 or len(mpi_record_fields) == 0:
         # Return early if a field is missing, and log that was the case
         return (missing_field_points_proportion * log_odds, True)
@@ -148,3 +157,105 @@ def compare_probabilistic_fuzzy_match(
         # return 0 if our max score is less than the threshold
         return (0.0, False)
     return (max_score * log_odds, False)
+
+
+def batch_compare_probabilistic_exact_match(
+    record: PIIRecord,
+    mpi_records: typing.Sequence[PIIRecord],
+    key: Feature,
+    log_odds: float,
+    missing_field_points_proportion: float,
+    prepend_suffix: bool = True,
+    **kwargs: typing.Any,
+) -> list[tuple[float, bool]]:
+    """
+    Compare the same Feature Field of one incoming record against many MPI records.
+    The results are identical to calling compare_probabilistic_exact_match once per
+    MPI record, however the incoming values are only extracted once.
+
+    :param record: The incoming record to evaluate.
+    :param mpi_records: The MPI records to compare against.
+    :param key: The name of the column being evaluated (e.g. "city").
+    :param log_odds: The log-odds weight-points for this field
+    :param missing_field_points_proportion: The proportion of log-odds points to
+      award if one of the records is missing information in the given field.
+    :param prepend_suffix: Optionally, a boolean indicating whether for name comparisons,
+      the function should prepend a suffix if it present.
+    :param **kwargs: Optionally, a dictionary that may include parameters required for other
+        compare_ functions.
+    :return: A list of tuples, one per MPI record, in the same format as returned by
+      compare_probabilistic_exact_match.
+    """
+    incoming_record_fields = set(record.feature_values(key, prepend_suffix=prepend_suffix))
+    missing: tuple[float, bool] = (missing_field_points_proportion * log_odds, True)
+    results: list[tuple[float, bool]] = []
+    for mpi_record in mpi_records:
+        mpi_record_fields = mpi_record.feature_values(key, prepend_suffix=prepend_suffix)
+        if not incoming_record_fields or not mpi_record_fields:
+            results.append(missing)
+            continue
+        agree = 1.0 if any(y in incoming_record_fields for y in mpi_record_fields) else 0.0
+        results.append((agree * log_odds, False))
+    return results
+
+
+def batch_compare_probabilistic_fuzzy_match(
+    record: PIIRecord,
+    mpi_records: typing.Sequence[PIIRecord],
+    key: Feature,
+    log_odds: float,
+    missing_field_points_proportion: float,
+    fuzzy_match_measure: SIMILARITY_MEASURES,
+    fuzzy_match_threshold: float,
+    **kwargs: typing.Any,
+) -> list[tuple[float, bool]]:
+    """
+    Compare the same Feature Field of one incoming record against many MPI records.
+    Every distinct MPI value is scored against each incoming value once, and the
+    score is shared by all the MPI records with that value.  The similarities are
+    calculated with the same function as compare_probabilistic_fuzzy_match, rather
+    than rapidfuzz.process, whose scores can differ in the last bits for some
+    measures (e.g. JaroWinkler), so the results are identical to calling
+    compare_probabilistic_fuzzy_match once per MPI record.
+
+    :param record: The incoming record to evaluate.
+    :param mpi_records: The MPI records to compare against.
+    :param key: The name of the column being evaluated (e.g. "city").
+    :param log_odds: The log-odds weight-points for this field
+    :param missing_field_points_proportion: The proportion of log-odds points
+      to award if one of the records is missing information in the given field.
+    :param fuzzy_match_measure: The string comparison metric to use
+    :param fuzzy_match_threshold: The cutoff score beyond which to classify the strings as a partial match
+    :param **kwargs: Optionally, a dictionary that may include parameters required for other
+        compare_ functions.
+    :return: A list of tuples, one per MPI record, in the same format as returned by
+      compare_probabilistic_fuzzy_match.
+    """
+    incoming_record_fields = record.feature_values(key, prepend_suffix=True)
+    mpi_record_fields = [r.feature_values(key, prepend_suffix=True) for r in mpi_records]
+    missing: tuple[float, bool] = (missing_field_points_proportion * log_odds, True)
+    if not incoming_record_fields:
+        return [missing for _ in mpi_records]
+
+    # Score each distinct MPI value once, keeping the best score across incoming values
+    choices: list[str] = list({y: None for fields in mpi_record_fields for y in fields})
+    comp_func = getattr(rapidfuzz.distance, fuzzy_match_measure).normalized_similarity
+    best: dict[str, float] = dict.fromkeys(choices, 0.0)
+    for x in incoming_record_fields:
+        for choice in choices:
+            best[choice] = max(comp_func(x, choice), best[choice])
+
+    results: list[tuple[float, bool]] = []
+    for fields in mpi_record_fields:
+        if not fields:
+            results.append(missing)
+            continue
+        max_score = 0.0
+        for y in fields:
+            max_score = max(best[y], max_score)
+        if max_score < fuzzy_match_threshold:
+            # return 0 if our max score is less than the threshold
+            results.append((0.0, False))
+        else:
+            results.append((max_score * log_odds, False))
+    return results
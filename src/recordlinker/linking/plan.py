@@ -0,0 +1,165 @@
+"""
+recordlinker.linking.plan
+~~~~~~~~~~~~~~~~~~~~~~~~~
+
+This module is used to compile an Algorithm into a flat execution plan, with
+all the per-pass and per-evaluator values pre-resolved, so the linkage
+algorithm doesn't need to derive them again on every request.
+"""
+
+import dataclasses
+import threading
+import typing
+
+from recordlinker import schemas
+
+CACHE_MAX_SIZE = 32
+
+# compiled plans keyed by the id of the Algorithm object, each plan holds a reference
+# to its Algorithm, so the id can't be reused by another object while it's cached
+_CACHE: dict[int, "CompiledAlgorithm"] = {}
+_LOCK = threading.Lock()
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class CompiledEvaluator:
+    """
+    An evaluator with its comparison functions, log-odds and fuzzy matching
+    parameters resolved against the algorithm context.
+    """
+
+    feature: schemas.Feature
+    feature_key: str
+    detail_key: str
+    func: typing.Callable
+    batch_func: typing.Callable
+    log_odds: float
+    missing_field_points_proportion: float
+    fuzzy_match_threshold: float
+    fuzzy_match_measure: str
+
+    def __call__(
+        self, record: schemas.PIIRecord, mpi_record: schemas.PIIRecord
+    ) -> tuple[float, bool]:
+        """
+        Compare the incoming record to a single MPI record.
+        """
+        return self.func(
+            record,
+            mpi_record,
+            self.feature,
+            self.log_odds,
+            self.missing_field_points_proportion,
+            fuzzy_match_threshold=self.fuzzy_match_threshold,
+            fuzzy_match_measure=self.fuzzy_match_measure,
+        )
+
+    def batch(
+        self, record: schemas.PIIRecord, mpi_records: typing.Sequence[schemas.PIIRecord]
+    ) -> list[tuple[float, bool]]:
+        """
+        Compare the incoming record to many MPI records.
+        """
+        return self.batch_func(
+            record,
+            mpi_records,
+            self.feature,
+            self.log_odds,
+            self.missing_field_points_proportion,
+            fuzzy_match_threshold=self.fuzzy_match_threshold,
+            fuzzy_match_measure=self.fuzzy_match_measure,
+        )
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class CompiledPass:
+    """
+    An algorithm pass with its label, thresholds and evaluators resolved.
+    """
+
+    algorithm_pass: schemas.AlgorithmPass
+    label: str
+    evaluators: tuple[CompiledEvaluator, ...]
+    max_points: float
+    max_missing_points: float
+    minimum_match_threshold: float
+    certain_match_threshold: float
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class CompiledAlgorithm:
+    """
+    An algorithm with all of its passes compiled.
+    """
+
+    algorithm: schemas.Algorithm
+    context: schemas.AlgorithmContext
+    passes: tuple[CompiledPass, ...]
+
+
+def compile_pass(
+    algorithm_pass: schemas.AlgorithmPass, context: schemas.AlgorithmContext
+) -> CompiledPass:
+    """
+    Compile a single algorithm pass using the provided algorithm context.
+
+    :param algorithm_pass: The AlgorithmPass to compile
+    :param context: The AlgorithmContext to resolve log-odds and defaults from
+    :returns: The compiled pass
+    """
+    advanced = context.advanced
+    evaluators = tuple(
+        CompiledEvaluator(
+            feature=e.feature,
+            feature_key=str(e.feature),
+            detail_key=f"evaluator.{e.feature}.{e.func}.result",
+            func=e.func.callable(),
+            batch_func=e.func.batch_callable(),
+            log_odds=context.get_log_odds(e.feature) or 0.0,
+            missing_field_points_proportion=advanced.missing_field_points_proportion,
+            fuzzy_match_threshold=e.fuzzy_match_threshold or advanced.fuzzy_match_threshold,
+            fuzzy_match_measure=e.fuzzy_match_measure or advanced.fuzzy_match_measure,
+        )
+        for e in algorithm_pass.evaluators
+    )
+    max_points: float = sum([e.log_odds for e in evaluators])
+    minimum_match_threshold, certain_match_threshold = algorithm_pass.possible_match_window
+    return CompiledPass(
+        algorithm_pass=algorithm_pass,
+        label=algorithm_pass.resolved_label,
+        evaluators=evaluators,
+        max_points=max_points,
+        max_missing_points=advanced.max_missing_allowed_proportion * max_points,
+        minimum_match_threshold=minimum_match_threshold,
+        certain_match_threshold=certain_match_threshold,
+    )
+
+
+def compile_algorithm(algorithm: schemas.Algorithm) -> CompiledAlgorithm:
+    """
+    Compile an Algorithm into an execution plan.  Plans are cached by the identity
+    of the Algorithm, so the lookup is cheap, and the algorithm returned by
+    `algorithm_service.get_cached_algorithm` is only compiled once per version and
+    then reused across requests.
+
+    NOTE: An Algorithm must not be changed after it's compiled, make a copy instead.
+
+    :param algorithm: The Algorithm to compile
+    :returns: The compiled algorithm
+    """
+    key = id(algorithm)
+    compiled = _CACHE.get(key)
+    if compiled is None or compiled.algorithm is not algorithm:
+        context = algorithm.algorithm_context
+        compiled = CompiledAlgorithm(
+            algorithm=algorithm,
+            context=context,
+            passes=tuple(compile_pass(p, context) for p in algorithm.passes),
+        )
+        with _LOCK:
+            if len(_CACHE) >= CACHE_MAX_SIZE:
+                # algorithms rarely change, so rather than tracking usage just
+                # start over when the cache fills up with old versions
+                _CACHE.clear()
+            _CACHE[key] = compiled
+    return compiled
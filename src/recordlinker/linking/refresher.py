@@ -0,0 +1,108 @@
+"""
+recordlinker.linking.refresher
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+This module manages the background worker that rebuilds the blocking value
+statistics, and the stop values flagged from them, every
+`blocking_stats_refresh_interval` seconds.  Every application process runs a
+worker, but the statistics are only rebuilt by the first one to find them
+older than the interval, so a newly common value (e.g. a placeholder birthdate)
+is flagged without running `scripts/refresh_blocking_stats.py` by hand.
+"""
+
+import datetime
+import logging
+import random
+import threading
+
+from sqlalchemy import orm
+
+from recordlinker import database
+from recordlinker.config import settings
+from recordlinker.database import mpi_service
+from recordlinker.utils.datetime import now_utc
+
+LOGGER = logging.getLogger(__name__)
+
+
+class BlockingStatsRefresher(threading.Thread):
+    """
+    A daemon thread that checks the age of the blocking value statistics about
+    every `interval` seconds, and rebuilds them once they're older than that.
+    """
+
+    def __init__(self, session_maker: orm.sessionmaker, interval: float, min_count: int = 100):
+        super().__init__(name="recordlinker-refresher", daemon=True)
+        self.session_maker = session_maker
+        self.interval = interval
+        self.min_count = min_count
+        self._stopped = threading.Event()
+
+    def refresh(self) -> int | None:
+        """
+        Rebuild the blocking value statistics, if they haven't been rebuilt by any
+        process in the last `interval` seconds.
+
+        :returns: The number of statistics stored, or None if they weren't due
+        """
+        with self.session_maker() as session:
+            refreshed_at = mpi_service.get_blocking_stats_refreshed_at(session)
+            if refreshed_at is not None and now_utc() - refreshed_at < datetime.timedelta(
+                seconds=self.interval
+            ):
+                return None
+            return mpi_service.refresh_blocking_stats(session, min_count=self.min_count)
+
+    def run(self) -> None:
+        """
+        Refresh the statistics until stopped.  The checks are spread over the
+        second half of the interval, so the workers of different processes
+        don't all check at once.
+        """
+        while not self._stopped.wait(self.interval * random.uniform(0.5, 1.0)):
+            try:
+                count = self.refresh()
+                if count is not None:
+                    LOGGER.info("refreshed blocking stats", extra={"count": count})
+            except Exception:
+                LOGGER.exception("error refreshing blocking stats")
+
+    def stop(self, wait: bool = True) -> None:
+        """
+        Stop the worker, a refresh in progress is finished first.
+        """
+        self._stopped.set()
+        if wait:
+            self.join()
+
+
+_REFRESHER: BlockingStatsRefresher | None = None
+_LOCK = threading.Lock()
+
+
+def start_refresher() -> BlockingStatsRefresher | None:
+    """
+    Start the blocking stats refresher, if it isn't running.  Returns None when the
+    `blocking_stats_refresh_interval` setting is unset.
+    """
+    global _REFRESHER
+    if not settings.blocking_stats_refresh_interval:
+        return None
+    with _LOCK:
+        if _REFRESHER is None:
+            _REFRESHER = BlockingStatsRefresher(
+                database.SessionMaker, settings.blocking_stats_refresh_interval
+            )
+            _REFRESHER.start()
+        return _REFRESHER
+
+
+def stop_refresher() -> None:
+    """
+    Stop the blocking stats refresher, if it has been started.
+    """
+    global _REFRESHER
+    with _LOCK:
+        if _REFRESHER is not None:
+            _REFRESHER.stop()
+            _REFRESHER = None
@@ -127,4 +127,7 @@ def remove_skip_values(record: schemas.PIIRecord, skips: typing.Sequence[SkipVal
                     val = f"{ident.value}:{ident.authority or ''}:{ident.type}"
                     if _match_skip_values(val, values):
                         cleaned.identifiers[idx].value = ""
+    if cleaned != record:
+        # precomputed features are no longer valid once a value has been removed
+        cleaned.clear_features()
     return cleaned
@@ -1,14 +1,23 @@
+import contextlib
+
 import fastapi
 import pydantic
 import sqlalchemy
 from fastapi import responses
 from sqlalchemy import orm
 
+from recordlinker import database
 from recordlinker import middleware
 from recordlinker._version import __version__
 from recordlinker.config import settings
+from recordlinker.database import blocking_index
 from recordlinker.database import get_session
+from recordlinker.linking import compute
+from recordlinker.linking import indexer
+from recordlinker.linking import refresher
 from recordlinker.routes.algorithm_router import router as algorithm_router
+from recordlinker.routes.blocking_router import router as blocking_router
+from recordlinker.routes.link_router import async_router as async_link_router
 from recordlinker.routes.link_router import router as link_router
 from recordlinker.routes.patient_router import router as patient_router
 from recordlinker.routes.person_router import router as person_router
@@ -23,7 +32,25 @@ def path(path: str) -> str:
     return f"{settings.api_root_path}{path}"
 
 
+@contextlib.asynccontextmanager
+async def lifespan(app: fastapi.FastAPI):
+    """
+    Load the blocking index, when enabled, and start the blocking stats refresher
+    before serving requests.  On shutdown, stop the refresher, flush the pending
+    Patients with the indexer and wait for the compute executor to finish.
+    """
+    if settings.blocking_index:
+        with database.get_session_manager() as session:
+            blocking_index.get_index(session)
+    refresher.start_refresher()
+    yield
+    refresher.stop_refresher()
+    indexer.stop_indexer()
+    compute.shutdown_executor()
+
+
 app = fastapi.FastAPI(
+    lifespan=lifespan,
     title="Record Linker",
     version=__version__,
     docs_url=path("/docs"),
@@ -53,6 +80,7 @@ app = fastapi.FastAPI(
 app.add_middleware(middleware.CorrelationIdMiddleware)
 app.add_middleware(middleware.AccessLogMiddleware)
 app.add_exception_handler(Exception, middleware.error_handler)
+app.add_exception_handler(compute.QueueFullError, middleware.queue_full_handler)
 
 
 @app.get("/", include_in_schema=False)
@@ -101,10 +129,14 @@ async def health_check(
         )
 
 
+if settings.async_db_uri:
+    # the async routes are registered first, so they take precedence over the sync routes
+    app.include_router(async_link_router, prefix=path(""), tags=["link"])
 app.include_router(link_router, prefix=path(""), tags=["link"])
 app.include_router(algorithm_router, prefix=path("/algorithm"), tags=["algorithm"])
 app.include_router(person_router, prefix=path("/person"), tags=["mpi"])
 app.include_router(patient_router, prefix=path("/patient"), tags=["mpi"])
 app.include_router(seed_router, prefix=path("/seed"), tags=["mpi"])
+app.include_router(blocking_router, prefix=path("/blocking"), tags=["mpi"])
 if settings.tuning_enabled:
     app.include_router(tuning_router, prefix=path("/tuning"), tags=["tuning"])
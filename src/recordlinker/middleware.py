@@ -74,3 +74,21 @@ async def error_handler(request: Request, exc: Exception):
     }
     ERROR_LOGGER.error("uncaught exception", extra=data)
     return JSONResponse(status_code=500, content={"detail": "Internal Server Error"})
+
+
+async def queue_full_handler(request: Request, exc: Exception):
+    """
+    Not a middleware, but rather an error handler. This is used to catch the
+    compute executor rejecting a job because its queue is full, and return a JSON
+    response with a 503 status code and a Retry-After header.
+    """
+    retry_after = getattr(exc, "retry_after", 1)
+    ERROR_LOGGER.warning(
+        "compute queue full",
+        extra={"correlation_id": request.headers.get(CorrelationIdMiddleware.header_name, "-")},
+    )
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Service Unavailable"},
+        headers={"Retry-After": str(retry_after)},
+    )
@@ -1,9 +1,17 @@
+from . import partitioning  # noqa: F401
 from .algorithm import Algorithm
 from .base import Base
+from .mpi import blocking_hash
+from .mpi import blocking_hash_range
+from .mpi import BLOCKING_HASH_VALUE_BITS
 from .mpi import BLOCKING_VALUE_MAX_LENGTH
+from .mpi import BlockingChange
+from .mpi import BlockingHash
 from .mpi import BlockingKey
+from .mpi import BlockingStat
 from .mpi import BlockingValue
 from .mpi import Patient
+from .mpi import PendingBlockingHash
 from .mpi import Person
 from .tuning import TuningJob
 from .tuning import TuningStatus
@@ -13,8 +21,15 @@ __all__ = [
     "Person",
     "Patient",
     "BlockingKey",
+    "BlockingStat",
     "BlockingValue",
+    "BlockingHash",
+    "BlockingChange",
+    "PendingBlockingHash",
+    "blocking_hash",
+    "blocking_hash_range",
     "BLOCKING_VALUE_MAX_LENGTH",
+    "BLOCKING_HASH_VALUE_BITS",
     "Algorithm",
     "TuningJob",
     "TuningStatus",
@@ -35,6 +35,9 @@ class Algorithm(Base):
     description: orm.Mapped[str] = orm.mapped_column(sqltypes.Text(), nullable=True)
     algorithm_context: orm.Mapped[dict] = orm.mapped_column(sqltypes.JSON, default=dict)
     passes: orm.Mapped[list[dict]] = orm.mapped_column(sqltypes.JSON, default=list)
+    # incremented on every update, so cached copies of the algorithm can cheaply
+    # check if they are stale
+    version: orm.Mapped[int] = orm.mapped_column(default=1, server_default="1")
 
 
 def check_only_one_default(mapping, connection, target):
@@ -1,18 +1,28 @@
+import datetime
 import enum
+import hashlib
 import uuid
 
 from sqlalchemy import orm
 from sqlalchemy import schema
 from sqlalchemy import types as sqltypes
+from sqlalchemy.sql import expression
+
+from recordlinker.utils.datetime import now_utc
 
 from .base import Base
 from .base import get_bigint_pk
+from .base import TZDateTime
 
 # The maximum length of a blocking value, we want to optimize this to be as small
 # as possible to reduce the amount of data stored in the database.  However, it needs
 # to be long enough to store the longest possible value for a blocking key.
 BLOCKING_VALUE_MAX_LENGTH = 20
 
+# The number of low bits of a blocking hash that hold the hash of the value, the
+# remaining high bits hold the id of the blocking key
+BLOCKING_HASH_VALUE_BITS = 56
+
 
 class Person(Base):
     __tablename__ = "mpi_person"
@@ -45,6 +55,9 @@ class Patient(Base):
     )
     person: orm.Mapped["Person"] = orm.relationship(back_populates="patients")
     data: orm.Mapped[dict] = orm.mapped_column(sqltypes.JSON, default=dict)
+    # Normalized feature values precomputed from data, to avoid normalizing
+    # the data during every comparison. See PIIRecord.to_features().
+    features: orm.Mapped[dict | None] = orm.mapped_column(sqltypes.JSON, nullable=True)
     external_patient_id: orm.Mapped[str] = orm.mapped_column(sqltypes.String(255), nullable=True)
     external_person_id: orm.Mapped[str] = orm.mapped_column(sqltypes.String(255), nullable=True)
     external_person_source: orm.Mapped[str] = orm.mapped_column(sqltypes.String(100), nullable=True)
@@ -52,6 +65,11 @@ class Patient(Base):
     reference_id: orm.Mapped[uuid.UUID] = orm.mapped_column(
         default=uuid.uuid4, unique=True, index=True
     )
+    # True when the BlockingValues of the Patient have not been written yet, see
+    # the deferred_indexing setting
+    pending_index: orm.Mapped[bool] = orm.mapped_column(
+        default=False, server_default=expression.false(), index=True
+    )
 
 
 class BlockingKey(enum.Enum):
@@ -114,6 +132,9 @@ class BlockingValue(Base):
             "ix_blocking_value_blockingkey_value_patient", "blockingkey", "value", "patient_id"
         ),
     )
+    # NOTE: when partitioned by blockingkey, see recordlinker.models.partitioning, the
+    # primary key is extended with the partition key after the table is created, and
+    # only on the dialects that support partitioning
 
     id: orm.Mapped[int] = orm.mapped_column(get_bigint_pk(), autoincrement=True, primary_key=True)
     patient_id: orm.Mapped[int] = orm.mapped_column(
@@ -122,3 +143,113 @@ class BlockingValue(Base):
     patient: orm.Mapped["Patient"] = orm.relationship(back_populates="blocking_values")
     blockingkey: orm.Mapped[int] = orm.mapped_column(sqltypes.SmallInteger)
     value: orm.Mapped[str] = orm.mapped_column(sqltypes.String(BLOCKING_VALUE_MAX_LENGTH))
+
+
+class BlockingHash(Base):
+    """
+    A compact alternative to BlockingValue, used when the `blocking_storage` setting
+    is "hash".  The blocking key and value are encoded in a single 64-bit integer,
+    see `blocking_hash`, so each row is a fixed 16 bytes and the primary key on
+    (hash, patient_id) doubles as the blocking index.  There is no surrogate id.
+    """
+
+    __tablename__ = "mpi_blocking_hash"
+
+    hash: orm.Mapped[int] = orm.mapped_column(sqltypes.BigInteger, primary_key=True)
+    patient_id: orm.Mapped[int] = orm.mapped_column(
+        schema.ForeignKey(f"{Patient.__tablename__}.id"), primary_key=True, index=True
+    )
+
+
+class PendingBlockingHash(Base):
+    """
+    The blocking hashes, see `blocking_hash`, of the Patients whose BlockingValues
+    haven't been written yet, see the `deferred_indexing` setting.  The rows are
+    deleted once the Patient is indexed, so the table stays small, and blocking
+    queries join it to find the matching pending Patients, in the same way as the
+    BlockingHash table.
+    """
+
+    __tablename__ = "mpi_pending_blocking_hash"
+
+    hash: orm.Mapped[int] = orm.mapped_column(sqltypes.BigInteger, primary_key=True)
+    patient_id: orm.Mapped[int] = orm.mapped_column(
+        schema.ForeignKey(f"{Patient.__tablename__}.id"), primary_key=True, index=True
+    )
+
+
+class BlockingChange(Base):
+    """
+    A log of the Patients whose blocking values were written, that is inserted,
+    updated, deleted or written late by the deferred indexer, read by each process
+    to keep its in-memory blocking index current, see
+    `blocking_index.BlockingIndex.catch_up`.  The id is a monotonic sequence, but
+    ids are assigned when the row is written, not when it's committed, and a row
+    without a Patient id marks that the MPI was reset.  There is no foreign key, as
+    the Patient may have been deleted.
+    """
+
+    __tablename__ = "mpi_blocking_change"
+    # SQLite reuses the ids of deleted rows otherwise
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id: orm.Mapped[int] = orm.mapped_column(get_bigint_pk(), autoincrement=True, primary_key=True)
+    patient_id: orm.Mapped[int | None] = orm.mapped_column(sqltypes.BigInteger, nullable=True)
+    # when the row was written, the rows logged before the column was added have none
+    created_at: orm.Mapped[datetime.datetime | None] = orm.mapped_column(
+        TZDateTime, default=now_utc, nullable=True
+    )
+
+
+def blocking_hash(key: BlockingKey, value: str) -> int:
+    """
+    Encode a blocking key and value as a signed 64-bit integer.  The id of the key
+    is stored in the high bits, so all the hashes for a key fall in one contiguous
+    range, and the first 7 bytes of the BLAKE2b digest of the value in the low bits.
+    Different values can collide, so matches on the hash need to be verified.
+    """
+    digest = hashlib.blake2b(value.encode("utf-8"), digest_size=BLOCKING_HASH_VALUE_BITS // 8)
+    return (key.id << BLOCKING_HASH_VALUE_BITS) | int.from_bytes(digest.digest(), "big")
+
+
+def blocking_hash_range(key: BlockingKey) -> tuple[int, int]:
+    """
+    Return the inclusive range of the hashes for a blocking key.
+    """
+    low = key.id << BLOCKING_HASH_VALUE_BITS
+    return low, low + (1 << BLOCKING_HASH_VALUE_BITS) - 1
+
+
+class BlockingStat(Base):
+    """
+    The number of Patients with a common blocking value, used to estimate how many
+    candidates a blocking query will select.  The key and value are identified by
+    their `blocking_hash`, regardless of the `blocking_storage` setting, and only
+    values above a minimum count are stored, all others are assumed to be rare.
+    The table is rebuilt by `mpi_service.refresh_blocking_stats`, which also flags
+    the hyper-frequent values (e.g. placeholders) as stop values.  The value itself
+    is recorded when known, and always for stop values, so they can be inspected.
+    """
+
+    __tablename__ = "mpi_blocking_stat"
+
+    hash: orm.Mapped[int] = orm.mapped_column(
+        sqltypes.BigInteger, primary_key=True, autoincrement=False
+    )
+    count: orm.Mapped[int] = orm.mapped_column(sqltypes.BigInteger)
+    stop: orm.Mapped[bool] = orm.mapped_column(default=False, server_default=expression.false())
+    value: orm.Mapped[str | None] = orm.mapped_column(
+        sqltypes.String(BLOCKING_VALUE_MAX_LENGTH), nullable=True
+    )
+    # when the table was rebuilt, the same for every row
+    refreshed_at: orm.Mapped[datetime.datetime | None] = orm.mapped_column(
+        TZDateTime, nullable=True
+    )
+
+    @property
+    def blocking_key(self) -> BlockingKey:
+        """
+        The BlockingKey of the value, from the high bits of the hash.
+        """
+        key_id = self.hash >> BLOCKING_HASH_VALUE_BITS
+        return next(k for k in BlockingKey if k.id == key_id)
@@ -0,0 +1,160 @@
+"""
+recordlinker.models.partitioning
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+This module builds the DDL used to partition the BlockingValue table by blocking
+key, when the `blocking_partitioning` setting is enabled.  Every blocking join
+filters on a single key, so each join only scans the partition for that key, and
+index maintenance (e.g. vacuum or rebuilds) can be done one key at a time.
+
+    - PostgreSQL: the table is LIST partitioned, with one partition per key and
+      a default partition for any keys added later.
+    - SQL Server: the table, and its indexes, are placed on a partition scheme,
+      with one range per key.
+
+The tables are created unpartitioned, with a primary key on id alone, and are
+partitioned after they're created, so other dialects (which don't support
+partitioning) ignore the setting.
+"""
+
+import sqlalchemy as sa
+from sqlalchemy import event
+
+from recordlinker.config import settings
+
+from .mpi import BlockingKey
+from .mpi import BlockingValue
+from .mpi import Patient
+
+# The dialects that support partitioning the BlockingValue table
+DIALECTS = ("postgresql", "mssql")
+
+
+def partition_name(table: str, key: BlockingKey | None) -> str:
+    """
+    Return the name of the partition for a blocking key, or of the default
+    partition if the key is None.
+    """
+    return f"{table}_{key.value.lower() if key else 'default'}"
+
+
+def postgresql_partitions(table: str) -> list[str]:
+    """
+    Return the statements to create the partitions of a LIST partitioned
+    BlockingValue table, one per blocking key and a default partition.
+    """
+    statements = [
+        f"CREATE TABLE {partition_name(table, key)} PARTITION OF {table} FOR VALUES IN ({key.id})"
+        for key in BlockingKey
+    ]
+    statements.append(f"CREATE TABLE {partition_name(table, None)} PARTITION OF {table} DEFAULT")
+    return statements
+
+
+def postgresql_convert(table: str, patient_table: str, partitioned: bool) -> list[str]:
+    """
+    Return the statements to convert an existing BlockingValue table to, or from,
+    a LIST partitioned table.  PostgreSQL can't change the partitioning of an
+    existing table, so a new table is created, the rows are copied into it and
+    the old table is dropped.  The id sequence is moved to the new table.
+
+    :param table: The name of the BlockingValue table
+    :param patient_table: The name of the Patient table
+    :param partitioned: Convert to a partitioned table if True, or back if False
+    """
+    old = f"{table}_old"
+    pkey = "(id, blockingkey)" if partitioned else "(id)"
+    options = " PARTITION BY LIST (blockingkey)" if partitioned else ""
+    statements = [
+        f"ALTER TABLE {table} RENAME TO {old}",
+        f"ALTER TABLE {old} RENAME CONSTRAINT {table}_pkey TO {old}_pkey",
+        "DROP INDEX ix_blocking_value_blockingkey_value_patient",
+        f"DROP INDEX ix_{table}_patient_id",
+        f"CREATE TABLE {table} ("
+        f"id BIGINT NOT NULL DEFAULT nextval('{table}_id_seq'), "
+        f"patient_id BIGINT NOT NULL REFERENCES {patient_table} (id), "
+        "blockingkey SMALLINT NOT NULL, "
+        "value VARCHAR(20) NOT NULL, "
+        f"CONSTRAINT {table}_pkey PRIMARY KEY {pkey}"
+        f"){options}",
+    ]
+    if partitioned:
+        statements.extend(postgresql_partitions(table))
+    statements.extend(
+        [
+            f"INSERT INTO {table} (id, patient_id, blockingkey, value) "
+            f"SELECT id, patient_id, blockingkey, value FROM {old}",
+            f"CREATE INDEX ix_blocking_value_blockingkey_value_patient ON {table} "
+            "(blockingkey, value, patient_id)",
+            f"CREATE INDEX ix_{table}_patient_id ON {table} (patient_id)",
+            # move the sequence before dropping the old table, which owns it
+            f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id",
+            f"DROP TABLE {old}",
+        ]
+    )
+    return statements
+
+
+def mssql_partition_scheme(table: str) -> list[str]:
+    """
+    Return the statements to create the partition function and scheme for a
+    BlockingValue table.  There is one range per blocking key, and a final range
+    for any keys added later.
+    """
+    boundaries = ", ".join(str(key.id) for key in sorted(BlockingKey, key=lambda k: k.id))
+    return [
+        f"CREATE PARTITION FUNCTION pf_{table} (smallint) AS RANGE LEFT FOR VALUES ({boundaries})",
+        f"CREATE PARTITION SCHEME ps_{table} AS PARTITION pf_{table} ALL TO ([PRIMARY])",
+    ]
+
+
+def mssql_convert(table: str, pk_name: str, partitioned: bool) -> list[str]:
+    """
+    Return the statements to move an existing BlockingValue table onto, or off
+    of, its partition scheme.  The clustered primary key is rebuilt on the scheme,
+    which moves the rows, and the other indexes are rebuilt to align with it.
+
+    :param table: The name of the BlockingValue table
+    :param pk_name: The name of the existing primary key constraint
+    :param partitioned: Move onto the partition scheme if True, or off if False
+    """
+    pkey = "(id, blockingkey)" if partitioned else "(id)"
+    storage = f"ps_{table}(blockingkey)" if partitioned else "[PRIMARY]"
+    statements = mssql_partition_scheme(table) if partitioned else []
+    statements.extend(
+        [
+            f"ALTER TABLE {table} DROP CONSTRAINT {pk_name}",
+            f"ALTER TABLE {table} ADD CONSTRAINT pk_{table} PRIMARY KEY CLUSTERED {pkey} "
+            f"ON {storage}",
+            "CREATE INDEX ix_blocking_value_blockingkey_value_patient ON "
+            f"{table} (blockingkey, value, patient_id) WITH (DROP_EXISTING = ON) ON {storage}",
+            f"CREATE INDEX ix_{table}_patient_id ON {table} (patient_id) "
+            f"WITH (DROP_EXISTING = ON) ON {storage}",
+        ]
+    )
+    if not partitioned:
+        statements.extend(
+            [f"DROP PARTITION SCHEME ps_{table}", f"DROP PARTITION FUNCTION pf_{table}"]
+        )
+    return statements
+
+
+def _after_create(target: sa.Table, connection: sa.Connection, **kw) -> None:
+    """
+    Partition the BlockingValue table after it's created by `create_all`.
+    """
+    statements: list[str] = []
+    if connection.dialect.name == "postgresql":
+        # the partitioning of a table can't be changed, so the new, empty, table is
+        # replaced with a partitioned one
+        statements = postgresql_convert(target.name, Patient.__table__.name, partitioned=True)
+    elif connection.dialect.name == "mssql":
+        # SQL Server generates a name for the unnamed primary key constraint
+        pk_name = str(sa.inspect(connection).get_pk_constraint(target.name)["name"])
+        statements = mssql_convert(target.name, pk_name, partitioned=True)
+    for statement in statements:
+        connection.execute(sa.text(statement))
+
+
+if settings.blocking_partitioning:
+    event.listen(BlockingValue.__table__, "after_create", _after_create)
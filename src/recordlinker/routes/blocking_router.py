@@ -0,0 +1,61 @@
+"""
+recordlinker.routes.blocking_router
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+This module implements the blocking router for the RecordLinker API. Exposing
+the blocking statistics API endpoints.
+"""
+
+import fastapi
+import sqlalchemy.orm as orm
+
+from recordlinker import schemas
+from recordlinker.database import blocking_index
+from recordlinker.database import get_session
+from recordlinker.database import mpi_service as service
+
+router = fastapi.APIRouter()
+
+
+@router.get(
+    "/stop-values",
+    summary="Retrieve blocking stop values",
+    status_code=fastapi.status.HTTP_200_OK,
+    name="get-blocking-stop-values",
+)
+def get_stop_values(
+    session: orm.Session = fastapi.Depends(get_session),
+) -> schemas.BlockingStopValues:
+    """
+    Retrieve the blocking stop values, ordered from most to least common.  These
+    are blocking values shared by so many records (e.g. a 1900-01-01 birthdate
+    placeholder) that they are treated as missing when blocking.
+
+    NOTE: The stop values are computed from the blocking value statistics, when
+    they are refreshed with `scripts/refresh_blocking_stats.py` and the
+    `BLOCKING_STOP_VALUE_RATIO` setting is set.
+    """
+    stats = service.get_blocking_stop_values(session)
+    return schemas.BlockingStopValues(
+        stop_values=[schemas.BlockingStopValue.model_validate(s) for s in stats]
+    )
+
+
+@router.get(
+    "/index",
+    summary="Retrieve blocking index usage",
+    status_code=fastapi.status.HTTP_200_OK,
+    name="get-blocking-index",
+)
+def get_index(session: orm.Session = fastapi.Depends(get_session)) -> schemas.BlockingIndexInfo:
+    """
+    Retrieve the number of blocking hashes and Patient ids in the in-memory blocking
+    index of the process serving the request, an estimate of its memory usage in
+    bytes, and the size of the memory-mapped snapshot shared with other processes.
+
+    NOTE: Returns a 404 when the `BLOCKING_INDEX` setting is disabled.
+    """
+    index = blocking_index.get_index(session)
+    if index is None:
+        raise fastapi.HTTPException(status_code=fastapi.status.HTTP_404_NOT_FOUND)
+    return schemas.BlockingIndexInfo(watermark=index.watermark, **index.memory_usage())
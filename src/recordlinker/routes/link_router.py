@@ -9,32 +9,61 @@ API endpoints to link and match patient records.
 import typing
 
 import fastapi
+import pydantic
 import sqlalchemy.orm as orm
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext import asyncio as sa_asyncio
+from starlette.types import Receive
+from starlette.types import Scope
+from starlette.types import Send
 
 from recordlinker import schemas
 from recordlinker.database import algorithm_service
+from recordlinker.database import get_async_session
 from recordlinker.database import get_session
 from recordlinker.hl7 import fhir
 from recordlinker.linking import link
+from recordlinker.schemas.link import LINK_BATCH_MAX_SIZE
+from recordlinker.schemas.link import LINK_STREAM_CHUNK_SIZE
 
 router = fastapi.APIRouter()
+# The async variants of the /link and /match endpoints, these are registered ahead
+# of the sync endpoints when `async_db_uri` is configured
+async_router = fastapi.APIRouter()
+
+
+class NDJSONStreamingResponse(StreamingResponse):
+    """
+    A streaming response for body iterators that read the request body while the
+    response is being sent.  The default StreamingResponse listens for a client
+    disconnect on the same channel the request body is received on, which would
+    consume the request body out from under the iterator.  A client disconnect is
+    instead raised by the iterator when it reads the request body.
+    """
+
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """
+        Send the response, without listening for a client disconnect.
+        """
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
 
 
 def algorithm_or_422(db_session: orm.Session, label: str | None) -> schemas.Algorithm:
     """
     Get the Algorithm, or default if no label. Raise a 422 if no Algorithm can be found.
     """
-    algorithm = (
-        algorithm_service.get_algorithm(db_session, label)
-        if label
-        else algorithm_service.default_algorithm(db_session)
-    )
+    algorithm = algorithm_service.get_cached_algorithm(db_session, label)
     if not algorithm:
         raise fastapi.HTTPException(
             status_code=fastapi.status.HTTP_422_UNPROCESSABLE_ENTITY,
             detail="No algorithm found",
         )
-    return schemas.Algorithm.model_validate(algorithm)
+    return algorithm
 
 
 def fhir_record_or_422(bundle: dict) -> schemas.PIIRecord:
@@ -87,6 +116,123 @@ def link_piirecord(
     )
 
 
+@router.post("/link/batch", summary="Link Record Batch", name="link-batch")
+def link_batch(
+    request: fastapi.Request,
+    input: typing.Annotated[schemas.LinkBatchInput, fastapi.Body()],
+    response: fastapi.Response,
+    db_session: orm.Session = fastapi.Depends(get_session),
+) -> schemas.LinkBatchResponse:
+    """
+    Compare a batch of PII Records with records in the Master Patient Index (MPI)
+    to check for matches with existing patient records.  The algorithm is resolved
+    once for the whole batch and the records are linked in order within a single
+    transaction, so a record can link to a Person created by an earlier record in
+    the same batch.  Returns a link response for each record, in input order.
+
+    NOTE: Each record in the batch still runs its own blocking queries, so a batch
+    saves the per-request overhead, but not the per-record database round-trips.
+    """
+    algorithm: schemas.Algorithm = algorithm_or_422(db_session, input.algorithm)
+
+    linked = link.link_records_against_mpi(
+        records=[r.record for r in input.records],
+        session=db_session,
+        algorithm=algorithm,
+        external_person_ids=[r.external_person_id for r in input.records],
+        persist=True,
+    )
+    responses: list[schemas.LinkResponse] = []
+    for patient, person, results, match_grade in linked:
+        assert patient is not None, "Patient should always be created"
+        responses.append(
+            schemas.LinkResponse(
+                match_grade=match_grade,
+                patient_reference_id=patient.reference_id,
+                person_reference_id=(person and person.reference_id),
+                results=[schemas.LinkResult(**r.__dict__) for r in results],
+            )
+        )
+    return schemas.LinkBatchResponse(results=responses)
+
+
+async def ndjson_lines(request: fastapi.Request) -> typing.AsyncIterator[bytes]:
+    """
+    Read the request body incrementally, yielding each non-empty line.
+    """
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
+
+
+@router.post(
+    "/link/stream",
+    summary="Link Record Stream",
+    name="link-stream",
+    response_class=NDJSONStreamingResponse,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/x-ndjson": {
+                    "schema": {"$ref": "#/components/schemas/PIIRecord"},
+                }
+            },
+        }
+    },
+)
+async def link_stream(
+    request: fastapi.Request,
+    algorithm: str | None = None,
+    chunk_size: typing.Annotated[
+        int, fastapi.Query(ge=1, le=LINK_BATCH_MAX_SIZE)
+    ] = LINK_STREAM_CHUNK_SIZE,
+    db_session: orm.Session = fastapi.Depends(get_session),
+) -> NDJSONStreamingResponse:
+    """
+    Compare a newline-delimited stream of PII Records with records in the Master
+    Patient Index (MPI) to check for matches with existing patient records.  The
+    request body is read incrementally, and the records are linked in order, in
+    chunks of `chunk_size` records.  Each chunk is committed before its results
+    are streamed back as newline-delimited LinkStreamResults, so the memory used
+    is bounded by the chunk size rather than the size of the upload.  Lines that
+    are not valid PII Records are reported with an error and skipped.
+    """
+    resolved: schemas.Algorithm = await run_in_threadpool(algorithm_or_422, db_session, algorithm)
+
+    async def stream() -> typing.AsyncIterator[str]:
+        chunk: list[tuple[int, schemas.PIIRecord | str]] = []
+        line = 0
+        try:
+            async for data in ndjson_lines(request):
+                line += 1
+                try:
+                    chunk.append((line, schemas.PIIRecord.model_validate_json(data)))
+                except pydantic.ValidationError as exc:
+                    chunk.append((line, str(exc)))
+                if len(chunk) >= chunk_size:
+                    for result in await run_in_threadpool(
+                        link.link_stream_chunk, db_session, resolved, chunk
+                    ):
+                        yield result.model_dump_json() + "\n"
+                    chunk = []
+            if chunk:
+                for result in await run_in_threadpool(
+                    link.link_stream_chunk, db_session, resolved, chunk
+                ):
+                    yield result.model_dump_json() + "\n"
+        finally:
+            db_session.close()
+
+    return NDJSONStreamingResponse(stream())
+
+
 @router.post("/link/fhir", summary="Link FHIR", name="link-fhir")
 def link_fhir(
     request: fastapi.Request,
@@ -149,6 +295,35 @@ def match_piirecord(
     )
 
 
+@router.post("/match/explain", summary="Explain Match Record", name="match-explain")
+def match_explain(
+    request: fastapi.Request,
+    input: typing.Annotated[schemas.LinkInput, fastapi.Body()],
+    response: fastapi.Response,
+    db_session: orm.Session = fastapi.Depends(get_session),
+) -> schemas.MatchExplainResponse:
+    """
+    Similar to the /match endpoint, but also returns a profile of each pass of the
+    algorithm: the blocking keys used and skipped, the time spent in SQL, the number
+    of Persons and Patients hydrated and filtered, the CPU time of each feature's
+    evaluator and the early termination decisions.  Use it to find out whether
+    blocking, hydration or scoring makes a record slow to link.
+    """
+    algorithm: schemas.Algorithm = algorithm_or_422(db_session, input.algorithm)
+
+    (person, results, match_grade, profile) = link.explain_record_against_mpi(
+        record=input.record,
+        session=db_session,
+        algorithm=algorithm,
+    )
+    return schemas.MatchExplainResponse(
+        match_grade=match_grade,
+        person_reference_id=(person and person.reference_id),
+        results=[schemas.LinkResult(**r.__dict__) for r in results],
+        profile=profile,
+    )
+
+
 @router.post("/match/fhir", summary="Match FHIR", name="match-fhir")
 def match_fhir(
     request: fastapi.Request,
@@ -179,3 +354,58 @@ def match_fhir(
             and fhir.add_person_resource(str(person.reference_id), record.external_id, input.bundle)
         ),
     )
+
+
+@async_router.post("/link", summary="Link Record", name="link-record", include_in_schema=False)
+async def link_piirecord_async(
+    request: fastapi.Request,
+    input: typing.Annotated[schemas.LinkInput, fastapi.Body()],
+    response: fastapi.Response,
+    db_session: sa_asyncio.AsyncSession = fastapi.Depends(get_async_session),
+) -> schemas.LinkResponse:
+    """
+    Async variant of the /link endpoint, using an async database session.
+    """
+    algorithm: schemas.Algorithm = await db_session.run_sync(algorithm_or_422, input.algorithm)
+
+    (patient, person, results, match_grade) = await link.link_record_against_mpi_async(
+        record=input.record,
+        session=db_session,
+        algorithm=algorithm,
+        external_person_id=input.external_person_id,
+        persist=True,
+    )
+    assert patient is not None, "Patient should always be created"
+    return schemas.LinkResponse(
+        match_grade=match_grade,
+        patient_reference_id=patient.reference_id,
+        person_reference_id=(person and person.reference_id),
+        results=[schemas.LinkResult(**r.__dict__) for r in results],
+    )
+
+
+@async_router.post("/match", summary="Match Record", name="match-record", include_in_schema=False)
+async def match_piirecord_async(
+    request: fastapi.Request,
+    input: typing.Annotated[schemas.LinkInput, fastapi.Body()],
+    response: fastapi.Response,
+    db_session: sa_asyncio.AsyncSession = fastapi.Depends(get_async_session),
+) -> schemas.MatchResponse:
+    """
+    Async variant of the /match endpoint, using an async database session.
+    """
+    algorithm: schemas.Algorithm = await db_session.run_sync(algorithm_or_422, input.algorithm)
+
+    (patient, person, results, match_grade) = await link.link_record_against_mpi_async(
+        record=input.record,
+        session=db_session,
+        algorithm=algorithm,
+        external_person_id=input.external_person_id,
+        persist=False,
+    )
+    assert patient is None, "Patient should not have been created"
+    return schemas.MatchResponse(
+        match_grade=match_grade,
+        person_reference_id=(person and person.reference_id),
+        results=[schemas.LinkResult(**r.__dict__) for r in results],
+    )
@@ -6,12 +6,9 @@ This module implements the seed router for the RecordLinker API. Exposing
 the seed API endpoints.
 """
 
-import typing
-
 import fastapi
 import sqlalchemy.orm as orm
 
-from recordlinker import models
 from recordlinker import schemas
 from recordlinker.database import get_session
 from recordlinker.database import mpi_service as service
@@ -38,53 +35,12 @@ def batch(
     The endpoint will return a list of Person objects, each containing a person_reference_id and a
     list of Patient objects, each containing patient_reference_ids.
 
-    NOTE: MySQL does not support bulk insert, so when using this dialect, each patient record will
-    be inserted individually.  This will be slower than using a dialect that supports bulk insert.
+    NOTE: On PostgreSQL, the records are streamed into the database with COPY, which is
+    significantly faster than the bulk insert used for other dialects.
 
     NOTE: The maximum number of clusters that can be seeded in a single request is 100.
     """
-    results: list[schemas.PersonCluster] = []
-    dialect = session.get_bind().dialect.name
-
-    for cluster in data.clusters:
-        person = models.Person()
-        patients: typing.Sequence[models.Patient] = []
-        if dialect == "mysql":
-            # MySQL does not support bulk insert, so we need to insert each patient individually
-            patients = [
-                service.insert_patient(
-                    session,
-                    r,
-                    person,
-                    external_patient_id=r.external_id,
-                    external_person_id=cluster.external_person_id,
-                    commit=False,
-                )
-                for r in cluster.records
-            ]
-        else:
-            patients = service.bulk_insert_patients(
-                session,
-                cluster.records,
-                person,
-                external_person_id=cluster.external_person_id,
-                commit=False,
-            )
-
-        results.append(
-            schemas.PersonCluster(
-                person_reference_id=person.reference_id,
-                external_person_id=cluster.external_person_id,
-                patients=[
-                    schemas.PatientRef(
-                        patient_reference_id=p.reference_id,
-                        external_patient_id=p.external_patient_id,
-                    )
-                    for p in patients
-                ],
-            )
-        )
-
+    results = service.seed_clusters(session, data.clusters, commit=False)
     return schemas.PersonGroup(persons=results)
 
 
@@ -4,14 +4,24 @@ from .algorithm import AlgorithmPass
 from .algorithm import AlgorithmSummary
 from .algorithm import Evaluator
 from .algorithm import LogOdd
+from .link import LinkBatchInput
+from .link import LinkBatchRecord
+from .link import LinkBatchResponse
 from .link import LinkFhirInput
 from .link import LinkFhirResponse
 from .link import LinkInput
 from .link import LinkResponse
 from .link import LinkResult
+from .link import LinkStreamResult
+from .link import MatchExplainResponse
 from .link import MatchFhirResponse
 from .link import MatchGrade
+from .link import MatchProfile
 from .link import MatchResponse
+from .link import PassProfile
+from .mpi import BlockingIndexInfo
+from .mpi import BlockingStopValue
+from .mpi import BlockingStopValues
 from .mpi import ErrorDetail
 from .mpi import ErrorResponse
 from .mpi import PaginatedMetaData
@@ -52,12 +62,19 @@ __all__ = [
     "PIIRecord",
     "MatchGrade",
     "LinkInput",
+    "LinkBatchInput",
+    "LinkBatchRecord",
+    "LinkBatchResponse",
     "LinkResponse",
     "MatchResponse",
     "LinkResult",
+    "LinkStreamResult",
     "LinkFhirInput",
     "LinkFhirResponse",
     "MatchFhirResponse",
+    "MatchExplainResponse",
+    "MatchProfile",
+    "PassProfile",
     "PersonRef",
     "PatientRef",
     "PatientPersonRef",
@@ -71,6 +88,9 @@ __all__ = [
     "PersonCluster",
     "PersonGroup",
     "PersonRefs",
+    "BlockingIndexInfo",
+    "BlockingStopValue",
+    "BlockingStopValues",
     "ErrorDetail",
     "ErrorResponse",
     "PaginatedMetaData",
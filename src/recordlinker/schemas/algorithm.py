@@ -169,6 +169,16 @@ class AlgorithmContext(pydantic.BaseModel):
             "match candidates who scored an equivalently high grade with the best match."
         ),
     )
+    early_termination: bool = pydantic.Field(
+        default=False,
+        description=(
+            "A boolean flag indicating whether the algorithm should stop evaluating as "
+            "soon as the outcome is known. Person clusters are only compared until their "
+            "median is fixed or can no longer reach the minimum match threshold, and when "
+            "include_multiple_matches is false, the remaining passes are skipped once a "
+            "certain match is found."
+        ),
+    )
     log_odds: typing.Sequence[LogOdd] = []
     skip_values: typing.Sequence[SkipValue] = []
     advanced: AlgorithmAdvanced = AlgorithmAdvanced()
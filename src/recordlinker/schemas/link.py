@@ -14,6 +14,13 @@ from recordlinker.schemas.pii import PIIRecord
 
 MatchGrade = typing.Literal["certain", "possible", "certainly-not"]
 
+# NOTE: records are linked sequentially in a single transaction, so the batch
+# size is bounded to keep the transaction (and the request body) reasonable.
+LINK_BATCH_MAX_SIZE = 5000
+# NOTE: a streamed upload has no size limit, the records are linked and committed
+# in chunks of this many records (by default), so memory use stays flat.
+LINK_STREAM_CHUNK_SIZE = 100
+
 
 class LinkInput(pydantic.BaseModel):
     """
@@ -33,6 +40,45 @@ class LinkInput(pydantic.BaseModel):
     )
 
 
+class LinkBatchRecord(pydantic.BaseModel):
+    """
+    Schema for a single record in a request to the link batch endpoint
+    """
+
+    record: PIIRecord = pydantic.Field(description="A PIIRecord to be checked")
+    external_person_id: typing.Optional[str] = pydantic.Field(
+        description="The External Identifier, provided by the client,"
+        " for a unique patient/person that is linked to patient(s)",
+        default=None,
+    )
+
+
+class LinkBatchInput(pydantic.BaseModel):
+    """
+    Schema for requests to the link batch endpoint
+    """
+
+    records: list[LinkBatchRecord] = pydantic.Field(
+        description="The records to be linked, in the order they should be processed"
+    )
+    algorithm: typing.Optional[str] = pydantic.Field(
+        description="Optionally, a string that maps to an algorithm label stored in "
+        "algorithm table",
+        default=None,
+    )
+
+    @pydantic.field_validator("records", mode="before")
+    def validate_records(cls, records):
+        """
+        Validate that the records are not empty and do not exceed the maximum size.
+        """
+        if not records:
+            raise ValueError("Records must not be empty")
+        if len(records) > LINK_BATCH_MAX_SIZE:
+            raise ValueError(f"Records must not exceed {LINK_BATCH_MAX_SIZE} records")
+        return records
+
+
 class LinkResult(pydantic.BaseModel):
     """
     Schema for linkage results to a person cluster.
@@ -100,6 +146,96 @@ class MatchResponse(pydantic.BaseModel):
     )
 
 
+class PassProfile(pydantic.BaseModel):
+    """
+    Schema for the profile of a single algorithm pass, in a match explain response.
+    """
+
+    label: str = pydantic.Field(description="The label of the algorithm pass.")
+    blocking_keys: list[str] = pydantic.Field(
+        default=[],
+        description="The blocking keys used to find the candidates, in the order they "
+        "were applied.",
+    )
+    skipped_keys: dict[str, str] = pydantic.Field(
+        default={},
+        description="The blocking keys that were not used, and why: the incoming record "
+        "is 'missing' a value, or its values are all 'stop values'.",
+    )
+    skipped: str | None = pydantic.Field(
+        default=None,
+        description="The reason the pass was skipped, if it was.",
+    )
+    estimated_candidates: int | None = pydantic.Field(
+        default=None,
+        description="The estimated number of Patients matching the blocking keys, when "
+        "blocking statistics are used to plan the pass.",
+    )
+    blocking_seconds: float = pydantic.Field(
+        default=0.0,
+        description="The time taken to find and hydrate the candidates, in seconds.",
+    )
+    sql_seconds: float = pydantic.Field(
+        default=0.0,
+        description="The time spent executing SQL statements to find the candidates, in seconds.",
+    )
+    persons: int = pydantic.Field(
+        default=0, description="The number of Persons hydrated in blocking."
+    )
+    patients: int = pydantic.Field(
+        default=0, description="The number of Patients hydrated in blocking."
+    )
+    filtered: int = pydantic.Field(
+        default=0,
+        description="The number of hydrated Patients removed for having conflicting "
+        "blocking values.",
+    )
+    persons_compared: int = pydantic.Field(
+        default=0, description="The number of Persons scored against the incoming record."
+    )
+    persons_decided_early: int = pydantic.Field(
+        default=0,
+        description="The number of Persons whose score was fixed by a majority of their "
+        "Patients, so the rest were not compared.",
+    )
+    persons_skipped: int = pydantic.Field(
+        default=0,
+        description="The number of Persons skipped, as they could not reach the minimum "
+        "match threshold.",
+    )
+    patients_compared: int = pydantic.Field(
+        default=0, description="The number of Patients compared to the incoming record."
+    )
+    feature_seconds: dict[str, float] = pydantic.Field(
+        default={},
+        description="The CPU time spent in the evaluator of each feature, in seconds.",
+    )
+
+
+class MatchProfile(pydantic.BaseModel):
+    """
+    Schema for the profile of a match, in a match explain response.
+    """
+
+    passes: list[PassProfile] = pydantic.Field(
+        description="The profile of each pass of the algorithm, in order."
+    )
+    scoring_seconds: float = pydantic.Field(
+        description="The CPU time spent scoring the candidates of every pass, in seconds."
+    )
+    total_seconds: float = pydantic.Field(description="The time taken by the match, in seconds.")
+
+
+class MatchExplainResponse(MatchResponse):
+    """
+    Schema for responses from the match explain endpoint.
+    """
+
+    profile: MatchProfile = pydantic.Field(
+        description="The profile of the blocking and scoring of each pass of the algorithm."
+    )
+
+
 class LinkResponse(MatchResponse):
     """
     Schema for responses from the link endpoint.
@@ -110,6 +246,30 @@ class LinkResponse(MatchResponse):
     )
 
 
+class LinkBatchResponse(pydantic.BaseModel):
+    """
+    Schema for responses from the link batch endpoint.
+    """
+
+    results: list[LinkResponse] = pydantic.Field(
+        description="The link responses for each record, in the same order as the input."
+    )
+
+
+class LinkStreamResult(pydantic.BaseModel):
+    """
+    Schema for each line of the responses from the link stream endpoint.
+    """
+
+    line: int = pydantic.Field(description="The line number of the record in the request body.")
+    result: LinkResponse | None = pydantic.Field(
+        default=None, description="The link response, if the record was linked."
+    )
+    error: str | None = pydantic.Field(
+        default=None, description="The reason the record could not be linked."
+    )
+
+
 class LinkFhirInput(pydantic.BaseModel):
     """
     Schema for requests to the link FHIR endpoint.
@@ -3,6 +3,8 @@ import uuid
 
 import pydantic
 
+from recordlinker.models.mpi import BlockingKey
+
 from .pii import PIIRecord
 
 
@@ -88,3 +90,38 @@ class PaginatedMetaData(pydantic.BaseModel):
 class PaginatedRefs(pydantic.BaseModel):
     data: list[uuid.UUID] = pydantic.Field(...)
     meta: PaginatedMetaData | None
+
+
+class BlockingStopValue(pydantic.BaseModel):
+    """
+    A blocking value common enough to be treated as missing when blocking.
+    """
+
+    model_config = pydantic.ConfigDict(from_attributes=True)
+
+    blocking_key: BlockingKey
+    value: str | None = None
+    count: int
+
+    @pydantic.field_serializer("blocking_key")
+    def serialize_blocking_key(self, key: BlockingKey) -> str:
+        """
+        Serialize the blocking key to a string.
+        """
+        return str(key)
+
+
+class BlockingStopValues(pydantic.BaseModel):
+    stop_values: list[BlockingStopValue]
+
+
+class BlockingIndexInfo(pydantic.BaseModel):
+    """
+    The size of the in-memory blocking index of the application process.
+    """
+
+    hashes: int
+    postings: int
+    bytes: int
+    mapped_bytes: int
+    watermark: int
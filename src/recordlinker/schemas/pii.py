@@ -354,12 +354,18 @@ class PIIRecord(StrippedBaseModel):
     race: typing.List[Race] = []
     identifiers: typing.List[Identifier] = []
 
+    # Precomputed, normalized feature values (see to_features), when available
+    _features: typing.Optional[dict[str, list[str]]] = pydantic.PrivateAttr(default=None)
+
     @classmethod
     def from_patient(cls, patient: models.Patient) -> "PIIRecord":
         """
-        Construct a PIIRecord from a Patient model.
+        Construct a PIIRecord from a Patient model.  If the Patient has
+        precomputed feature values, they are attached to the record.
         """
-        return PIIRecord.from_data(patient.data)
+        obj = PIIRecord.from_data(patient.data)
+        obj._features = patient.features
+        return obj
 
     @classmethod
     def from_data(cls, data: dict) -> typing.Self:
@@ -567,6 +573,62 @@ class PIIRecord(StrippedBaseModel):
                     identifier_authority = identifier.authority or ""
                     yield f"{normalize_text(identifier.value)}:{normalize_text(identifier_authority) if identifier_authority else identifier_authority}:{identifier.type}"
 
+    @staticmethod
+    def _feature_key(attribute: FeatureAttribute, prepend_suffix: bool = False) -> str:
+        """
+        Return the key used to store the values of a feature attribute in the
+        precomputed features dictionary.
+        """
+        if prepend_suffix and attribute == FeatureAttribute.FIRST_NAME:
+            return f"{attribute}+{FeatureAttribute.SUFFIX}"
+        return str(attribute)
+
+    def to_features(self) -> dict[str, list[str]]:
+        """
+        Compute the normalized values of every feature attribute for this record.
+        The result is JSON serializable, so it can be persisted alongside the
+        Patient data and used in place of feature_iter during comparisons.
+        """
+        features: dict[str, list[str]] = {}
+        for attribute in FeatureAttribute:
+            feature = Feature(attribute=attribute)
+            features[self._feature_key(attribute)] = list(self.feature_iter(feature))
+        first_name = Feature(attribute=FeatureAttribute.FIRST_NAME)
+        features[self._feature_key(FeatureAttribute.FIRST_NAME, True)] = list(
+            self.feature_iter(first_name, prepend_suffix=True)
+        )
+        return features
+
+    def precompute_features(self) -> typing.Self:
+        """
+        Compute and attach the normalized feature values to this record, so
+        subsequent calls to feature_values don't need to normalize the data again.
+        """
+        self._features = self.to_features()
+        return self
+
+    def clear_features(self) -> None:
+        """
+        Remove any precomputed feature values, this should be called whenever
+        the record is modified.
+        """
+        self._features = None
+
+    def feature_values(self, feature: Feature, prepend_suffix: bool = False) -> list[str]:
+        """
+        Return a list of all string values for a Feature.  The values are
+        identical to those returned by feature_iter, however when the record
+        has precomputed features, they are used instead of normalizing the data.
+        """
+        if self._features is None:
+            return list(self.feature_iter(feature, prepend_suffix=prepend_suffix))
+        values = self._features.get(self._feature_key(feature.attribute, prepend_suffix), [])
+        if feature.attribute == FeatureAttribute.IDENTIFIER and feature.suffix:
+            # identifier values are formatted as 'value:authority:type'
+            suffix = f":{feature.suffix}"
+            return [v for v in values if v.endswith(suffix)]
+        return values
+
     def blocking_keys(self, key: models.BlockingKey) -> set[str]:
         """
         For a particular Feature, return a set of all possible Blocking Key values
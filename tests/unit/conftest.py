@@ -1,3 +1,4 @@
+import asyncio
 import contextlib
 import functools
 import gzip
@@ -9,10 +10,12 @@ import pytest
 import sqlalchemy
 import sqlalchemy.event
 from fastapi.testclient import TestClient
+from sqlalchemy.ext import asyncio as sa_asyncio
 
 from recordlinker import database
 from recordlinker import main
 from recordlinker import schemas
+from recordlinker.config import settings
 from recordlinker.utils import path as utils
 
 
@@ -40,6 +43,23 @@ def session():
         yield session
 
 
+@pytest.fixture(scope="function")
+def async_session_maker(session):
+    """
+    An async sessionmaker connected to the same test database as the `session`
+    fixture.  Skips the test if the async driver for the database isn't installed.
+    """
+    drivers = {"sqlite": "aiosqlite", "postgresql": "asyncpg", "mysql": "aiomysql"}
+    url = sqlalchemy.engine.make_url(settings.test_db_uri)
+    driver = drivers.get(url.get_backend_name())
+    if driver is None:
+        pytest.skip(f"no async driver for {url.get_backend_name()}")
+    pytest.importorskip(driver)
+    engine = sa_asyncio.create_async_engine(url.set(drivername=f"{url.get_backend_name()}+{driver}"))
+    yield sa_asyncio.async_sessionmaker(bind=engine, expire_on_commit=False)
+    asyncio.run(engine.dispose())
+
+
 @pytest.fixture(scope="function")
 def client():
     # Create a new testing session, its important just to call the
@@ -5,12 +5,17 @@ unit.database.test_algorithm_service.py
 This module contains the unit tests for the recordlinker.database.algorithm_service module.
 """
 
+from unittest import mock
+
 import pytest
 import sqlalchemy.exc
+from conftest import count_queries
 from sqlalchemy.sql import select
+from sqlalchemy.sql import update
 
 from recordlinker import models
 from recordlinker import schemas
+from recordlinker.config import settings
 from recordlinker.database import algorithm_service
 
 
@@ -57,6 +62,87 @@ class TestGetAlgorithm:
         assert algorithm is None
 
 
+class TestGetCachedAlgorithm:
+    @pytest.fixture
+    def algorithm(self, session, default_algorithm):
+        obj, _ = algorithm_service.load_algorithm(session, default_algorithm)
+        obj.is_default = True
+        session.commit()
+        return obj
+
+    def test_not_found(self, session):
+        assert algorithm_service.get_cached_algorithm(session, "missing") is None
+        assert algorithm_service.get_cached_algorithm(session, None) is None
+
+    def test_cached(self, session, algorithm, default_algorithm):
+        result = algorithm_service.get_cached_algorithm(session, algorithm.label)
+        assert result == default_algorithm
+        with count_queries(session) as count:
+            assert algorithm_service.get_cached_algorithm(session, algorithm.label) is result
+        assert count() == 0
+
+    def test_default(self, session, algorithm, default_algorithm):
+        result = algorithm_service.get_cached_algorithm(session, None)
+        assert result == default_algorithm
+        assert algorithm_service.get_cached_algorithm(session, None) is result
+
+    def test_version_check(self, session, algorithm):
+        with mock.patch.object(settings, "algorithm_cache_ttl", 0):
+            result = algorithm_service.get_cached_algorithm(session, algorithm.label)
+            with count_queries(session) as count:
+                assert algorithm_service.get_cached_algorithm(session, algorithm.label) is result
+            # only the version was queried, the algorithm was not reloaded
+            assert count() == 1
+
+    def test_stale_version(self, session, algorithm):
+        with mock.patch.object(settings, "algorithm_cache_ttl", 0):
+            result = algorithm_service.get_cached_algorithm(session, algorithm.label)
+            # simulate another process updating the algorithm
+            session.execute(
+                update(models.Algorithm)
+                .where(models.Algorithm.id == algorithm.id)
+                .values(description="Changed elsewhere", version=algorithm.version + 1)
+            )
+            session.commit()
+            reloaded = algorithm_service.get_cached_algorithm(session, algorithm.label)
+            assert reloaded is not result
+            assert reloaded.description == "Changed elsewhere"
+
+    def test_invalidated_by_load(self, session, algorithm, default_algorithm):
+        result = algorithm_service.get_cached_algorithm(session, algorithm.label)
+        data = default_algorithm.model_copy(update={"description": "Updated description"})
+        algorithm_service.load_algorithm(session, data, algorithm, commit=True)
+        reloaded = algorithm_service.get_cached_algorithm(session, algorithm.label)
+        assert reloaded is not result
+        assert reloaded.description == "Updated description"
+
+    def test_invalidated_by_delete(self, session, algorithm):
+        assert algorithm_service.get_cached_algorithm(session, algorithm.label)
+        algorithm_service.delete_algorithm(session, algorithm, commit=True)
+        assert algorithm_service.get_cached_algorithm(session, algorithm.label) is None
+
+    def test_invalidated_by_clear(self, session, algorithm):
+        assert algorithm_service.get_cached_algorithm(session, None)
+        algorithm_service.clear_algorithms(session, commit=True)
+        assert algorithm_service.get_cached_algorithm(session, None) is None
+
+    def test_invalidated_after_commit(self, session, algorithm, default_algorithm):
+        data = default_algorithm.model_copy(update={"description": "Updated description"})
+        algorithm_service.load_algorithm(session, data, algorithm)
+        # a request in the middle of the transaction caches the algorithm
+        assert algorithm_service.get_cached_algorithm(session, algorithm.label)
+        assert algorithm_service._CACHE
+        session.commit()
+        assert not algorithm_service._CACHE
+
+    def test_not_invalidated_after_rollback(self, session, algorithm):
+        algorithm_service.delete_algorithm(session, algorithm)
+        session.rollback()
+        assert algorithm_service.get_cached_algorithm(session, algorithm.label)
+        session.commit()
+        assert algorithm_service._CACHE
+
+
 class TestLoadAlgorithm:
     def test_load_algorithm_created(self, session):
         data = schemas.Algorithm(
@@ -92,6 +178,7 @@ class TestLoadAlgorithm:
         assert obj.description == "First algorithm"
         assert obj.algorithm_context == {
             "include_multiple_matches": True,
+            "early_termination": False,
             "log_odds": [
                 {"feature": "FIRST_NAME", "value": 6.8},
                 {"feature": "ZIP", "value": 5.0},
@@ -153,10 +240,12 @@ class TestLoadAlgorithm:
         session.flush()
         assert created is False
         assert obj.id == 1
+        assert obj.version == 2
         assert obj.label == "dibbs-test"
         assert obj.description == "Updated description"
         assert obj.algorithm_context == {
             "include_multiple_matches": True,
+            "early_termination": False,
             "log_odds": [
                 {"feature": "FIRST_NAME", "value": 6.8},
                 {"feature": "ZIP", "value": 5.0},
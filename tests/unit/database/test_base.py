@@ -31,10 +31,10 @@ def test_tables():
     """
     with unittest.mock.patch.dict("os.environ", {"TUNING_ENABLED": "true"}):
         settings.__init__()
-        assert len(tables()) == 5
+        assert len(tables()) == 9
     with unittest.mock.patch.dict("os.environ", {"TUNING_ENABLED": "false"}):
         settings.__init__()
-        assert len(tables()) == 4
+        assert len(tables()) == 8
 
 
 class TestCreateSessionmaker:
@@ -68,7 +68,7 @@ class TestCreateSessionmaker:
                 assert len(self.existing_rl_tables(db_uri)) == 0
                 assert "alembic_version" not in self.existing_tables(db_uri)
                 session = create_sessionmaker(auto_migrate=True)()
-                assert len(self.existing_rl_tables(db_uri)) == 5
+                assert len(self.existing_rl_tables(db_uri)) == 9
                 assert "alembic_version" in self.existing_tables(db_uri)
                 assert str(session.bind.url) == db_uri
                 assert session.bind.pool.size() == 10
@@ -90,9 +90,9 @@ class TestCreateSessionmaker:
                 settings.__init__()
                 models.Base.metadata.create_all(create_engine(db_uri))
                 assert "alembic_version" not in self.existing_tables(db_uri)
-                assert len(self.existing_rl_tables(db_uri)) == 5
+                assert len(self.existing_rl_tables(db_uri)) == 9
                 session = create_sessionmaker(auto_migrate=True)()
-                assert len(self.existing_rl_tables(db_uri)) == 5
+                assert len(self.existing_rl_tables(db_uri)) == 9
                 assert "alembic_version" in self.existing_tables(db_uri)
                 assert str(session.bind.url) == db_uri
                 assert session.bind.pool.size() == 10
@@ -115,9 +115,9 @@ class TestCreateSessionmaker:
                 models.Base.metadata.create_all(create_engine(db_uri))
                 self.stamp_migrations()
                 assert "alembic_version" in self.existing_tables(db_uri)
-                assert len(self.existing_rl_tables(db_uri)) == 5
+                assert len(self.existing_rl_tables(db_uri)) == 9
                 session = create_sessionmaker(auto_migrate=True)()
-                assert len(self.existing_rl_tables(db_uri)) == 5
+                assert len(self.existing_rl_tables(db_uri)) == 9
                 assert "alembic_version" in self.existing_tables(db_uri)
                 assert str(session.bind.url) == db_uri
                 assert session.bind.pool.size() == 10
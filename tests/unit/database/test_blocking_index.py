@@ -0,0 +1,355 @@
+"""
+unit.database.test_blocking_index.py
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+This module contains the unit tests for the recordlinker.database.blocking_index module.
+"""
+
+import os
+import time
+from unittest import mock
+
+import pytest
+from sqlalchemy import orm
+from sqlalchemy.orm.session import Session
+
+from recordlinker import models
+from recordlinker import schemas
+from recordlinker.database import blocking_index
+from recordlinker.database import mpi_service
+
+
+@pytest.fixture(autouse=True)
+def logged():
+    # the changes are only logged with the blocking index enabled
+    with mock.patch.object(blocking_index.settings, "blocking_index", True):
+        yield
+
+
+@pytest.fixture
+def patients(session: Session):
+    records = [
+        schemas.PIIRecord(name=[{"given": ["John"], "family": "Doe"}], birth_date="1980-01-01"),
+        schemas.PIIRecord(name=[{"given": ["Jane"], "family": "Doe"}], birth_date="1980-01-01"),
+        schemas.PIIRecord(name=[{"given": ["John"], "family": "Smith"}], birth_date="1975-05-05"),
+    ]
+    return [mpi_service.insert_patient(session, r, person=models.Person()) for r in records]
+
+
+@pytest.fixture
+def enabled(tmp_path):
+    snapshot = str(tmp_path / "index.bin")
+    with (
+        mock.patch.object(blocking_index.settings, "blocking_index", True),
+        mock.patch.object(blocking_index.settings, "blocking_index_snapshot", snapshot),
+        mock.patch.object(blocking_index.settings, "blocking_index_refresh_interval", 0),
+    ):
+        blocking_index.reset_index()
+        yield snapshot
+        blocking_index.reset_index()
+
+
+def bhash(key: str, value: str) -> int:
+    return models.blocking_hash(models.BlockingKey[key], value)
+
+
+class TestBlockingIndex:
+    def test_add_remove(self):
+        index = blocking_index.BlockingIndex()
+        index.add(3, [1, 2])
+        index.add(1, [1])
+        index.add(2, [1])
+        index.add(1, [1])
+        assert list(index._postings[1]) == [1, 2, 3]
+        index.remove(2)
+        assert index.candidates([[1]]) == {1, 3}
+        # a removed patient added again replaces the hashes it was last added with
+        index.add(2, [2])
+        assert index.candidates([[1]]) == {1, 3}
+        assert index.candidates([[2]]) == {2, 3}
+        index.add(2, [3])
+        assert index.candidates([[2]]) == {3}
+        assert index.candidates([[3]]) == {2}
+        index.remove(2)
+        assert index.candidates([[3]]) == set()
+        assert index._changed == {}
+
+    def test_candidates(self):
+        index = blocking_index.BlockingIndex()
+        index.add(1, [10, 20])
+        index.add(2, [10, 21])
+        index.add(3, [11, 20])
+        assert index.candidates([[10], [20]]) == {1}
+        assert index.candidates([[10, 11], [20]]) == {1, 3}
+        assert index.candidates([[10], [20, 21]]) == {1, 2}
+        assert index.candidates([[10], [99]]) == set()
+        assert index.candidates([]) == set()
+
+    def test_memory_usage(self):
+        index = blocking_index.BlockingIndex()
+        index.add(1, [10, 20])
+        index.add(2, [10])
+        usage = index.memory_usage()
+        assert usage["hashes"] == 2
+        assert usage["postings"] == 3
+        assert usage["bytes"] > 0
+
+    def test_snapshot(self, tmp_path):
+        index = blocking_index.BlockingIndex()
+        index.add(1, [10, -20])
+        index.add(2, [10])
+        index.watermark = 2
+        index._gaps = [(5, 7, 0.0)]
+        path = str(tmp_path / "index.bin")
+        index.save(path)
+        loaded = blocking_index.BlockingIndex.from_snapshot(path)
+        assert loaded.watermark == 2
+        assert [(first, last) for first, last, _ in loaded._gaps] == [(5, 7)]
+        assert loaded._postings == {}
+        assert list(loaded._snapshot.hashes) == [-20, 10]
+        assert list(loaded._snapshot.get(10)) == [1, 2]
+        assert list(loaded._snapshot.get(-20)) == [1]
+        assert loaded._snapshot.get(11) is None
+        assert len(loaded) == 2
+        assert loaded.candidates([[10], [-20]]) == {1}
+        usage = loaded.memory_usage()
+        assert usage["postings"] == 3
+        assert usage["mapped_bytes"] == os.path.getsize(path)
+
+    def test_empty_snapshot(self, tmp_path):
+        path = str(tmp_path / "index.bin")
+        blocking_index.BlockingIndex().save(path)
+        loaded = blocking_index.BlockingIndex.from_snapshot(path)
+        assert len(loaded) == 0
+        assert loaded.candidates([[10]]) == set()
+
+    @pytest.mark.parametrize("size", [0, 1])
+    def test_invalid_snapshot(self, tmp_path, size: int):
+        path = tmp_path / "index.bin"
+        path.write_bytes(b"\0" * blocking_index.SNAPSHOT_HEADER.size * size)
+        with pytest.raises(ValueError, match="invalid blocking index snapshot"):
+            blocking_index.BlockingIndex.from_snapshot(str(path))
+
+    def test_snapshot_delta(self, tmp_path):
+        index = blocking_index.BlockingIndex()
+        index.add(1, [10, 20])
+        index.add(2, [10, 21])
+        path = str(tmp_path / "index.bin")
+        index.save(path)
+        loaded = blocking_index.BlockingIndex.from_snapshot(path)
+        # a new patient, and an updated one, are held in the delta
+        loaded.add(3, [10, 20])
+        loaded.remove(2)
+        loaded.add(2, [11, 20])
+        assert loaded.candidates([[10], [20]]) == {1, 3}
+        assert loaded.candidates([[10, 11], [20, 21]]) == {1, 2, 3}
+        assert loaded.candidates([[21]]) == set()
+        loaded.remove(1)
+        assert loaded.candidates([[10]]) == {3}
+        assert len(loaded) == 4
+        # saving merges the delta into a new snapshot
+        loaded.save(path)
+        merged = blocking_index.BlockingIndex.from_snapshot(path)
+        assert list(merged._snapshot.hashes) == [10, 11, 20]
+        assert list(merged._snapshot.get(20)) == [2, 3]
+        loaded.clear()
+        assert len(loaded) == 0
+        assert loaded.candidates([[10]]) == set()
+
+    @pytest.mark.parametrize("storage", ["value", "hash"])
+    def test_load(self, session: Session, storage: str):
+        with mock.patch.object(blocking_index.settings, "blocking_storage", storage):
+            record = schemas.PIIRecord(birth_date="1980-01-01")
+            patient = mpi_service.insert_patient(session, record)
+            index = blocking_index.BlockingIndex()
+            assert index.load(session) == 1
+            assert index.watermark == patient.id
+            assert index.candidates([[bhash("BIRTHDATE", "1980-01-01")]]) == {patient.id}
+
+    def test_catch_up(self, session: Session, patients: list[models.Patient]):
+        index = blocking_index.BlockingIndex()
+        index.load(session)
+        # a patient inserted by another process, the index isn't updated in place
+        record = schemas.PIIRecord(birth_date="1980-01-01")
+        other = mpi_service.insert_patient(session, record)
+        birthdate = bhash("BIRTHDATE", "1980-01-01")
+        assert index.candidates([[birthdate]]) == {patients[0].id, patients[1].id}
+        assert index.catch_up(session) > 0
+        assert index.watermark == other.id
+        assert index.candidates([[birthdate]]) == {patients[0].id, patients[1].id, other.id}
+
+    def test_catch_up_changes(self, session: Session, patients: list[models.Patient]):
+        index = blocking_index.BlockingIndex()
+        index.load(session)
+        smith = bhash("LAST_NAME", "smit")
+        doe = bhash("LAST_NAME", "doe")
+        # patients changed by another process, which doesn't have this index
+        with (
+            mock.patch.object(blocking_index, "current", return_value=None),
+            orm.Session(bind=session.get_bind()) as other,
+        ):
+            mpi_service.update_patient(
+                other,
+                other.get(models.Patient, patients[0].id),
+                schemas.PIIRecord(name=[{"given": ["John"], "family": "Smith"}]),
+            )
+            mpi_service.delete_patient(other, other.get(models.Patient, patients[2].id), commit=True)
+        assert index.candidates([[smith]]) == {patients[2].id}
+        assert index.catch_up(session) > 0
+        assert index.change_watermark == blocking_index.last_change(session)
+        assert index.candidates([[smith]]) == {patients[0].id}
+        assert index.candidates([[doe]]) == {patients[1].id}
+        # changing a patient again replaces the postings from the last change
+        with (
+            mock.patch.object(blocking_index, "current", return_value=None),
+            orm.Session(bind=session.get_bind()) as other,
+        ):
+            mpi_service.update_patient(
+                other,
+                other.get(models.Patient, patients[0].id),
+                schemas.PIIRecord(name=[{"given": ["John"], "family": "Doe"}]),
+            )
+        index.catch_up(session)
+        assert index.candidates([[smith]]) == set()
+        assert index.candidates([[doe]]) == {patients[0].id, patients[1].id}
+
+    def test_catch_up_deferred(self, session: Session, patients: list[models.Patient]):
+        record = schemas.PIIRecord(birth_date="1990-02-02")
+        pending = mpi_service.insert_patient(session, record, defer_index=True)
+        # a later patient moves the watermark past the pending one
+        mpi_service.insert_patient(session, schemas.PIIRecord(birth_date="1970-03-03"))
+        index = blocking_index.BlockingIndex()
+        index.load(session)
+        assert mpi_service.index_pending_patients(session) == 1
+        index.catch_up(session)
+        assert index.candidates([[bhash("BIRTHDATE", "1990-02-02")]]) == {pending.id}
+
+    def test_catch_up_late_commit(self, session: Session, patients: list[models.Patient]):
+        index = blocking_index.BlockingIndex()
+        index.load(session)
+        late = mpi_service.insert_patient(session, schemas.PIIRecord(birth_date="1990-02-02"))
+        change = session.query(models.BlockingChange).filter_by(patient_id=late.id).one()
+        change_id = change.id
+        # the late patient's transaction hasn't committed yet, while another transaction
+        # has committed a change with a much higher id
+        session.delete(change)
+        other = mpi_service.insert_patient(session, schemas.PIIRecord(birth_date="1970-03-03"))
+        session.query(models.BlockingChange).filter_by(patient_id=other.id).update(
+            {"id": change_id + 500}
+        )
+        session.commit()
+        index.catch_up(session)
+        assert index.candidates([[bhash("BIRTHDATE", "1970-03-03")]]) == {other.id}
+        assert index.candidates([[bhash("BIRTHDATE", "1990-02-02")]]) == set()
+        assert index.change_watermark == change_id + 500
+        assert [(first, last) for first, last, _ in index._gaps] == [
+            (change_id, change_id + 499)
+        ]
+        # the change is read once committed, even though the watermark has moved past it
+        session.add(models.BlockingChange(id=change_id, patient_id=late.id))
+        session.commit()
+        index.catch_up(session)
+        assert index.candidates([[bhash("BIRTHDATE", "1990-02-02")]]) == {late.id}
+        assert [(first, last) for first, last, _ in index._gaps] == [
+            (change_id + 1, change_id + 499)
+        ]
+        # the gaps that are never committed expire
+        later = time.monotonic() + 10
+        with (
+            mock.patch.object(blocking_index.settings, "blocking_index_change_retention", 1),
+            mock.patch.object(blocking_index.time, "monotonic", return_value=later),
+        ):
+            index.catch_up(session)
+        assert index._gaps == []
+
+    def test_catch_up_reset(self, session: Session, patients: list[models.Patient]):
+        index = blocking_index.BlockingIndex()
+        index.load(session)
+        with mock.patch.object(blocking_index, "current", return_value=None):
+            mpi_service.reset_mpi(session)
+        index.catch_up(session)
+        assert len(index) == 0
+        assert index.watermark == 0
+
+    def test_build_snapshot(self, session: Session, patients: list[models.Patient], tmp_path):
+        path = str(tmp_path / "index.bin")
+        assert blocking_index.build_snapshot(session, path) > 0
+        index = blocking_index.BlockingIndex.from_snapshot(path)
+        assert index.watermark == patients[-1].id
+        assert index.candidates([[bhash("LAST_NAME", "doe")]]) == {p.id for p in patients[:2]}
+
+    def test_build_snapshot_prune(
+        self, session: Session, patients: list[models.Patient], tmp_path
+    ):
+        index = blocking_index.BlockingIndex()
+        index.load(session)
+        mpi_service.update_patient(
+            session, patients[0], schemas.PIIRecord(name=[{"given": ["Jon"], "family": "Smith"}])
+        )
+        count = session.query(models.BlockingChange).count()
+        path = str(tmp_path / "index.bin")
+        # the changes are kept for the retention, so other processes can read them
+        blocking_index.build_snapshot(session, path, prune=True)
+        session.commit()
+        assert session.query(models.BlockingChange).count() == count
+        assert index.stale(session) is False
+        with mock.patch.object(blocking_index.settings, "blocking_index_change_retention", 0):
+            blocking_index.build_snapshot(session, path, prune=True)
+            session.commit()
+        # the latest change is always kept
+        assert session.query(models.BlockingChange).count() == 1
+        # the index hadn't caught up to the pruned changes, so it maps the new snapshot
+        index._snapshot = blocking_index.MappedSnapshot(path)
+        assert index.stale(session) is True
+        index.catch_up(session)
+        assert index._snapshot is not None
+        assert index.stale(session) is False
+        assert index.candidates([[bhash("LAST_NAME", "smit")]]) == {p.id for p in patients[::2]}
+        mpi_service.delete_patient(session, patients[1], commit=True)
+        index.catch_up(session)
+        assert index.candidates([[bhash("LAST_NAME", "doe")]]) == set()
+
+
+class TestGetIndex:
+    def test_disabled(self, session: Session):
+        with mock.patch.object(blocking_index.settings, "blocking_index", False):
+            assert blocking_index.get_index(session) is None
+
+    def test_in_memory(self, session: Session, patients: list[models.Patient], enabled: str):
+        with mock.patch.object(blocking_index.settings, "blocking_index_snapshot", None):
+            index = blocking_index.get_index(session)
+        assert index._snapshot is None
+        assert index.candidates([[bhash("LAST_NAME", "doe")]]) == {p.id for p in patients[:2]}
+        assert not os.path.exists(enabled)
+
+    def test_snapshot(self, session: Session, patients: list[models.Patient], enabled: str):
+        index = blocking_index.get_index(session)
+        assert blocking_index.get_index(session) is index
+        assert index._snapshot is not None
+        assert index.candidates([[bhash("LAST_NAME", "doe")]]) == {p.id for p in patients[:2]}
+        # the snapshot is built on first use, and mapped on the next load
+        blocking_index.reset_index()
+        with mock.patch.object(blocking_index.BlockingIndex, "load") as load:
+            loaded = blocking_index.get_index(session)
+            load.assert_not_called()
+        assert loaded is not index
+        assert loaded.candidates([[bhash("LAST_NAME", "doe")]]) == {p.id for p in patients[:2]}
+        # patients inserted since the snapshot was built are caught up into the delta
+        other = mpi_service.insert_patient(session, schemas.PIIRecord(birth_date="1980-01-01"))
+        blocking_index.reset_index()
+        loaded = blocking_index.get_index(session)
+        assert loaded.watermark == other.id
+        assert other.id in loaded.candidates([[bhash("BIRTHDATE", "1980-01-01")]])
+
+    def test_updated_in_place(self, session: Session, patients: list[models.Patient], enabled: str):
+        index = blocking_index.get_index(session)
+        smith = bhash("LAST_NAME", "smit")
+        mpi_service.update_patient(
+            session, patients[0], schemas.PIIRecord(name=[{"given": ["John"], "family": "Smith"}])
+        )
+        assert index.candidates([[smith]]) == {patients[0].id, patients[2].id}
+        assert index.candidates([[bhash("LAST_NAME", "doe")]]) == {patients[1].id}
+        mpi_service.delete_patient(session, patients[2], commit=True)
+        assert index.candidates([[smith]]) == {patients[0].id}
+        mpi_service.reset_mpi(session)
+        assert len(index) == 0
@@ -5,7 +5,9 @@ unit.database.test_mpi_service.py
 This module contains the unit tests for the recordlinker.database.mpi_service module.
 """
 
+import asyncio
 import uuid
+from unittest import mock
 
 import pytest
 import sqlalchemy.exc
@@ -16,6 +18,7 @@ from sqlalchemy.orm.session import Session
 
 from recordlinker import models
 from recordlinker import schemas
+from recordlinker.database import blocking_index
 from recordlinker.database import mpi_service
 
 
@@ -156,6 +159,28 @@ class TestInsertPatient:
         assert patient.person_id is None
         assert len(patient.blocking_values) == 3
 
+    def test_async(self, session: Session, async_session_maker):
+        record = schemas.PIIRecord(
+            name=[{"given": ["Johnathon"], "family": "Smith"}], birthdate="01/01/1980"
+        )
+
+        async def insert():
+            async with async_session_maker() as async_session:
+                person = models.Person()
+                patient = await mpi_service.insert_patient_async(
+                    async_session, record, person, external_patient_id="123"
+                )
+                return patient.id, person.id
+
+        patient_id, person_id = asyncio.run(insert())
+        patient = session.get(models.Patient, patient_id)
+        assert patient.person_id == person_id
+        assert patient.external_patient_id == "123"
+        assert patient.data["birth_date"] == "1980-01-01"
+        assert len(patient.blocking_values) == 3
+        assert patient.features == record.to_features()
+        assert patient.features["BIRTHDATE"] == ["1980-01-01"]
+
     def test_no_person_with_external_id(self, session: Session):
         data = {
             "name": [
@@ -240,13 +265,48 @@ class TestInsertPatient:
         assert patient.external_person_source is None
         assert len(patient.blocking_values) == 2
 
+    def test_hash_storage(self, session: Session):
+        record = schemas.PIIRecord(name=[{"given": ["George"], "family": "Harrison"}])
+        with mock.patch.object(mpi_service.settings, "blocking_storage", "hash"):
+            patient = mpi_service.insert_patient(session, record)
+        assert len(patient.blocking_values) == 0
+        hashes = session.query(models.BlockingHash).filter_by(patient_id=patient.id).all()
+        assert sorted(h.hash for h in hashes) == sorted(
+            models.blocking_hash(k, v) for k, v in record.blocking_values()
+        )
 
-class TestBulkInsertPatients:
-    @classmethod
-    def setup_class(cls):
-        if db_dialect() == "mysql":
-            pytest.skip("Test skipped because the database dialect is MySQL")
+    def test_defer_index(self, session: Session):
+        record = schemas.PIIRecord(name=[{"given": ["George"], "family": "Harrison"}])
+        patient = mpi_service.insert_patient(session, record, defer_index=True)
+        assert patient.pending_index is True
+        assert len(patient.blocking_values) == 0
+        hashes = session.query(models.PendingBlockingHash).filter_by(patient_id=patient.id)
+        assert sorted(h.hash for h in hashes) == sorted(
+            models.blocking_hash(k, v) for k, v in record.blocking_values()
+        )
+
+    def test_defer_index_max_pending(self, session: Session):
+        record = schemas.PIIRecord(name=[{"given": ["George"], "family": "Harrison"}])
+        with mock.patch.object(mpi_service.settings, "deferred_index_max_pending", 1):
+            pending = mpi_service.insert_patient(session, record, defer_index=True)
+            indexed = mpi_service.insert_patient(session, record, defer_index=True)
+            assert mpi_service.count_pending_patients(session) == 1
+        assert pending.pending_index is True
+        assert indexed.pending_index is False
+        assert len(indexed.blocking_values) == 2
+
+    def test_count_pending_cached(self, session: Session):
+        record = schemas.PIIRecord(name=[{"given": ["George"], "family": "Harrison"}])
+        mpi_service.insert_patient(session, record, defer_index=True)
+        count = mpi_service.count_pending_patients(session)
+        with mock.patch.object(session, "execute", wraps=session.execute) as execute:
+            mpi_service.insert_patient(session, record, defer_index=True)
+            # the Patients deferred by this process are added to the cached count
+            assert mpi_service.count_pending_patients(session, max_age=60) == count + 1
+        assert not any("count" in str(c.args[0]).lower() for c in execute.call_args_list)
 
+
+class TestBulkInsertPatients:
     def test_empty(self, session: Session):
         assert mpi_service.bulk_insert_patients(session, []) == []
 
@@ -300,15 +360,159 @@ class TestBulkInsertPatients:
         }
 
 
-class TestBulkInsertPatientsMySQL:
-    @classmethod
-    def setup_class(cls):
-        if db_dialect() != "mysql":
-            pytest.skip("Test skipped because the database dialect is not MySQL")
+class TestBulkInsertPatientsWithoutReturning:
+    def test_insert(self, session: Session):
+        person = models.Person()
+        records = [
+            schemas.PIIRecord(external_id=str(i), birth_date="1980-01-01", sex="F")
+            for i in range(5)
+        ]
+        dialect = session.get_bind().dialect
+        with mock.patch.object(dialect, "insert_returning", False):
+            with count_queries(session) as count:
+                patients = mpi_service.bulk_insert_patients(
+                    session, records, person=person, external_person_id="123456"
+                )
+        # 1 for the Person, 1 for the Patients, 1 to read them back and 1 for the BlockingValues
+        assert count() == 4
+        assert [p.external_patient_id for p in patients] == ["0", "1", "2", "3", "4"]
+        assert len({p.reference_id for p in patients}) == 5
+        assert all(p.person_id == person.id for p in patients)
+        assert all(p.external_person_source == "IRIS" for p in patients)
+        assert session.query(models.BlockingValue).count() == 10
+
+
+class TestCopyCsvField:
+    def test_null(self):
+        assert mpi_service._copy_csv_field(None) == ""
+
+    def test_empty_string(self):
+        assert mpi_service._copy_csv_field("") == '""'
+
+    def test_quoted(self):
+        assert mpi_service._copy_csv_field('O"Brien, Jr') == '"O""Brien, Jr"'
+        assert mpi_service._copy_csv_field(5) == '"5"'
+
+    def test_json(self):
+        assert mpi_service._copy_csv_field({"a": "b"}) == '"{""a"": ""b""}"'
+
+
+class TestCopyReader:
+    def test_read_all(self):
+        reader = mpi_service.CopyReader([(1, "a"), (None, 'b"c')])
+        assert reader.read() == '"1","a"\n,"b""c"\n'
+        assert reader.read() == ""
+
+    def test_read_chunks(self):
+        rows = ((i, "x" * 10) for i in range(100))
+        reader = mpi_service.CopyReader(rows)
+        first = reader.read(50)
+        assert len(first) == 50
+        # only the rows needed for the first chunk have been encoded
+        assert next(rows)[0] < 10
+        chunks = [first]
+        while chunk := reader.read(50):
+            chunks.append(chunk)
+        assert all(len(c) <= 50 for c in chunks)
+        assert "".join(chunks).startswith('"0","xxxxxxxxxx"\n"1","xxxxxxxxxx"\n')
+
+
+class TestSeedClusters:
+    def clusters(self):
+        return [
+            schemas.Cluster(
+                records=[
+                    schemas.PIIRecord(external_id="a", birth_date="1980-01-01", sex="F"),
+                    schemas.PIIRecord(external_id="b", birth_date="1980-01-01"),
+                ],
+                external_person_id="p1",
+            ),
+            schemas.Cluster(records=[schemas.PIIRecord(name=[{"family": "Smith"}])]),
+        ]
 
-    def test_error(self, session: Session):
+    def test_seed(self, session: Session):
+        results = mpi_service.seed_clusters(session, self.clusters())
+        assert len(results) == 2
+        assert results[0].external_person_id == "p1"
+        assert [p.external_patient_id for p in results[0].patients] == ["a", "b"]
+        assert len(results[1].patients) == 1
+        person = mpi_service.get_person_by_reference_id(session, results[0].person_reference_id)
+        assert person is not None
+        assert {p.reference_id for p in person.patients} == {
+            p.patient_reference_id for p in results[0].patients
+        }
+        assert {p.external_person_source for p in person.patients} == {"IRIS"}
+        assert session.query(models.Person).count() == 2
+        assert session.query(models.Patient).count() == 3
+        assert session.query(models.BlockingValue).count() == 4
+
+    def test_copy_unsupported(self, session: Session):
+        if mpi_service.supports_copy(session):
+            pytest.skip("Test skipped because the database supports COPY")
         with pytest.raises(ValueError):
-            assert mpi_service.bulk_insert_patients(session, [])
+            mpi_service.copy_seed_clusters(session, self.clusters())
+
+
+class TestCopySeedClusters:
+    @classmethod
+    def setup_class(cls):
+        if db_dialect() != "postgresql":
+            pytest.skip("Test skipped because the database dialect is not PostgreSQL")
+
+    def test_copy(self, session: Session):
+        clusters = [
+            schemas.Cluster(
+                records=[
+                    schemas.PIIRecord(external_id="", birth_date="1980-01-01", sex="F"),
+                    schemas.PIIRecord(name=[{"given": ['Jo "JJ"'], "family": "O'Brien, Jr"}]),
+                ],
+                external_person_id="p1",
+            ),
+        ]
+        results = mpi_service.copy_seed_clusters(session, clusters)
+        person = mpi_service.get_person_by_reference_id(session, results[0].person_reference_id)
+        patients = sorted(person.patients, key=lambda p: p.id)
+        assert [p.reference_id for p in patients] == [
+            p.patient_reference_id for p in results[0].patients
+        ]
+        assert patients[0].external_patient_id == ""
+        assert patients[1].external_patient_id is None
+        assert patients[1].data == {"name": [{"given": ['Jo "JJ"'], "family": "O'Brien, Jr"}]}
+        assert patients[0].external_person_source == "IRIS"
+        assert {(b.blockingkey, b.value) for b in patients[0].blocking_values} == {
+            (models.BlockingKey.BIRTHDATE.id, "1980-01-01"),
+            (models.BlockingKey.SEX.id, "F"),
+        }
+        # the sequences are advanced past the pre-allocated ids
+        patient = models.Patient(data={})
+        session.add(patient)
+        session.flush()
+        assert patient.id > patients[1].id
+
+    def test_blocking_index(self, session: Session):
+        index = blocking_index.BlockingIndex()
+        clusters = [schemas.Cluster(records=[schemas.PIIRecord(birth_date="1980-01-01")])]
+        with (
+            mock.patch.object(mpi_service.settings, "blocking_index", True),
+            mock.patch.object(blocking_index, "current", return_value=index),
+        ):
+            results = mpi_service.copy_seed_clusters(session, clusters)
+        person = mpi_service.get_person_by_reference_id(session, results[0].person_reference_id)
+        patient = person.patients[0]
+        birthdate = models.blocking_hash(models.BlockingKey.BIRTHDATE, "1980-01-01")
+        # the seeded patients are added to the index, and logged for the other processes
+        assert index.candidates([[birthdate]]) == {patient.id}
+        changes = session.query(models.BlockingChange).filter_by(patient_id=patient.id).all()
+        assert len(changes) == 1
+        assert changes[0].created_at is not None
+
+    def test_insert_blocking_values(self, session: Session):
+        patients = [models.Patient(data={}) for _ in range(mpi_service.COPY_MIN_ROWS)]
+        session.add_all(patients)
+        session.flush()
+        records = [schemas.PIIRecord(sex="M") for _ in patients]
+        mpi_service.insert_blocking_values(session, patients, records=records)
+        assert session.query(models.BlockingValue).count() == mpi_service.COPY_MIN_ROWS
 
 
 class TestUpdatePatient:
@@ -335,6 +539,14 @@ class TestUpdatePatient:
         }
         assert len(patient.blocking_values) == 3
 
+    def test_update_pending(self, session: Session):
+        record = schemas.PIIRecord(name=[{"given": ["John"], "family": "Doe"}])
+        patient = mpi_service.insert_patient(session, record, defer_index=True)
+        patient = mpi_service.update_patient(session, patient, record=record)
+        assert patient.pending_index is False
+        assert len(patient.blocking_values) == 2
+        assert mpi_service.index_pending_patients(session) == 0
+
     def test_update_person(self, session: Session):
         person = models.Person()
         session.add(person)
@@ -353,6 +565,134 @@ class TestUpdatePatient:
         assert patient.external_patient_id == "123"
 
 
+class TestBackfillPatientFeatures:
+    def test_empty(self, session: Session):
+        assert mpi_service.backfill_patient_features(session) == 0
+
+    def test_backfill(self, session: Session):
+        records = [
+            schemas.PIIRecord(name=[{"given": ["John"], "family": "Doe"}]),
+            schemas.PIIRecord(name=[{"given": ["Jane"], "family": "Smith"}]),
+            schemas.PIIRecord(birth_date="1980-01-01"),
+        ]
+        patients = [models.Patient(data=r.to_data()) for r in records]
+        patients.append(mpi_service.insert_patient(session, records[0], commit=False))
+        session.add_all(patients)
+        session.commit()
+        assert mpi_service.backfill_patient_features(session, batch_size=2) == 3
+        for patient in patients:
+            session.refresh(patient)
+            assert patient.features == schemas.PIIRecord.from_data(patient.data).to_features()
+        assert mpi_service.backfill_patient_features(session) == 0
+
+
+class TestBackfillBlockingHashes:
+    def test_empty(self, session: Session):
+        assert mpi_service.backfill_blocking_hashes(session) == 0
+
+    def test_backfill(self, session: Session):
+        records = [
+            schemas.PIIRecord(name=[{"given": ["John"], "family": "Doe"}]),
+            schemas.PIIRecord(birth_date="1980-01-01"),
+            schemas.PIIRecord(),
+        ]
+        patients = [mpi_service.insert_patient(session, r, commit=False) for r in records]
+        # pending patients are left for the indexer
+        mpi_service.insert_patient(session, records[0], defer_index=True, commit=False)
+        session.commit()
+        assert mpi_service.backfill_blocking_hashes(session, batch_size=2) == 3
+        hashes = session.query(models.BlockingHash).all()
+        assert {(h.patient_id, h.hash) for h in hashes} == {
+            (p.id, models.blocking_hash(k, v))
+            for p, r in zip(patients, records)
+            for k, v in r.blocking_values()
+        }
+        # the patient without blocking values is checked again, but nothing is inserted
+        assert mpi_service.backfill_blocking_hashes(session) == 1
+        assert session.query(models.BlockingHash).count() == len(hashes)
+
+
+class TestRefreshBlockingStats:
+    def test_empty(self, session: Session):
+        assert mpi_service.refresh_blocking_stats(session) == 0
+        assert session.query(models.BlockingStat).count() == 0
+
+    def test_refresh(self, session: Session):
+        for given in ["John", "Johnny", "Jane"]:
+            record = schemas.PIIRecord(
+                name=[{"given": [given], "family": "Doe"}], birth_date="1980-01-01"
+            )
+            mpi_service.insert_patient(session, record)
+        session.add(models.BlockingStat(hash=1, count=1))
+        session.commit()
+        assert mpi_service.refresh_blocking_stats(session, min_count=2) == 3
+        stats = {s.hash: s.count for s in session.query(models.BlockingStat)}
+        assert stats == {
+            models.blocking_hash(models.BlockingKey.BIRTHDATE, "1980-01-01"): 3,
+            models.blocking_hash(models.BlockingKey.LAST_NAME, "doe"): 3,
+            models.blocking_hash(models.BlockingKey.FIRST_NAME, "john"): 2,
+        }
+
+
+class TestBlockingStopValues:
+    @pytest.fixture(params=["value", "hash"])
+    def storage(self, request):
+        with mock.patch.object(mpi_service.settings, "blocking_storage", request.param):
+            yield request.param
+
+    @pytest.fixture
+    def placeholders(self, session: Session, storage: str):
+        # half the patients have a placeholder birthdate, the rest are all different
+        birthdates = ["1900-01-01"] * 6 + [f"1980-01-0{i}" for i in range(1, 7)]
+        for birthdate in birthdates:
+            record = schemas.PIIRecord(
+                name=[{"given": ["John"], "family": "Doe"}], birth_date=birthdate
+            )
+            mpi_service.insert_patient(session, record, person=models.Person(), commit=False)
+        session.commit()
+
+    def test_disabled(self, session: Session, placeholders: None):
+        mpi_service.refresh_blocking_stats(session, min_count=1)
+        assert mpi_service.get_blocking_stop_values(session) == []
+
+    def test_refresh(self, session: Session, placeholders: None):
+        with mock.patch.object(mpi_service.settings, "blocking_stop_value_ratio", 2.0):
+            assert mpi_service.refresh_blocking_stats(session, min_count=1) == 9
+        # the first name is shared by every patient, but it's the only value of its key
+        stop_values = mpi_service.get_blocking_stop_values(session)
+        assert [(s.blocking_key, s.value, s.count) for s in stop_values] == [
+            (models.BlockingKey.BIRTHDATE, "1900-01-01", 6)
+        ]
+
+    def test_blocking(self, session: Session, placeholders: None):
+        with mock.patch.object(mpi_service.settings, "blocking_stop_value_ratio", 2.0):
+            mpi_service.refresh_blocking_stats(session, min_count=1)
+            algorithm_pass = schemas.AlgorithmPass(
+                label="pass",
+                evaluators=[],
+                blocking_keys=["BIRTHDATE", "LAST_NAME"],
+                possible_match_window=(0, 1),
+            )
+            context = schemas.AlgorithmContext(
+                log_odds=[
+                    {"feature": "LAST_NAME", "value": 6.3},
+                    {"feature": "BIRTHDATE", "value": 5.0},
+                ],
+            )
+            # the placeholder birthdate is treated as missing, so only the last name blocks
+            record = schemas.PIIRecord(
+                name=[{"given": ["Jane"], "family": "Doe"}], birth_date="1900-01-01"
+            )
+            matches = mpi_service.BlockData.get(session, record, algorithm_pass, context)
+            assert len(matches) == 12
+            # a birthdate that isn't a stop value still blocks
+            record = schemas.PIIRecord(
+                name=[{"given": ["Jane"], "family": "Doe"}], birth_date="1980-01-01"
+            )
+            matches = mpi_service.BlockData.get(session, record, algorithm_pass, context)
+            assert len(matches) == 1
+
+
 class TestDeleteBlockingValuesForPatient:
     def test_no_values(self, session: Session):
         other_patient = models.Patient()
@@ -392,6 +732,32 @@ class TestDeleteBlockingValuesForPatient:
         mpi_service.delete_blocking_values_for_patient(session, patient)
         assert len(patient.blocking_values) == 0
 
+    def test_with_hashes(self, session: Session):
+        with mock.patch.object(mpi_service.settings, "blocking_storage", "hash"):
+            patient = mpi_service.insert_patient(session, schemas.PIIRecord(sex="M"))
+            assert session.query(models.BlockingHash).count() == 1
+            mpi_service.delete_blocking_values_for_patient(session, patient)
+        assert session.query(models.BlockingHash).count() == 0
+
+
+class TestIndexPendingPatients:
+    def test_none_pending(self, session: Session):
+        mpi_service.insert_patient(session, schemas.PIIRecord(sex="M"))
+        assert mpi_service.index_pending_patients(session) == 0
+
+    def test_batches(self, session: Session):
+        record = schemas.PIIRecord(birthdate="1980-01-01", sex="F")
+        patients = [
+            mpi_service.insert_patient(session, record, defer_index=True) for _ in range(3)
+        ]
+        assert mpi_service.index_pending_patients(session, batch_size=2) == 2
+        assert mpi_service.index_pending_patients(session, batch_size=2) == 1
+        assert mpi_service.index_pending_patients(session, batch_size=2) == 0
+        for patient in patients:
+            session.refresh(patient)
+            assert patient.pending_index is False
+            assert len(patient.blocking_values) == 2
+
 
 class TestBlockData:
     @pytest.fixture
@@ -948,6 +1314,554 @@ class TestBlockData:
         matches = mpi_service.BlockData.get(session, schemas.PIIRecord(**data), algorithm_pass, context)
         assert len(matches) == 3
 
+    def test_filter_uses_stored_blocking_values(self, session: Session, prime_index: None):
+        data = {
+            "name": [{"given": ["Johnathon", "Bill"], "family": "Smith"}],
+            "birthdate": "01/01/1980",
+        }
+        algorithm_pass = schemas.AlgorithmPass(
+            label="pass",
+            evaluators=[],
+            blocking_keys=["BIRTHDATE", "FIRST_NAME"],
+            possible_match_window=(0, 1),
+        )
+        context = schemas.AlgorithmContext(
+            log_odds=[
+                {"feature": "FIRST_NAME", "value": 6.8},
+                {"feature": "BIRTHDATE", "value": 10.1},
+            ],
+            advanced={"max_missing_allowed_proportion": 0.3},
+        )
+        with mock.patch.object(schemas.PIIRecord, "from_patient", side_effect=AssertionError):
+            matches = mpi_service.BlockData.get(
+                session, schemas.PIIRecord(**data), algorithm_pass, context
+            )
+        # One candidate in MPI person_1 is just a Bill, ruled out
+        assert len(matches) == 3
+
+    def test_get_multi(self, session: Session, prime_index: None):
+        data = {
+            "name": [{"given": ["Johnathon", "Bill"], "family": "Smith"}],
+            "birthdate": "01/01/1980",
+        }
+        passes = [
+            schemas.AlgorithmPass(
+                label="birthdate",
+                evaluators=[],
+                blocking_keys=["BIRTHDATE"],
+                possible_match_window=(0, 1),
+            ),
+            schemas.AlgorithmPass(
+                label="names",
+                evaluators=[],
+                blocking_keys=["BIRTHDATE", "FIRST_NAME", "LAST_NAME"],
+                possible_match_window=(0, 1),
+            ),
+            schemas.AlgorithmPass(
+                label="email",
+                evaluators=[],
+                blocking_keys=["EMAIL"],
+                possible_match_window=(0, 1),
+            ),
+        ]
+        context = schemas.AlgorithmContext(
+            log_odds=[
+                {"feature": "FIRST_NAME", "value": 6.8},
+                {"feature": "LAST_NAME", "value": 6.3},
+                {"feature": "BIRTHDATE", "value": 10.1},
+                {"feature": "EMAIL", "value": 5.0},
+            ],
+            advanced={"max_missing_allowed_proportion": 0.3},
+        )
+        record = schemas.PIIRecord(**data)
+        with count_queries(session) as count:
+            matches = mpi_service.BlockData.get_multi(session, record, passes, context)
+            # One query for the patients, one for their stored blocking values
+            assert count() == 2
+        assert list(matches.keys()) == ["birthdate", "names", "email"]
+        for algorithm_pass in passes:
+            expected = mpi_service.BlockData.get(session, record, algorithm_pass, context)
+            assert sorted(p.id for p in matches[algorithm_pass.resolved_label]) == sorted(
+                p.id for p in expected
+            )
+        assert len(matches["birthdate"]) == 4
+        assert len(matches["names"]) == 2
+        assert matches["email"] == []
+        # Patients returned in multiple passes are the same hydrated objects
+        shared = {id(p) for p in matches["names"]} & {id(p) for p in matches["birthdate"]}
+        assert len(shared) == 2
+
+    def test_pending(self, session: Session, prime_index: None):
+        algorithm_pass = schemas.AlgorithmPass(
+            label="pass",
+            evaluators=[],
+            blocking_keys=["BIRTHDATE", "LAST_NAME"],
+            possible_match_window=(0, 1),
+        )
+        context = schemas.AlgorithmContext(
+            log_odds=[
+                {"feature": "BIRTHDATE", "value": 10.1},
+                {"feature": "LAST_NAME", "value": 6.3},
+            ]
+        )
+        record = schemas.PIIRecord(
+            name=[{"given": ["Lourdes"], "family": "Rodriguez"}], birthdate="1997-12-09"
+        )
+        # a pending patient that agrees with the record, and one that doesn't
+        pending = mpi_service.insert_patient(session, record, models.Person(), defer_index=True)
+        mpi_service.insert_patient(
+            session,
+            schemas.PIIRecord(name=[{"family": "Smith"}], birthdate="1997-12-09"),
+            models.Person(),
+            defer_index=True,
+        )
+        with mock.patch.object(mpi_service.settings, "deferred_indexing", False):
+            assert mpi_service.BlockData.get(session, record, algorithm_pass, context) == []
+        with mock.patch.object(mpi_service.settings, "deferred_indexing", True):
+            matches = mpi_service.BlockData.get(session, record, algorithm_pass, context)
+            assert matches == [pending]
+            multi = mpi_service.BlockData.get_multi(session, record, [algorithm_pass], context)
+            assert multi == {"pass": [pending]}
+            assert mpi_service.BlockData.get(
+                session, record, algorithm_pass, context, max_cluster_size=3
+            ) == [pending]
+            multi = mpi_service.BlockData.get_multi(
+                session, record, [algorithm_pass], context, max_cluster_size=3
+            )
+            assert multi == {"pass": [pending]}
+            # once indexed, the patient is found through the blocking values
+            mpi_service.index_pending_patients(session, commit=False)
+            multi = mpi_service.BlockData.get_multi(session, record, [algorithm_pass], context)
+            assert multi == {"pass": [pending]}
+
+    def test_pending_in_indexed_cluster(self, session: Session):
+        algorithm_pass = schemas.AlgorithmPass(
+            label="pass",
+            evaluators=[],
+            blocking_keys=["BIRTHDATE"],
+            possible_match_window=(0, 1),
+        )
+        context = schemas.AlgorithmContext(log_odds=[{"feature": "BIRTHDATE", "value": 10.1}])
+        record = schemas.PIIRecord(birthdate="1997-12-09")
+        person = models.Person()
+        indexed = mpi_service.insert_patient(session, record, person)
+        pending = mpi_service.insert_patient(session, record, person, defer_index=True)
+        with mock.patch.object(mpi_service.settings, "deferred_indexing", True):
+            multi = mpi_service.BlockData.get_multi(session, record, [algorithm_pass], context)
+        # the cluster is only returned once, even though it was blocked twice
+        assert multi == {"pass": [indexed, pending]}
+
+    def test_pending_not_parsed(self, session: Session):
+        algorithm_pass = schemas.AlgorithmPass(
+            label="pass",
+            evaluators=[],
+            blocking_keys=["BIRTHDATE", "LAST_NAME"],
+            possible_match_window=(0, 1),
+        )
+        context = schemas.AlgorithmContext(log_odds=[{"feature": "BIRTHDATE", "value": 10.1}])
+        record = schemas.PIIRecord(name=[{"family": "Smith"}], birthdate="1997-12-09")
+        pending = mpi_service.insert_patient(session, record, models.Person(), defer_index=True)
+        other = schemas.PIIRecord(name=[{"family": "Jones"}], birthdate="1997-12-09")
+        mpi_service.insert_patient(session, other, models.Person(), defer_index=True)
+        with (
+            mock.patch.object(mpi_service.settings, "deferred_indexing", True),
+            mock.patch.object(
+                schemas.PIIRecord, "from_data", wraps=schemas.PIIRecord.from_data
+            ) as from_data,
+        ):
+            for storage in ("value", "hash"):
+                with mock.patch.object(mpi_service.settings, "blocking_storage", storage):
+                    assert mpi_service.BlockData.get(
+                        session, record, algorithm_pass, context
+                    ) == [pending]
+        # the pending Patients are matched on their hashes, not their data
+        assert from_data.call_count == 0
+        mpi_service.index_pending_patients(session, commit=False)
+        assert session.query(models.PendingBlockingHash).count() == 0
+
+    @pytest.fixture
+    def large_cluster(self, session: Session) -> list[models.Patient]:
+        person = models.Person()
+        record = schemas.PIIRecord(
+            name=[{"given": ["Lourdes"], "family": "Rodriguez"}], birthdate="1997-12-09"
+        )
+        return [mpi_service.insert_patient(session, record, person) for _ in range(5)]
+
+    def test_max_cluster_size(self, session: Session, large_cluster: list[models.Patient]):
+        algorithm_pass = schemas.AlgorithmPass(
+            label="pass",
+            evaluators=[],
+            blocking_keys=["BIRTHDATE"],
+            possible_match_window=(0, 1),
+        )
+        context = schemas.AlgorithmContext(log_odds=[{"feature": "BIRTHDATE", "value": 10.1}])
+        record = schemas.PIIRecord(birthdate="1997-12-09")
+        with mock.patch.object(mpi_service.LOGGER, "info") as log:
+            matches = mpi_service.BlockData.get(
+                session, record, algorithm_pass, context, max_cluster_size=3
+            )
+        # the most recently inserted patients are kept
+        assert sorted(p.id for p in matches) == sorted(p.id for p in large_cluster[-3:])
+        log.assert_called_once_with(
+            "truncated person cluster",
+            extra={
+                "person_id": large_cluster[0].person_id,
+                "cluster_size": 5,
+                "max_cluster_size": 3,
+                "algorithm.pass_label": "pass",
+            },
+        )
+        # clusters under the limit are not truncated
+        with mock.patch.object(mpi_service.LOGGER, "info") as log:
+            matches = mpi_service.BlockData.get(
+                session, record, algorithm_pass, context, max_cluster_size=5
+            )
+        assert len(matches) == 5
+        log.assert_not_called()
+
+    def test_max_cluster_size_keeps_matched(self, session: Session):
+        algorithm_pass = schemas.AlgorithmPass(
+            label="pass",
+            evaluators=[],
+            blocking_keys=["BIRTHDATE"],
+            possible_match_window=(0, 1),
+        )
+        context = schemas.AlgorithmContext(log_odds=[{"feature": "BIRTHDATE", "value": 10.1}])
+        record = schemas.PIIRecord(birthdate="1997-12-09")
+        person = models.Person()
+        # the only Patient matching the block is older than the cap
+        matched = mpi_service.insert_patient(session, record, person)
+        others = [
+            mpi_service.insert_patient(session, schemas.PIIRecord(birthdate="1980-01-01"), person)
+            for _ in range(4)
+        ]
+        with mock.patch.object(mpi_service.BlockData, "_filter_incorrect_match", return_value=True):
+            matches = mpi_service.BlockData.get(
+                session, record, algorithm_pass, context, max_cluster_size=3
+            )
+            multi = mpi_service.BlockData.get_multi(
+                session, record, [algorithm_pass], context, max_cluster_size=3
+            )
+        # the rest of the cap is filled with the most recent Patients
+        expected = [matched.id, others[-2].id, others[-1].id]
+        assert sorted(p.id for p in matches) == expected
+        assert sorted(p.id for p in multi["pass"]) == expected
+
+    def test_get_multi_max_cluster_size(
+        self, session: Session, large_cluster: list[models.Patient]
+    ):
+        passes = [
+            schemas.AlgorithmPass(
+                label="birthdate",
+                evaluators=[],
+                blocking_keys=["BIRTHDATE"],
+                possible_match_window=(0, 1),
+            ),
+            schemas.AlgorithmPass(
+                label="names",
+                evaluators=[],
+                blocking_keys=["FIRST_NAME", "LAST_NAME"],
+                possible_match_window=(0, 1),
+            ),
+        ]
+        context = schemas.AlgorithmContext(
+            log_odds=[
+                {"feature": "FIRST_NAME", "value": 6.8},
+                {"feature": "LAST_NAME", "value": 6.3},
+                {"feature": "BIRTHDATE", "value": 10.1},
+            ],
+        )
+        record = schemas.PIIRecord(
+            name=[{"given": ["Lourdes"], "family": "Rodriguez"}], birthdate="1997-12-09"
+        )
+        with count_queries(session) as count:
+            with mock.patch.object(mpi_service.LOGGER, "info") as log:
+                matches = mpi_service.BlockData.get_multi(
+                    session, record, passes, context, max_cluster_size=2
+                )
+            assert count() == 2
+        expected = sorted(p.id for p in large_cluster[-2:])
+        assert sorted(p.id for p in matches["birthdate"]) == expected
+        assert sorted(p.id for p in matches["names"]) == expected
+        assert [c.kwargs["extra"]["algorithm.pass_label"] for c in log.call_args_list] == [
+            "birthdate",
+            "names",
+        ]
+
+    def test_get_multi_all_skipped(self, session: Session, prime_index: None):
+        algorithm_pass = schemas.AlgorithmPass(
+            label="pass",
+            evaluators=[],
+            blocking_keys=["EMAIL"],
+            possible_match_window=(0, 1),
+        )
+        context = schemas.AlgorithmContext(log_odds=[{"feature": "EMAIL", "value": 5.0}])
+        with count_queries(session) as count:
+            matches = mpi_service.BlockData.get_multi(
+                session, schemas.PIIRecord(), [algorithm_pass], context
+            )
+            assert count() == 0
+        assert matches == {"pass": []}
+
+    def test_estimated_counts(self, session: Session, prime_index: None):
+        mpi_service.refresh_blocking_stats(session, min_count=2)
+        record = schemas.PIIRecord(birthdate="1980-01-01", email=["test@example.com"])
+        estimates = mpi_service.BlockData._estimated_counts(
+            session, record, [models.BlockingKey.BIRTHDATE, models.BlockingKey.EMAIL]
+        )
+        assert estimates.counts == {
+            models.BlockingKey.BIRTHDATE: 4,
+            models.BlockingKey.EMAIL: 0,
+        }
+        assert estimates.stop_values == set()
+
+    def test_ordered_by_estimates(self):
+        algorithm_pass = schemas.AlgorithmPass(
+            label="pass",
+            evaluators=[],
+            blocking_keys=["BIRTHDATE", "FIRST_NAME"],
+            possible_match_window=(0, 1),
+        )
+        context = schemas.AlgorithmContext(
+            log_odds=[
+                {"feature": "FIRST_NAME", "value": 6.8},
+                {"feature": "BIRTHDATE", "value": 10.1},
+            ],
+        )
+        record = schemas.PIIRecord(
+            name=[{"given": ["John"], "family": "Smith"}], birthdate="1980-01-01"
+        )
+        _, values = mpi_service.BlockData._blocking_query(record, algorithm_pass, context)
+        assert list(values) == [models.BlockingKey.BIRTHDATE, models.BlockingKey.FIRST_NAME]
+        estimates = mpi_service.BlockingEstimates(
+            counts={models.BlockingKey.BIRTHDATE: 100, models.BlockingKey.FIRST_NAME: 1},
+            stop_values=set(),
+        )
+        with mock.patch.object(mpi_service.settings, "blocking_stats", True):
+            _, values = mpi_service.BlockData._blocking_query(
+                record, algorithm_pass, context, estimates
+            )
+        assert list(values) == [models.BlockingKey.FIRST_NAME, models.BlockingKey.BIRTHDATE]
+        # the estimates are also used for MAX_BLOCKING_CANDIDATES and stop values,
+        # but the keys are only reordered with BLOCKING_STATS
+        with mock.patch.object(mpi_service.settings, "blocking_stats", False):
+            _, values = mpi_service.BlockData._blocking_query(
+                record, algorithm_pass, context, estimates
+            )
+        assert list(values) == [models.BlockingKey.BIRTHDATE, models.BlockingKey.FIRST_NAME]
+
+    def test_max_candidates(self, session: Session, prime_index: None):
+        mpi_service.refresh_blocking_stats(session, min_count=1)
+        algorithm_pass = schemas.AlgorithmPass(
+            label="pass",
+            evaluators=[],
+            blocking_keys=["BIRTHDATE", "FIRST_NAME"],
+            possible_match_window=(0, 1),
+        )
+        context = schemas.AlgorithmContext(
+            log_odds=[
+                {"feature": "FIRST_NAME", "value": 6.8},
+                {"feature": "BIRTHDATE", "value": 10.1},
+            ],
+        )
+        # the birthdate and first name are each shared by 4 patients
+        record = schemas.PIIRecord(
+            name=[{"given": ["John"], "family": "Smith"}], birthdate="1980-01-01"
+        )
+        assert mpi_service.BlockData.get(
+            session, record, algorithm_pass, context, max_candidates=3
+        ) == []
+        matches = mpi_service.BlockData.get(
+            session, record, algorithm_pass, context, max_candidates=4
+        )
+        assert len(matches) == 3
+        multi = mpi_service.BlockData.get_multi(
+            session, record, [algorithm_pass], context, max_candidates=3
+        )
+        assert multi == {"pass": []}
+
+    def test_get_profile(self, session: Session, prime_index: None):
+        algorithm_pass = schemas.AlgorithmPass(
+            label="pass",
+            evaluators=[],
+            blocking_keys=["BIRTHDATE", "FIRST_NAME", "ZIP"],
+            possible_match_window=(0, 1),
+        )
+        context = schemas.AlgorithmContext(
+            log_odds=[
+                {"feature": "BIRTHDATE", "value": 10.1},
+                {"feature": "FIRST_NAME", "value": 6.8},
+                {"feature": "ZIP", "value": 1.0},
+            ],
+        )
+        # the cluster of 3 patients is hydrated, and the one that disagrees is filtered
+        record = schemas.PIIRecord(
+            name=[{"given": ["Ferris"], "family": "Bueller"}], birthdate="1974-11-07"
+        )
+        profile = schemas.PassProfile(label="pass")
+        matches = mpi_service.BlockData.get(
+            session, record, algorithm_pass, context, profile=profile
+        )
+        assert len(matches) == 2
+        assert profile.blocking_keys == ["BIRTHDATE", "FIRST_NAME"]
+        assert profile.skipped_keys == {"ZIP": "missing"}
+        assert profile.skipped is None
+        assert profile.sql_seconds > 0
+        assert (profile.persons, profile.patients, profile.filtered) == (1, 3, 1)
+
+    def test_get_profile_skipped(self, session: Session, prime_index: None):
+        mpi_service.refresh_blocking_stats(session, min_count=1)
+        algorithm_pass = schemas.AlgorithmPass(
+            label="pass",
+            evaluators=[],
+            blocking_keys=["BIRTHDATE", "FIRST_NAME"],
+            possible_match_window=(0, 1),
+        )
+        context = schemas.AlgorithmContext(
+            log_odds=[
+                {"feature": "FIRST_NAME", "value": 6.8},
+                {"feature": "BIRTHDATE", "value": 10.1},
+            ],
+        )
+        record = schemas.PIIRecord(
+            name=[{"given": ["John"], "family": "Smith"}], birthdate="1980-01-01"
+        )
+        profile = schemas.PassProfile(label="pass")
+        mpi_service.BlockData.get(
+            session, record, algorithm_pass, context, max_candidates=3, profile=profile
+        )
+        assert profile.skipped == "too many candidates"
+        assert profile.estimated_candidates == 4
+        assert profile.patients == 0
+        profile = schemas.PassProfile(label="pass")
+        mpi_service.BlockData.get(
+            session, schemas.PIIRecord(), algorithm_pass, context, profile=profile
+        )
+        assert profile.skipped == "missing blocking values"
+        assert profile.skipped_keys == {"BIRTHDATE": "missing"}
+
+    def test_get_async(self, session: Session, prime_index: None, async_session_maker):
+        data = {
+            "name": [{"given": ["Johnathon", "Bill"], "family": "Smith"}],
+            "birthdate": "01/01/1980",
+        }
+        algorithm_pass = schemas.AlgorithmPass(
+            label="birthdate",
+            evaluators=[],
+            blocking_keys=["BIRTHDATE"],
+            possible_match_window=(0, 1),
+        )
+        context = schemas.AlgorithmContext(log_odds=[{"feature": "BIRTHDATE", "value": 10.1}])
+        record = schemas.PIIRecord(**data)
+        session.commit()
+
+        async def get():
+            async with async_session_maker() as async_session:
+                return await mpi_service.BlockData.get_async(
+                    async_session, record, algorithm_pass, context
+                )
+
+        matches = asyncio.run(get())
+        expected = mpi_service.BlockData.get(session, record, algorithm_pass, context)
+        assert sorted(p.id for p in matches) == sorted(p.id for p in expected)
+        # the Persons were eagerly loaded, so they are available outside the session
+        assert sorted(p.person.id for p in matches) == sorted(p.person_id for p in expected)
+
+    def test_get_multi_async(self, session: Session, prime_index: None, async_session_maker):
+        data = {
+            "name": [{"given": ["Johnathon", "Bill"], "family": "Smith"}],
+            "birthdate": "01/01/1980",
+        }
+        passes = [
+            schemas.AlgorithmPass(
+                label="birthdate",
+                evaluators=[],
+                blocking_keys=["BIRTHDATE"],
+                possible_match_window=(0, 1),
+            ),
+            schemas.AlgorithmPass(
+                label="names",
+                evaluators=[],
+                blocking_keys=["BIRTHDATE", "FIRST_NAME", "LAST_NAME"],
+                possible_match_window=(0, 1),
+            ),
+        ]
+        context = schemas.AlgorithmContext(
+            log_odds=[
+                {"feature": "FIRST_NAME", "value": 6.8},
+                {"feature": "LAST_NAME", "value": 6.3},
+                {"feature": "BIRTHDATE", "value": 10.1},
+            ],
+        )
+        record = schemas.PIIRecord(**data)
+        session.commit()
+
+        async def get_multi():
+            async with async_session_maker() as async_session:
+                return await mpi_service.BlockData.get_multi_async(
+                    async_session, record, passes, context
+                )
+
+        matches = asyncio.run(get_multi())
+        expected = mpi_service.BlockData.get_multi(session, record, passes, context)
+        for label, patients in expected.items():
+            assert sorted(p.id for p in matches[label]) == sorted(p.id for p in patients)
+            assert {p.person.id for p in matches[label]} == {p.person_id for p in patients}
+
+
+class TestBlockDataHashStorage(TestBlockData):
+    """
+    Run all the BlockData tests again, with the blocking values stored as hashes.
+    """
+
+    @pytest.fixture(autouse=True)
+    def hash_storage(self):
+        with mock.patch.object(mpi_service.settings, "blocking_storage", "hash"):
+            yield
+
+    def test_stored_as_hashes(self, session: Session, prime_index: None):
+        assert session.query(models.BlockingValue).count() == 0
+        hashes = session.query(models.BlockingHash).all()
+        assert len(hashes) > 0
+        assert {h.hash >> models.BLOCKING_HASH_VALUE_BITS for h in hashes} <= {
+            k.id for k in models.BlockingKey
+        }
+
+
+class TestBlockDataBlockingIndex(TestBlockData):
+    """
+    Run all the BlockData tests again, with the blocking step answered by the
+    in-memory blocking index.
+    """
+
+    @pytest.fixture(autouse=True)
+    def index(self, session: Session):
+        with (
+            mock.patch.object(mpi_service.settings, "blocking_index", True),
+            mock.patch.object(mpi_service.settings, "blocking_index_snapshot", None),
+            mock.patch.object(mpi_service.settings, "blocking_index_refresh_interval", 60),
+        ):
+            blocking_index.reset_index()
+            # load the index before the tests insert patients, which update it in place
+            yield blocking_index.get_index(session)
+            blocking_index.reset_index()
+
+    def test_uses_index(self, session: Session, prime_index: None, index):
+        assert len(index) > 0
+        algorithm_pass = schemas.AlgorithmPass(
+            label="pass",
+            evaluators=[],
+            blocking_keys=["BIRTHDATE"],
+            possible_match_window=(0, 1),
+        )
+        context = schemas.AlgorithmContext(log_odds=[{"feature": "BIRTHDATE", "value": 10.1}])
+        record = schemas.PIIRecord(birthdate="1980-01-01")
+        base, _ = mpi_service.BlockData._blocking_query(
+            record, algorithm_pass, context, index=index
+        )
+        assert "mpi_blocking_value" not in str(base)
+        assert len(mpi_service.BlockData.get(session, record, algorithm_pass, context)) == 4
+
 
 class TestGetPatientsByReferenceIds:
     def test_invalid_reference_id(self, session: Session):
@@ -1041,7 +1955,9 @@ class TestResetMPI:
         assert session.query(models.Patient).count() == 1
         assert session.query(models.Person).count() == 1
         assert session.query(models.BlockingValue).count() == 3
+        mpi_service.refresh_blocking_stats(session, min_count=1)
         mpi_service.reset_mpi(session)
+        assert session.query(models.BlockingStat).count() == 0
         assert session.query(models.Patient).count() == 0
         assert session.query(models.Person).count() == 0
         assert session.query(models.BlockingValue).count() == 0
@@ -0,0 +1,75 @@
+"""
+unit.linking.test_compute.py
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+This module contains the unit tests for the recordlinker.linking.compute module.
+"""
+
+import threading
+from unittest import mock
+
+import pytest
+
+from recordlinker.linking import compute
+
+
+class TestComputeExecutor:
+    def test_submit(self):
+        executor = compute.ComputeExecutor("thread", 2, 0)
+        try:
+            assert executor.submit(sum, [1, 2, 3]).result() == 6
+        finally:
+            executor.shutdown()
+
+    def test_process(self):
+        executor = compute.ComputeExecutor("process", 1, 0)
+        try:
+            assert executor.submit(sum, [1, 2, 3]).result() == 6
+        finally:
+            executor.shutdown()
+
+    def test_queue_full(self):
+        executor = compute.ComputeExecutor("thread", 1, 1)
+        event = threading.Event()
+        try:
+            running = executor.submit(event.wait)
+            queued = executor.submit(event.wait)
+            with pytest.raises(compute.QueueFullError):
+                executor.submit(event.wait)
+            event.set()
+            assert running.result() and queued.result()
+            # the slots are released once the jobs are done
+            assert executor.submit(sum, [1]).result() == 1
+        finally:
+            event.set()
+            executor.shutdown()
+
+    def test_submit_error(self):
+        executor = compute.ComputeExecutor("thread", 1, 0)
+        executor.shutdown()
+        with pytest.raises(RuntimeError):
+            executor.submit(sum, [1])
+        # the slot is released when the submit fails
+        assert executor._slots.acquire(blocking=False)
+
+
+class TestGetExecutor:
+    def test_none(self):
+        with mock.patch("recordlinker.linking.compute.settings.compute_executor", "none"):
+            assert compute.get_executor() is None
+
+    def test_thread(self):
+        with (
+            mock.patch("recordlinker.linking.compute.settings.compute_executor", "thread"),
+            mock.patch("recordlinker.linking.compute.settings.compute_pool_size", 2),
+            mock.patch("recordlinker.linking.compute.settings.compute_queue_depth", 3),
+        ):
+            try:
+                executor = compute.get_executor()
+                assert executor.kind == "thread"
+                assert executor.pool_size == 2
+                assert executor.queue_depth == 3
+                assert compute.get_executor() is executor
+            finally:
+                compute.shutdown_executor()
+        assert compute._EXECUTOR is None
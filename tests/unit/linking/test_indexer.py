@@ -0,0 +1,77 @@
+"""
+unit.linking.test_indexer.py
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+This module contains the unit tests for the recordlinker.linking.indexer module.
+"""
+
+from unittest import mock
+
+import pytest
+from sqlalchemy import orm
+
+from recordlinker import models
+from recordlinker import schemas
+from recordlinker.database import mpi_service
+from recordlinker.linking import indexer
+
+
+@pytest.fixture
+def session_maker(session):
+    return orm.sessionmaker(bind=session.get_bind())
+
+
+@pytest.fixture
+def pending(session):
+    record = schemas.PIIRecord(birthdate="1980-01-01", sex="F")
+    patients = [mpi_service.insert_patient(session, record, defer_index=True) for _ in range(3)]
+    return [p.id for p in patients]
+
+
+class TestBlockingIndexer:
+    def test_flush(self, session, session_maker, pending):
+        worker = indexer.BlockingIndexer(session_maker, batch_size=2, interval=60)
+        assert worker.flush() == 3
+        assert worker.flush() == 0
+        assert session.query(models.BlockingValue).count() == 6
+        assert session.query(models.Patient).filter(models.Patient.pending_index).count() == 0
+
+    def test_stop(self, session, session_maker, pending):
+        worker = indexer.BlockingIndexer(session_maker, batch_size=2, interval=60)
+        worker.start()
+        # the pending patients are indexed before the worker stops
+        worker.stop()
+        assert not worker.is_alive()
+        assert session.query(models.BlockingValue).count() == 6
+
+    def test_error(self, session_maker):
+        worker = indexer.BlockingIndexer(session_maker, batch_size=2, interval=60)
+        with (
+            mock.patch.object(worker, "flush", side_effect=RuntimeError),
+            mock.patch.object(indexer.LOGGER, "exception") as log,
+        ):
+            worker.start()
+            worker.stop()
+        log.assert_called_once_with("error indexing pending patients")
+
+
+class TestGetIndexer:
+    def test_disabled(self):
+        with mock.patch.object(indexer.settings, "deferred_indexing", False):
+            assert indexer.get_indexer() is None
+
+    def test_enabled(self, session_maker):
+        with (
+            mock.patch.object(indexer.settings, "deferred_indexing", True),
+            mock.patch.object(indexer.settings, "deferred_index_batch_size", 10),
+            mock.patch.object(indexer.database, "SessionMaker", session_maker),
+        ):
+            try:
+                worker = indexer.get_indexer()
+                assert worker.is_alive()
+                assert worker.batch_size == 10
+                assert indexer.get_indexer() is worker
+            finally:
+                indexer.stop_indexer()
+        assert indexer._INDEXER is None
+        assert not worker.is_alive()
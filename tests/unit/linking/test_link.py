@@ -5,16 +5,23 @@ unit.linking.test_link.py
 This module contains the unit tests for the recordlinker.linking.link module.
 """
 
+import asyncio
 import collections
 import copy
+import threading
 import uuid
+from unittest import mock
 
 import pytest
 from conftest import load_test_json_asset
 
+from recordlinker import models
 from recordlinker import schemas
 from recordlinker.hl7 import fhir
+from recordlinker.linking import compute
+from recordlinker.linking import indexer
 from recordlinker.linking import link
+from recordlinker.linking import plan
 
 
 class TestInvokeEvaluator:
@@ -242,6 +249,98 @@ class TestCompare:
         assert feature_scores == {"IDENTIFIER:SS": 0.0}
 
 
+class TestCompareBatch:
+    def test_identical_to_compare(self, default_algorithm):
+        bundle = load_test_json_asset("simple_patient_bundle_to_link_with_mpi.json")
+        records: list[schemas.PIIRecord] = [
+            fhir.fhir_record_to_pii_record(e["resource"])
+            for e in bundle["entry"]
+            if e.get("resource", {}).get("resourceType") == "Patient"
+        ]
+        context = default_algorithm.algorithm_context
+        for algorithm_pass in default_algorithm.passes:
+            for record in records:
+                expected = [link.compare(record, r, algorithm_pass, context) for r in records]
+                results = link.compare_batch(record, records, algorithm_pass, context)
+                assert results == expected
+
+    def test_empty(self, default_algorithm):
+        algorithm_pass = default_algorithm.passes[0]
+        context = default_algorithm.algorithm_context
+        assert link.compare_batch(schemas.PIIRecord(), [], algorithm_pass, context) == []
+
+
+class TestCompareCompiled:
+    def test_logging(self, default_algorithm):
+        compiled_pass = plan.compile_pass(
+            default_algorithm.passes[0], default_algorithm.algorithm_context
+        )
+        record = schemas.PIIRecord(name=[{"given": ["Alejandro"], "family": "Gutierrez"}])
+        other = schemas.PIIRecord(name=[{"given": ["Alejandro"], "family": "Quinn"}])
+        with (
+            mock.patch.object(link.LOGGER, "isEnabledFor", return_value=True),
+            mock.patch.object(link.LOGGER, "info") as info,
+        ):
+            logged = link.compare_compiled(record, [record, other], compiled_pass)
+        assert info.call_count == 2
+        assert info.call_args.kwargs["extra"]["rule.probabilistic_sum.results"] == logged[1][0]
+        # the details aren't built when the comparisons won't be logged
+        with (
+            mock.patch.object(link.LOGGER, "isEnabledFor", return_value=False),
+            mock.patch.object(link.LOGGER, "info") as info,
+        ):
+            results = link.compare_compiled(record, [record, other], compiled_pass)
+        info.assert_not_called()
+        assert results == logged
+
+
+class TestCompareCluster:
+    @pytest.fixture
+    def compiled_pass(self, default_algorithm):
+        # BLOCK_birthdate_identifier_sex_MATCH_first_name_last_name
+        return plan.compile_pass(default_algorithm.passes[0], default_algorithm.algorithm_context)
+
+    def record(self, given: list[str], family: str) -> schemas.PIIRecord:
+        return schemas.PIIRecord(name=[{"given": given, "family": family}])
+
+    def test_single_record(self, compiled_pass):
+        record = self.record(["Alejandro"], "Gutierrez")
+        results = link.compare_cluster(record, [record], compiled_pass)
+        assert results == link.compare_compiled(record, [record], compiled_pass)
+
+    def test_median_fixed(self, compiled_pass):
+        record = self.record(["Alejandro"], "Gutierrez")
+        cluster = [self.record(["Alejandro"], "Gutierrez") for _ in range(5)]
+        with mock.patch.object(link, "compare_compiled", wraps=link.compare_compiled) as spy:
+            results = link.compare_cluster(record, cluster, compiled_pass)
+        # only a majority of the cluster needs to be compared
+        assert spy.call_count == 1
+        assert len(results) == 3
+        assert results == link.compare_compiled(record, cluster[:3], compiled_pass)
+
+    def test_cannot_match(self, compiled_pass):
+        record = self.record(["Alejandro"], "Gutierrez")
+        cluster = [
+            self.record(["Zed"], "Quinn"),
+            self.record(["Yolanda"], "Park"),
+            self.record([], "Xu"),
+            self.record(["Alejandro"], "Gutierrez"),
+            self.record(["Alejandro"], "Gutierrez"),
+        ]
+        assert link.compare_cluster(record, cluster, compiled_pass) is None
+
+    def test_compare_all(self, compiled_pass):
+        record = self.record(["Alejandro"], "Gutierrez")
+        cluster = [
+            self.record(["Alejandro"], "Gutierrez"),
+            self.record(["Alejandro"], "Gutierez"),
+            self.record(["Alejandro"], "Quinn"),
+            self.record(["Alejandro"], "Gutierrez"),
+        ]
+        results = link.compare_cluster(record, cluster, compiled_pass)
+        assert results == link.compare_compiled(record, cluster, compiled_pass)
+
+
 class TestLinkRecordAgainstMpi:
     # TODO: Add test case for last name O'Neil
     @pytest.fixture
@@ -668,10 +767,11 @@ class TestLinkRecordAgainstMpi:
     ):
         match_grades: dict[str, dict] = collections.defaultdict(dict)
         # Can just set the threshold for certainty higher to catch a possible match
-        default_algorithm.passes[0].possible_match_window = (0.7, 0.95)
+        algorithm = copy.deepcopy(default_algorithm)
+        algorithm.passes[0].possible_match_window = (0.7, 0.95)
         for i, data in enumerate(possible_match_default_patients):
             (patient, person, results, match_grade) = link.link_record_against_mpi(
-                data, session, default_algorithm
+                data, session, algorithm
             )
             match_grades[i] = {
                 "patient": patient,
@@ -686,13 +786,119 @@ class TestLinkRecordAgainstMpi:
         assert match_grades[1]["match_grade"] == "certain"
         assert match_grades[2]["match_grade"] == "possible"
         assert match_grades[2]["results"][0].person == match_grades[0]["person"]
-        assert (
-            match_grades[2]["results"][0].rms
-            >= default_algorithm.passes[0].possible_match_window[0]
-        )
-        assert (
-            match_grades[2]["results"][0].rms < default_algorithm.passes[0].possible_match_window[1]
-        )
+        assert match_grades[2]["results"][0].rms >= algorithm.passes[0].possible_match_window[0]
+        assert match_grades[2]["results"][0].rms < algorithm.passes[0].possible_match_window[1]
+
+    def test_early_termination(self, session, default_algorithm, patients):
+        algorithm = copy.deepcopy(default_algorithm)
+        algorithm.algorithm_context.early_termination = True
+        matches: list[bool] = []
+        mapped_patients: dict[str, int] = collections.defaultdict(int)
+        all_results = []
+        for data in patients:
+            (_, person, results, _) = link.link_record_against_mpi(data, session, algorithm)
+            matches.append(bool(person and results))
+            all_results.append(results)
+            mapped_patients[person.reference_id] += 1
+
+        # The results are the same as test_default_match_two
+        assert matches == [False, True, False, True, False, False]
+        assert sorted(list(mapped_patients.values())) == [1, 1, 1, 3]
+        assert round(all_results[1][0].median_features["FIRST_NAME"], 3) == 6.393
+        assert round(all_results[1][0].median_features["LAST_NAME"], 3) == 6.351
+        assert round(all_results[3][0].median_features["ADDRESS"], 3) == 8.438
+        assert round(all_results[3][0].median_features["BIRTHDATE"], 3) == 10.127
+
+    def test_early_termination_skips_passes(
+        self, session, default_algorithm, patients: list[schemas.PIIRecord]
+    ):
+        algorithm = copy.deepcopy(default_algorithm)
+        algorithm.algorithm_context.early_termination = True
+        algorithm.algorithm_context.include_multiple_matches = False
+        first_pass = algorithm.passes[0].label
+        link.link_record_against_mpi(patients[0], session, algorithm)
+        with mock.patch.object(link, "compare_cluster", wraps=link.compare_cluster) as spy:
+            (_, _, results, grade) = link.link_record_against_mpi(
+                copy.deepcopy(patients[0]), session, algorithm
+            )
+        assert grade == "certain"
+        assert results[0].pass_label == first_pass
+        # the certain match was found in the first pass, so the second was skipped
+        assert spy.call_count == 1
+        assert spy.call_args[0][2].label == first_pass
+
+    @pytest.mark.parametrize("kind", ["thread", "process"])
+    def test_compute_executor(self, session, default_algorithm, patients, kind):
+        executor = compute.ComputeExecutor(kind, 1, 0)
+        grades: list[schemas.MatchGrade] = []
+        persons: list[uuid.UUID] = []
+        try:
+            with mock.patch.object(compute, "get_executor", return_value=executor):
+                for data in patients:
+                    (_, person, _, grade) = link.link_record_against_mpi(
+                        data, session, default_algorithm
+                    )
+                    grades.append(grade)
+                    persons.append(person.reference_id)
+        finally:
+            executor.shutdown()
+        # The results are the same as test_default_match_two
+        assert grades == [
+            "certainly-not",
+            "certain",
+            "certainly-not",
+            "certain",
+            "certainly-not",
+            "certainly-not",
+        ]
+        assert persons[1] == persons[0]
+        assert persons[3] == persons[0]
+
+    def test_deferred_indexing(self, session, default_algorithm, patients):
+        grades: list[schemas.MatchGrade] = []
+        persons: list[uuid.UUID] = []
+        with (
+            mock.patch.object(link.settings, "deferred_indexing", True),
+            mock.patch.object(indexer, "get_indexer") as get_indexer,
+        ):
+            for data in patients:
+                (patient, person, _, grade) = link.link_record_against_mpi(
+                    data, session, default_algorithm
+                )
+                assert patient.pending_index is True
+                grades.append(grade)
+                persons.append(person.reference_id)
+        assert get_indexer.call_count == len(patients)
+        assert session.query(models.BlockingValue).count() == 0
+        # The results are the same as test_default_match_two, the pending Patients
+        # are found without their blocking values
+        assert grades == [
+            "certainly-not",
+            "certain",
+            "certainly-not",
+            "certain",
+            "certainly-not",
+            "certainly-not",
+        ]
+        assert persons[1] == persons[0]
+        assert persons[3] == persons[0]
+
+    def test_compute_queue_full(self, session, default_algorithm, patients):
+        executor = mock.Mock(submit=mock.Mock(side_effect=compute.QueueFullError))
+        with mock.patch.object(compute, "get_executor", return_value=executor):
+            with pytest.raises(compute.QueueFullError):
+                link.link_record_against_mpi(patients[0], session, default_algorithm)
+        assert session.query(models.Patient).count() == 0
+
+    def test_max_cluster_size(self, session, default_algorithm, patients):
+        with mock.patch.object(link.settings, "max_cluster_size", 2):
+            with mock.patch.object(
+                link.mpi_service.BlockData,
+                "get_multi",
+                return_value=collections.defaultdict(list),
+            ) as get_multi:
+                link.link_record_against_mpi(patients[0], session, default_algorithm, persist=False)
+        assert get_multi.call_args.kwargs["max_cluster_size"] == 2
 
     def test_include_multiple_matches_true(
         self, session, default_algorithm, multiple_matches_patients: list[schemas.PIIRecord]
@@ -730,10 +936,11 @@ class TestLinkRecordAgainstMpi:
         self, session, default_algorithm, multiple_matches_patients: list[schemas.PIIRecord]
     ):
         match_grades: dict[str, dict] = collections.defaultdict(dict)
-        default_algorithm.algorithm_context.include_multiple_matches = False
+        algorithm = copy.deepcopy(default_algorithm)
+        algorithm.algorithm_context.include_multiple_matches = False
         for i, data in enumerate(multiple_matches_patients):
             (patient, person, results, match_grade) = link.link_record_against_mpi(
-                data, session, default_algorithm
+                data, session, algorithm
             )
             match_grades[i] = {
                 "patient": patient,
@@ -777,3 +984,212 @@ class TestLinkRecordAgainstMpi:
         assert pat3 is None
         assert per3 is None
         assert not results
+
+
+class TestLinkRecordAgainstMpiAsync:
+    @pytest.fixture
+    def patients(self):
+        bundle = load_test_json_asset("simple_patient_bundle_to_link_with_mpi.json")
+        patients: list[schemas.PIIRecord] = []
+        for entry in bundle["entry"]:
+            if entry.get("resource", {}).get("resourceType", {}) == "Patient":
+                patients.append(fhir.fhir_record_to_pii_record(entry["resource"]))
+        return patients
+
+    def test_link(self, session, default_algorithm, patients, async_session_maker):
+        async def link_all():
+            linked = []
+            async with async_session_maker() as async_session:
+                for record in patients:
+                    linked.append(
+                        await link.link_record_against_mpi_async(
+                            record, async_session, default_algorithm
+                        )
+                    )
+                    await async_session.commit()
+            return linked
+
+        linked = asyncio.run(link_all())
+        assert [grade for _, _, _, grade in linked] == [
+            "certainly-not",
+            "certain",
+            "certainly-not",
+            "certain",
+            "certainly-not",
+            "certainly-not",
+        ]
+        persons = [person.reference_id for _, person, _, _ in linked]
+        assert persons[1] == persons[0]
+        assert persons[3] == persons[0]
+        assert session.query(models.Patient).count() == len(patients)
+
+    def test_no_persist(self, session, default_algorithm, patients, async_session_maker):
+        link.link_record_against_mpi(patients[0], session, default_algorithm)
+        session.commit()
+
+        async def match():
+            async with async_session_maker() as async_session:
+                return await link.link_record_against_mpi_async(
+                    patients[1], async_session, default_algorithm, persist=False
+                )
+
+        patient, person, results, grade = asyncio.run(match())
+        assert patient is None
+        assert grade == "certain"
+        assert person.reference_id == session.query(models.Person).one().reference_id
+        assert session.query(models.Patient).count() == 1
+
+    def test_scores_off_event_loop(self, default_algorithm, patients, async_session_maker):
+        threads = []
+        original = link.score_clusters
+
+        def score_clusters(*args):
+            threads.append(threading.get_ident())
+            return original(*args)
+
+        async def match():
+            async with async_session_maker() as async_session:
+                return await link.link_record_against_mpi_async(
+                    patients[0], async_session, default_algorithm, persist=False
+                )
+
+        with mock.patch.object(link, "score_clusters", side_effect=score_clusters):
+            asyncio.run(match())
+        assert threads and threading.get_ident() not in threads
+
+
+class TestExplainRecordAgainstMpi:
+    @pytest.fixture
+    def patients(self):
+        bundle = load_test_json_asset("simple_patient_bundle_to_link_with_mpi.json")
+        patients: list[schemas.PIIRecord] = []
+        for entry in bundle["entry"]:
+            if entry.get("resource", {}).get("resourceType", {}) == "Patient":
+                patients.append(fhir.fhir_record_to_pii_record(entry["resource"]))
+        return patients
+
+    def test_same_as_match(self, session, default_algorithm, patients):
+        for data in patients[:3]:
+            link.link_record_against_mpi(data, session, default_algorithm)
+        (_, person, results, grade) = link.link_record_against_mpi(
+            patients[3], session, default_algorithm, persist=False
+        )
+        (explained, explained_results, explained_grade, profile) = (
+            link.explain_record_against_mpi(patients[3], session, default_algorithm)
+        )
+        assert explained_grade == grade
+        assert explained is person
+        assert [r.rms for r in explained_results] == [r.rms for r in results]
+        assert session.query(models.Patient).count() == 3
+        assert [p.label for p in profile.passes] == [p.label for p in default_algorithm.passes]
+        for pass_profile, algorithm_pass in zip(profile.passes, default_algorithm.passes):
+            assert sorted(pass_profile.blocking_keys) == sorted(
+                str(k) for k in algorithm_pass.blocking_keys
+            )
+            assert pass_profile.sql_seconds > 0
+            assert pass_profile.blocking_seconds >= pass_profile.sql_seconds
+            assert pass_profile.patients >= pass_profile.patients_compared
+            assert sorted(pass_profile.feature_seconds) == sorted(
+                str(e.feature) for e in algorithm_pass.evaluators
+            )
+        assert sum(p.patients_compared for p in profile.passes) > 0
+        assert profile.total_seconds > 0
+
+    def test_no_candidates(self, session, default_algorithm, patients):
+        (person, results, grade, profile) = link.explain_record_against_mpi(
+            patients[0], session, default_algorithm
+        )
+        assert (person, results, grade) == (None, [], "certainly-not")
+        for pass_profile in profile.passes:
+            assert pass_profile.patients == 0
+            assert pass_profile.persons_compared == 0
+
+    def test_early_termination(self, session, default_algorithm, patients):
+        algorithm = copy.deepcopy(default_algorithm)
+        algorithm.algorithm_context.early_termination = True
+        algorithm.algorithm_context.include_multiple_matches = False
+        link.link_record_against_mpi(patients[0], session, algorithm)
+        (_, _, grade, profile) = link.explain_record_against_mpi(
+            copy.deepcopy(patients[0]), session, algorithm
+        )
+        assert grade == "certain"
+        first, second = profile.passes
+        assert first.persons_compared == 1
+        assert first.skipped is None
+        assert second.skipped == "certain match in an earlier pass"
+        assert second.persons_compared == 0
+
+
+class TestLinkRecordsAgainstMpi:
+    @pytest.fixture
+    def patients(self):
+        bundle = load_test_json_asset("simple_patient_bundle_to_link_with_mpi.json")
+        patients: list[schemas.PIIRecord] = []
+        for entry in bundle["entry"]:
+            if entry.get("resource", {}).get("resourceType", {}) == "Patient":
+                patients.append(fhir.fhir_record_to_pii_record(entry["resource"]))
+        return patients
+
+    def test_mismatched_external_person_ids(self, session, default_algorithm, patients):
+        with pytest.raises(ValueError):
+            link.link_records_against_mpi(
+                patients[:2], session, default_algorithm, external_person_ids=["1"]
+            )
+
+    def test_in_batch_ordering(self, session, default_algorithm, patients):
+        results = link.link_records_against_mpi(patients[:4], session, default_algorithm)
+        assert [r[3] for r in results] == ["certainly-not", "certain", "certainly-not", "certain"]
+        # The second and fourth records link to the Person created by the first
+        assert results[1][1].reference_id == results[0][1].reference_id
+        assert results[3][1].reference_id == results[0][1].reference_id
+        assert results[2][1].reference_id != results[0][1].reference_id
+
+    def test_matches_sequential_linking(self, session, default_algorithm, patients):
+        batch = link.link_records_against_mpi(
+            patients, session, default_algorithm, persist=False
+        )
+        for record, (_, person, results, grade) in zip(patients, batch):
+            (_, exp_person, exp_results, exp_grade) = link.link_record_against_mpi(
+                record, session, default_algorithm, persist=False
+            )
+            assert grade == exp_grade
+            assert (person and person.reference_id) == (exp_person and exp_person.reference_id)
+            assert len(results) == len(exp_results)
+
+
+class TestPatientRecordCache:
+    def test_get(self):
+        skip_values = [schemas.algorithm.SkipValue(feature="FIRST_NAME", values=["Unknown"])]
+        cache = link.PatientRecordCache(skip_values)
+        patient = models.Patient(
+            id=1, data={"name": [{"given": ["Unknown"], "family": "Doe"}]}
+        )
+        record = cache.get(patient)
+        assert record.name[0].given == [""]
+        assert record.name[0].family == "Doe"
+        assert len(cache) == 1
+        # the same record is returned without hydrating the patient again
+        with mock.patch.object(schemas.PIIRecord, "from_patient") as from_patient:
+            assert cache.get(patient) is record
+            from_patient.assert_not_called()
+
+    def test_shared_across_passes(self, session, default_algorithm):
+        record = schemas.PIIRecord(
+            name=[{"given": ["Johnny"], "family": "Smithson"}],
+            birth_date="1980-01-01",
+            address=[{"line": ["123 Main St"], "postal_code": "12345"}],
+            sex="M",
+        )
+        link.link_record_against_mpi(record, session, default_algorithm)
+        link.link_record_against_mpi(record, session, default_algorithm)
+        cache = link.PatientRecordCache(default_algorithm.algorithm_context.skip_values)
+        with mock.patch.object(
+            schemas.PIIRecord, "from_patient", wraps=schemas.PIIRecord.from_patient
+        ) as from_patient:
+            (_, _, results, grade) = link.link_record_against_mpi(
+                record, session, default_algorithm, persist=False, cache=cache
+            )
+        assert grade == "certain"
+        # both candidates are blocked in both passes, but only hydrated once each
+        assert from_patient.call_count == 2
+        assert len(cache) == 2
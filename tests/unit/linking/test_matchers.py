@@ -37,6 +37,16 @@ class TestFeatureFunc:
             == matchers.compare_probabilistic_fuzzy_match
         )
 
+    def test_batch_callable(self):
+        assert (
+            matchers.FeatureFunc["COMPARE_PROBABILISTIC_EXACT_MATCH"].batch_callable()
+            == matchers.batch_compare_probabilistic_exact_match
+        )
+        assert (
+            matchers.FeatureFunc["COMPARE_PROBABILISTIC_FUZZY_MATCH"].batch_callable()
+            == matchers.batch_compare_probabilistic_fuzzy_match
+        )
+
     def test_str(self):
         assert (
             str(matchers.FeatureFunc["COMPARE_PROBABILISTIC_EXACT_MATCH"])
@@ -286,3 +296,86 @@ def test_compare_probabilistic_fuzzy_match():
         fuzzy_match_threshold=0.7,
     )
     assert round(result[0], 3) == 0.0
+
+
+class TestBatchCompare:
+    RECORD = schemas.PIIRecord(
+        name=[{"given": ["John"], "family": "Smith"}, {"given": ["Johnny"], "family": "Smyth"}],
+        birth_date="1980-01-01",
+        sex="M",
+    )
+    MPI_RECORDS = [
+        schemas.PIIRecord(name=[{"given": ["Jon"], "family": "Smith"}], sex="M"),
+        schemas.PIIRecord(name=[{"given": ["Jonathan"], "family": "Smithe"}], sex="F"),
+        schemas.PIIRecord(birth_date="1980-01-01"),
+        schemas.PIIRecord(name=[{"given": ["John"], "family": "Smith", "suffix": ["Jr"]}]),
+        schemas.PIIRecord(
+            name=[{"given": ["Johnny"], "family": "Smith"}, {"given": ["Jon"], "family": "Doe"}]
+        ),
+    ]
+
+    def test_exact_match(self):
+        for attribute in ["FIRST_NAME", "LAST_NAME", "SEX", "BIRTHDATE", "NAME"]:
+            feature = schemas.Feature.parse(attribute)
+            expected = [
+                matchers.compare_probabilistic_exact_match(self.RECORD, r, feature, 6.8, 0.5)
+                for r in self.MPI_RECORDS
+            ]
+            results = matchers.batch_compare_probabilistic_exact_match(
+                self.RECORD, self.MPI_RECORDS, feature, 6.8, 0.5
+            )
+            assert results == expected
+
+    def test_fuzzy_match(self):
+        for attribute in ["FIRST_NAME", "LAST_NAME", "SEX", "BIRTHDATE", "NAME"]:
+            for measure in typing.get_args(matchers.SIMILARITY_MEASURES):
+                for threshold in [0.0, 0.7, 0.9, 1.0]:
+                    feature = schemas.Feature.parse(attribute)
+                    kwargs = {"fuzzy_match_measure": measure, "fuzzy_match_threshold": threshold}
+                    expected = [
+                        matchers.compare_probabilistic_fuzzy_match(
+                            self.RECORD, r, feature, 6.8, 0.5, **kwargs
+                        )
+                        for r in self.MPI_RECORDS
+                    ]
+                    results = matchers.batch_compare_probabilistic_fuzzy_match(
+                        self.RECORD, self.MPI_RECORDS, feature, 6.8, 0.5, **kwargs
+                    )
+                    assert results == expected
+
+    def test_fuzzy_match_names(self):
+        # process.extract scores some of these pairs (e.g. John and Martha) slightly
+        # differently than the scalar JaroWinkler, so batching must not use it
+        names = ["John", "Martha", "Jon", "Johnathan", "Mary", "Marta", "Joan", "Mark", "Jo"]
+        mpi_records = [schemas.PIIRecord(name=[{"given": [n], "family": "Doe"}]) for n in names]
+        feature = schemas.Feature.parse("FIRST_NAME")
+        for measure in typing.get_args(matchers.SIMILARITY_MEASURES):
+            for name in names:
+                record = schemas.PIIRecord(name=[{"given": [name], "family": "Doe"}])
+                kwargs = {"fuzzy_match_measure": measure, "fuzzy_match_threshold": 0.0}
+                expected = [
+                    matchers.compare_probabilistic_fuzzy_match(
+                        record, r, feature, 6.8, 0.5, **kwargs
+                    )
+                    for r in mpi_records
+                ]
+                results = matchers.batch_compare_probabilistic_fuzzy_match(
+                    record, mpi_records, feature, 6.8, 0.5, **kwargs
+                )
+                assert results == expected
+
+    def test_missing_incoming(self):
+        feature = schemas.Feature.parse("ZIP")
+        results = matchers.batch_compare_probabilistic_fuzzy_match(
+            self.RECORD, self.MPI_RECORDS, feature, 4.0, 0.5, "JaroWinkler", 0.9
+        )
+        assert results == [(2.0, True)] * len(self.MPI_RECORDS)
+
+    def test_empty(self):
+        feature = schemas.Feature.parse("FIRST_NAME")
+        assert matchers.batch_compare_probabilistic_fuzzy_match(
+            self.RECORD, [], feature, 4.0, 0.5, "JaroWinkler", 0.9
+        ) == []
+        assert matchers.batch_compare_probabilistic_exact_match(
+            self.RECORD, [], feature, 4.0, 0.5
+        ) == []
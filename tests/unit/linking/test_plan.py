@@ -0,0 +1,98 @@
+"""
+unit.linking.test_plan.py
+~~~~~~~~~~~~~~~~~~~~~~~~~
+
+This module contains the unit tests for the recordlinker.linking.plan module.
+"""
+
+import unittest.mock
+
+from recordlinker import schemas
+from recordlinker.linking import matchers
+from recordlinker.linking import plan
+
+
+class TestCompilePass:
+    def test_compile(self, default_algorithm):
+        algorithm_pass = default_algorithm.passes[0]
+        context = default_algorithm.algorithm_context
+        compiled = plan.compile_pass(algorithm_pass, context)
+        assert compiled.algorithm_pass is algorithm_pass
+        assert compiled.label == algorithm_pass.resolved_label
+        assert compiled.max_points == sum(
+            [context.get_log_odds(e.feature) or 0.0 for e in algorithm_pass.evaluators]
+        )
+        assert compiled.max_missing_points == (
+            context.advanced.max_missing_allowed_proportion * compiled.max_points
+        )
+        assert (
+            compiled.minimum_match_threshold,
+            compiled.certain_match_threshold,
+        ) == algorithm_pass.possible_match_window
+        assert isinstance(compiled.evaluators, tuple)
+        assert len(compiled.evaluators) == len(algorithm_pass.evaluators)
+        for evaluator, original in zip(compiled.evaluators, algorithm_pass.evaluators):
+            assert evaluator.feature_key == str(original.feature)
+            assert evaluator.detail_key == f"evaluator.{original.feature}.{original.func}.result"
+            assert evaluator.func is original.func.callable()
+            assert evaluator.batch_func is original.func.batch_callable()
+            assert evaluator.log_odds == context.get_log_odds(original.feature)
+
+    def test_evaluator_defaults(self):
+        context = schemas.AlgorithmContext(
+            log_odds=[{"feature": "FIRST_NAME", "value": 6.8}],
+            advanced={"fuzzy_match_threshold": 0.8, "fuzzy_match_measure": "Levenshtein"},
+        )
+        algorithm_pass = schemas.AlgorithmPass(
+            blocking_keys=["BIRTHDATE"],
+            evaluators=[
+                {"feature": "FIRST_NAME", "func": "COMPARE_PROBABILISTIC_FUZZY_MATCH"},
+                {
+                    "feature": "LAST_NAME",
+                    "func": "COMPARE_PROBABILISTIC_FUZZY_MATCH",
+                    "fuzzy_match_threshold": 0.9,
+                    "fuzzy_match_measure": "JaroWinkler",
+                },
+            ],
+            possible_match_window=(0.8, 0.9),
+        )
+        compiled = plan.compile_pass(algorithm_pass, context)
+        first, last = compiled.evaluators
+        assert first.log_odds == 6.8
+        assert first.fuzzy_match_threshold == 0.8
+        assert first.fuzzy_match_measure == "Levenshtein"
+        assert last.log_odds == 0.0
+        assert last.fuzzy_match_threshold == 0.9
+        assert last.fuzzy_match_measure == "JaroWinkler"
+        assert last.func is matchers.compare_probabilistic_fuzzy_match
+        assert compiled.max_points == 6.8
+
+
+class TestCompileAlgorithm:
+    def test_compile(self, default_algorithm):
+        compiled = plan.compile_algorithm(default_algorithm)
+        assert compiled.algorithm == default_algorithm
+        assert compiled.context == default_algorithm.algorithm_context
+        assert [p.label for p in compiled.passes] == [
+            p.resolved_label for p in default_algorithm.passes
+        ]
+
+    def test_cached(self, default_algorithm):
+        compiled = plan.compile_algorithm(default_algorithm)
+        assert plan.compile_algorithm(default_algorithm) is compiled
+        # the cache is keyed by identity, so the algorithm isn't serialized
+        with unittest.mock.patch.object(
+            schemas.Algorithm, "model_dump_json", side_effect=AssertionError
+        ):
+            assert plan.compile_algorithm(default_algorithm) is compiled
+        copy = schemas.Algorithm.model_validate(default_algorithm.model_dump())
+        assert plan.compile_algorithm(copy) is not compiled
+
+    def test_new_version(self, default_algorithm):
+        compiled = plan.compile_algorithm(default_algorithm)
+        changed = default_algorithm.model_copy(deep=True)
+        changed.passes[0].possible_match_window = (0.5, 0.95)
+        recompiled = plan.compile_algorithm(changed)
+        assert recompiled is not compiled
+        assert recompiled.passes[0].minimum_match_threshold == 0.5
+        assert recompiled.passes[0].certain_match_threshold == 0.95
@@ -0,0 +1,82 @@
+"""
+unit.linking.test_refresher.py
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+This module contains the unit tests for the recordlinker.linking.refresher module.
+"""
+
+import datetime
+from unittest import mock
+
+import pytest
+from sqlalchemy import orm
+
+from recordlinker import models
+from recordlinker import schemas
+from recordlinker.database import mpi_service
+from recordlinker.linking import refresher
+from recordlinker.utils.datetime import now_utc
+
+
+@pytest.fixture
+def session_maker(session):
+    return orm.sessionmaker(bind=session.get_bind())
+
+
+@pytest.fixture
+def patients(session):
+    record = schemas.PIIRecord(birthdate="1980-01-01", sex="F")
+    return [mpi_service.insert_patient(session, record) for _ in range(3)]
+
+
+class TestBlockingStatsRefresher:
+    def test_refresh(self, session, session_maker, patients):
+        worker = refresher.BlockingStatsRefresher(session_maker, interval=60, min_count=3)
+        assert worker.refresh() == 2
+        assert session.query(models.BlockingStat).count() == 2
+        # the statistics aren't rebuilt again until they are older than the interval
+        assert worker.refresh() is None
+        later = now_utc() + datetime.timedelta(seconds=61)
+        with mock.patch.object(refresher, "now_utc", return_value=later):
+            assert worker.refresh() == 2
+
+    def test_stop(self, session_maker):
+        worker = refresher.BlockingStatsRefresher(session_maker, interval=60)
+        with mock.patch.object(worker, "refresh") as refresh:
+            worker.start()
+            worker.stop()
+        assert not worker.is_alive()
+        refresh.assert_not_called()
+
+    def test_error(self, session_maker):
+        worker = refresher.BlockingStatsRefresher(session_maker, interval=0.01)
+        with (
+            mock.patch.object(worker, "refresh", side_effect=RuntimeError),
+            mock.patch.object(refresher.LOGGER, "exception") as log,
+        ):
+            worker.start()
+            while not log.called:
+                worker.join(0.01)
+            worker.stop()
+        log.assert_called_with("error refreshing blocking stats")
+
+
+class TestStartRefresher:
+    def test_disabled(self):
+        with mock.patch.object(refresher.settings, "blocking_stats_refresh_interval", None):
+            assert refresher.start_refresher() is None
+
+    def test_enabled(self, session_maker):
+        with (
+            mock.patch.object(refresher.settings, "blocking_stats_refresh_interval", 60),
+            mock.patch.object(refresher.database, "SessionMaker", session_maker),
+        ):
+            try:
+                worker = refresher.start_refresher()
+                assert worker.is_alive()
+                assert worker.interval == 60
+                assert refresher.start_refresher() is worker
+            finally:
+                refresher.stop_refresher()
+        assert refresher._REFRESHER is None
+        assert not worker.is_alive()
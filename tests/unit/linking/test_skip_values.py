@@ -242,3 +242,15 @@ class TestRemoveSkipValues:
         )
         assert cleaned.identifiers[0].type == IdentifierType.MR
         assert cleaned.identifiers[0].value == "99-999-9999"
+
+    def test_precomputed_features(self):
+        skips = [SkipValue(feature="LAST_NAME", values=["Unknown"])]
+        record = schemas.PIIRecord(name=[{"given": ["John"], "family": "Smith"}])
+        record.precompute_features()
+        cleaned = skip_values.remove_skip_values(record, skips)
+        assert cleaned._features == record._features
+        record = schemas.PIIRecord(name=[{"given": ["John"], "family": "Unknown"}])
+        record.precompute_features()
+        cleaned = skip_values.remove_skip_values(record, skips)
+        assert cleaned._features is None
+        assert record._features is not None
@@ -0,0 +1,27 @@
+"""
+unit.models.test_mpi.py
+~~~~~~~~~~~~~~~~~~~~~~~
+
+This module contains the unit tests for the recordlinker.models.mpi module.
+"""
+
+from recordlinker.models import mpi
+
+
+class TestBlockingHash:
+    def test_stable(self):
+        key = mpi.BlockingKey.BIRTHDATE
+        assert mpi.blocking_hash(key, "1980-01-01") == mpi.blocking_hash(key, "1980-01-01")
+        assert mpi.blocking_hash(key, "1980-01-01") != mpi.blocking_hash(key, "1980-01-02")
+
+    def test_key_in_high_bits(self):
+        for key in mpi.BlockingKey:
+            value = mpi.blocking_hash(key, "abcd")
+            assert value >> mpi.BLOCKING_HASH_VALUE_BITS == key.id
+            low, high = mpi.blocking_hash_range(key)
+            assert low <= value <= high
+
+    def test_signed_64_bit(self):
+        max_id = max(k.id for k in mpi.BlockingKey)
+        assert mpi.blocking_hash_range(mpi.BlockingKey.IDENTIFIER)[1] < 2**63
+        assert max_id < 2 ** (63 - mpi.BLOCKING_HASH_VALUE_BITS)
@@ -0,0 +1,114 @@
+"""
+unit.models.test_partitioning.py
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+This module contains the unit tests for the recordlinker.models.partitioning module.
+"""
+
+from unittest import mock
+
+import sqlalchemy
+
+from recordlinker.models import Base
+from recordlinker.models import mpi
+from recordlinker.models import partitioning
+
+
+class TestPartitionName:
+    def test_key(self):
+        assert (
+            partitioning.partition_name("mpi_blocking_value", mpi.BlockingKey.BIRTHDATE)
+            == "mpi_blocking_value_birthdate"
+        )
+
+    def test_default(self):
+        assert (
+            partitioning.partition_name("mpi_blocking_value", None) == "mpi_blocking_value_default"
+        )
+
+
+class TestPostgresqlPartitions:
+    def test_partitions(self):
+        statements = partitioning.postgresql_partitions("bv")
+        assert len(statements) == len(mpi.BlockingKey) + 1
+        assert "CREATE TABLE bv_sex PARTITION OF bv FOR VALUES IN (3)" in statements
+        assert statements[-1] == "CREATE TABLE bv_default PARTITION OF bv DEFAULT"
+
+
+class TestPostgresqlConvert:
+    def test_partitioned(self):
+        statements = partitioning.postgresql_convert("bv", "patient", partitioned=True)
+        assert statements[0] == "ALTER TABLE bv RENAME TO bv_old"
+        create = statements[4]
+        assert create.startswith("CREATE TABLE bv (")
+        assert "PRIMARY KEY (id, blockingkey)" in create
+        assert create.endswith("PARTITION BY LIST (blockingkey)")
+        assert "CREATE TABLE bv_default PARTITION OF bv DEFAULT" in statements
+        # the rows are copied before the old table, and its sequence, are dropped
+        insert = next(i for i, s in enumerate(statements) if s.startswith("INSERT INTO bv"))
+        assert insert < statements.index("ALTER SEQUENCE bv_id_seq OWNED BY bv.id")
+        assert statements[-1] == "DROP TABLE bv_old"
+
+    def test_unpartitioned(self):
+        statements = partitioning.postgresql_convert("bv", "patient", partitioned=False)
+        assert "PRIMARY KEY (id)" in statements[4]
+        assert "PARTITION" not in " ".join(statements)
+
+
+class TestMssqlConvert:
+    def test_partitioned(self):
+        statements = partitioning.mssql_convert("bv", "pk_old", partitioned=True)
+        assert statements[0].startswith("CREATE PARTITION FUNCTION pf_bv (smallint)")
+        assert (
+            statements[1] == "CREATE PARTITION SCHEME ps_bv AS PARTITION pf_bv ALL TO ([PRIMARY])"
+        )
+        assert "ALTER TABLE bv DROP CONSTRAINT pk_old" in statements
+        assert (
+            "ALTER TABLE bv ADD CONSTRAINT pk_bv PRIMARY KEY CLUSTERED (id, blockingkey) "
+            "ON ps_bv(blockingkey)"
+        ) in statements
+        assert all(s.endswith("ON ps_bv(blockingkey)") for s in statements[3:])
+
+    def test_unpartitioned(self):
+        statements = partitioning.mssql_convert("bv", "pk_bv", partitioned=False)
+        assert statements[0] == "ALTER TABLE bv DROP CONSTRAINT pk_bv"
+        assert statements[-2:] == ["DROP PARTITION SCHEME ps_bv", "DROP PARTITION FUNCTION pf_bv"]
+
+    def test_boundaries(self):
+        statements = partitioning.mssql_partition_scheme("bv")
+        ids = sorted(k.id for k in mpi.BlockingKey)
+        assert statements[0].endswith(f"FOR VALUES ({', '.join(str(i) for i in ids)})")
+
+
+class TestAfterCreate:
+    def test_postgresql(self):
+        connection = mock.Mock()
+        connection.dialect.name = "postgresql"
+        partitioning._after_create(mpi.BlockingValue.__table__, connection)
+        assert connection.execute.call_count == len(
+            partitioning.postgresql_convert("bv", "patient", partitioned=True)
+        )
+        create = str(connection.execute.call_args_list[4].args[0])
+        assert create.startswith("CREATE TABLE mpi_blocking_value (")
+        assert "REFERENCES mpi_patient (id)" in create
+
+    def test_other_dialect(self):
+        connection = mock.Mock()
+        connection.dialect.name = "sqlite"
+        partitioning._after_create(mpi.BlockingValue.__table__, connection)
+        connection.execute.assert_not_called()
+
+    def test_create_all_sqlite(self):
+        # the partitioning DDL is skipped, and the primary key is left on id alone
+        engine = sqlalchemy.create_engine("sqlite://")
+        sqlalchemy.event.listen(
+            mpi.BlockingValue.__table__, "after_create", partitioning._after_create
+        )
+        try:
+            Base.metadata.create_all(engine)
+        finally:
+            sqlalchemy.event.remove(
+                mpi.BlockingValue.__table__, "after_create", partitioning._after_create
+            )
+        pkey = sqlalchemy.inspect(engine).get_pk_constraint(mpi.BlockingValue.__tablename__)
+        assert pkey["constrained_columns"] == ["id"]
@@ -71,6 +71,7 @@ class TestGetAlgorithm:
             "description": "First algorithm",
             "algorithm_context": {
                 "include_multiple_matches": True,
+                "early_termination": False,
                 "log_odds": [
                     {"feature": "FIRST_NAME", "value": 6.8},
                     {"feature": "BIRTHDATE", "value": 10.0}
@@ -276,6 +277,7 @@ class TestUpdateAlgorithm:
         assert algo.description == "Updated algorithm"
         assert algo.algorithm_context == {
             "include_multiple_matches": True,
+            "early_termination": False,
             "log_odds": [
                 {"feature": "FIRST_NAME", "value": 6.8},
                 {"feature": "BIRTHDATE", "value": 10.0}
@@ -0,0 +1,73 @@
+"""
+unit.routes.test_blocking_router.py
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+This module contains the unit tests for the recordlinker.routes.blocking_router module.
+"""
+
+from unittest import mock
+
+from recordlinker import models
+from recordlinker.database import blocking_index
+
+
+class TestGetStopValues:
+    def path(self, client):
+        return client.app.url_path_for("get-blocking-stop-values")
+
+    def test_empty(self, client):
+        response = client.get(self.path(client))
+        assert response.status_code == 200
+        assert response.json() == {"stop_values": []}
+
+    def test_stop_values(self, client):
+        birthdate = models.blocking_hash(models.BlockingKey.BIRTHDATE, "1900-01-01")
+        zip_code = models.blocking_hash(models.BlockingKey.ZIP, "00000")
+        client.session.add_all(
+            [
+                models.BlockingStat(hash=birthdate, count=500, stop=True, value="1900-01-01"),
+                models.BlockingStat(hash=zip_code, count=900, stop=True, value="00000"),
+                models.BlockingStat(
+                    hash=models.blocking_hash(models.BlockingKey.SEX, "F"), count=1000
+                ),
+            ]
+        )
+        client.session.commit()
+        response = client.get(self.path(client))
+        assert response.status_code == 200
+        assert response.json() == {
+            "stop_values": [
+                {"blocking_key": "ZIP", "value": "00000", "count": 900},
+                {"blocking_key": "BIRTHDATE", "value": "1900-01-01", "count": 500},
+            ]
+        }
+
+
+class TestGetIndex:
+    def path(self, client):
+        return client.app.url_path_for("get-blocking-index")
+
+    def test_disabled(self, client):
+        response = client.get(self.path(client))
+        assert response.status_code == 404
+
+    def test_enabled(self, client):
+        client.session.add(models.Patient(id=5, data={}))
+        client.session.add(models.BlockingValue(patient_id=5, blockingkey=3, value="F"))
+        client.session.commit()
+        with (
+            mock.patch.object(blocking_index.settings, "blocking_index", True),
+            mock.patch.object(blocking_index.settings, "blocking_index_snapshot", None),
+        ):
+            blocking_index.reset_index()
+            try:
+                response = client.get(self.path(client))
+            finally:
+                blocking_index.reset_index()
+        assert response.status_code == 200
+        data = response.json()
+        assert data["hashes"] == 1
+        assert data["postings"] == 1
+        assert data["watermark"] == 5
+        assert data["bytes"] > 0
+        assert data["mapped_bytes"] == 0
@@ -10,15 +10,19 @@ import json
 import uuid
 from unittest import mock
 
+import fastapi
 import pytest
 from conftest import load_test_json_asset
 from fastapi import HTTPException
 from fastapi import status
+from fastapi.testclient import TestClient
 
 from recordlinker import models
 from recordlinker import schemas
 from recordlinker.database import algorithm_service
+from recordlinker.database import get_async_session as get_async_session_dependency
 from recordlinker.hl7 import fhir
+from recordlinker.linking import link
 from recordlinker.routes import link_router
 
 
@@ -173,6 +177,173 @@ class TestLink:
         assert actual_response.json()["detail"] == "No algorithm found"
 
 
+class TestLinkBatch:
+    def path(self, client):
+        return client.app.url_path_for("link-batch")
+
+    @pytest.fixture
+    def patients(self):
+        bundle = load_test_json_asset("simple_patient_bundle_to_link_with_mpi.json")
+        patients: list[schemas.PIIRecord] = []
+        for entry in bundle["entry"]:
+            if entry.get("resource", {}).get("resourceType", {}) == "Patient":
+                patients.append(fhir.fhir_record_to_pii_record(entry["resource"]))
+        return patients
+
+    def test_empty_records(self, client):
+        response = client.post(self.path(client), json={"records": []})
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        assert response.json()["detail"][0]["msg"] == "Value error, Records must not be empty"
+
+    def test_too_many_records(self, client):
+        data = {"records": [{"record": {}} for _ in range(schemas.link.LINK_BATCH_MAX_SIZE + 1)]}
+        response = client.post(self.path(client), json=data)
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        assert response.json()["detail"][0]["msg"] == (
+            f"Value error, Records must not exceed {schemas.link.LINK_BATCH_MAX_SIZE} records"
+        )
+
+    @mock.patch("recordlinker.database.algorithm_service.get_algorithm")
+    def test_invalid_algorithm_param(self, patched_subprocess, patients, client):
+        patched_subprocess.return_value = None
+        response = client.post(
+            self.path(client),
+            json={
+                "records": [{"record": json.loads(patients[0].model_dump_json(exclude_none=True))}],
+                "algorithm": "INVALID",
+            },
+        )
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        assert response.json()["detail"] == "No algorithm found"
+
+    @mock.patch("recordlinker.database.algorithm_service.default_algorithm")
+    def test_success(self, patched_subprocess, default_algorithm, patients, client):
+        patched_subprocess.return_value = default_algorithm
+        records = [
+            {
+                "record": json.loads(p.model_dump_json(exclude_none=True)),
+                "external_person_id": f"EXT-{idx}",
+            }
+            for idx, p in enumerate(patients)
+        ]
+        response = client.post(self.path(client), json={"records": records})
+        assert response.status_code == status.HTTP_200_OK
+        results = response.json()["results"]
+        assert len(results) == len(patients)
+        assert [r["match_grade"] for r in results] == [
+            "certainly-not",
+            "certain",
+            "certainly-not",
+            "certain",
+            "certainly-not",
+            "certainly-not",
+        ]
+        # Records later in the batch link to Persons created earlier in the batch
+        assert results[1]["person_reference_id"] == results[0]["person_reference_id"]
+        assert results[3]["person_reference_id"] == results[0]["person_reference_id"]
+        assert len({r["patient_reference_id"] for r in results}) == len(patients)
+        assert client.session.query(models.Patient).count() == len(patients)
+
+
+class TestLinkStream:
+    def path(self, client):
+        return client.app.url_path_for("link-stream")
+
+    @pytest.fixture
+    def patients(self):
+        bundle = load_test_json_asset("simple_patient_bundle_to_link_with_mpi.json")
+        patients: list[schemas.PIIRecord] = []
+        for entry in bundle["entry"]:
+            if entry.get("resource", {}).get("resourceType", {}) == "Patient":
+                patients.append(fhir.fhir_record_to_pii_record(entry["resource"]))
+        return patients
+
+    def ndjson(self, records: list[schemas.PIIRecord]) -> str:
+        return "\n".join(r.model_dump_json(exclude_none=True) for r in records) + "\n"
+
+    @mock.patch("recordlinker.database.algorithm_service.get_algorithm")
+    def test_invalid_algorithm_param(self, patched_subprocess, patients, client):
+        patched_subprocess.return_value = None
+        response = client.post(
+            self.path(client),
+            params={"algorithm": "INVALID"},
+            content=self.ndjson(patients[:1]),
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        assert response.json()["detail"] == "No algorithm found"
+
+    def test_invalid_chunk_size(self, patients, client):
+        response = client.post(
+            self.path(client),
+            params={"chunk_size": 0},
+            content=self.ndjson(patients[:1]),
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    @mock.patch("recordlinker.database.algorithm_service.default_algorithm")
+    def test_success(self, patched_subprocess, default_algorithm, patients, client):
+        patched_subprocess.return_value = default_algorithm
+        with mock.patch(
+            "recordlinker.linking.link.link_stream_chunk",
+            wraps=link.link_stream_chunk,
+        ) as chunks:
+            response = client.post(
+                self.path(client),
+                params={"chunk_size": 4},
+                content=self.ndjson(patients),
+                headers={"Content-Type": "application/x-ndjson"},
+            )
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        # the records were linked in two chunks, of 4 and 2 records
+        assert [len(c.args[2]) for c in chunks.call_args_list] == [4, 2]
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert [line["line"] for line in lines] == [1, 2, 3, 4, 5, 6]
+        results = [line["result"] for line in lines]
+        assert [r["match_grade"] for r in results] == [
+            "certainly-not",
+            "certain",
+            "certainly-not",
+            "certain",
+            "certainly-not",
+            "certainly-not",
+        ]
+        # Records later in the stream link to Persons created earlier in the stream
+        assert results[1]["person_reference_id"] == results[0]["person_reference_id"]
+        assert results[3]["person_reference_id"] == results[0]["person_reference_id"]
+        assert client.session.query(models.Patient).count() == len(patients)
+
+    @mock.patch("recordlinker.database.algorithm_service.default_algorithm")
+    def test_invalid_lines(self, patched_subprocess, default_algorithm, patients, client):
+        patched_subprocess.return_value = default_algorithm
+        content = "\n".join(
+            [
+                patients[0].model_dump_json(exclude_none=True),
+                "not json",
+                "",
+                '{"birth_date": "not a date"}',
+                patients[2].model_dump_json(exclude_none=True),
+            ]
+        )
+        response = client.post(
+            self.path(client),
+            content=content,
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+        assert response.status_code == status.HTTP_200_OK
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert [line["line"] for line in lines] == [1, 2, 3, 4]
+        assert lines[0]["result"]["match_grade"] == "certainly-not"
+        assert lines[1]["result"] is None
+        assert "Invalid JSON" in lines[1]["error"]
+        assert lines[2]["result"] is None
+        assert "birth_date" in lines[2]["error"]
+        assert lines[3]["result"]["match_grade"] == "certainly-not"
+        assert client.session.query(models.Patient).count() == 2
+
+
 class TestLinkFHIR:
     def path(self, client):
         return client.app.url_path_for("link-fhir")
@@ -374,6 +545,49 @@ class TestMatch:
         assert len(client.session.query(models.Patient).all()) == 1
 
 
+class TestMatchExplain:
+    def path(self, client):
+        return client.app.url_path_for("match-explain")
+
+    @pytest.fixture
+    def patients(self) -> list[schemas.PIIRecord]:
+        bundle = load_test_json_asset("simple_patient_bundle_to_link_with_mpi.json")
+        patients: list[schemas.PIIRecord] = []
+        for entry in bundle["entry"]:
+            if entry.get("resource", {}).get("resourceType", {}) == "Patient":
+                patients.append(fhir.fhir_record_to_pii_record(entry["resource"]))
+        return patients
+
+    def test_invalid_algorithm(self, client):
+        resp = client.post(self.path(client), json={"record": {}})
+        assert resp.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        assert resp.json()["detail"] == "No algorithm found"
+
+    def test_match(self, client, default_algorithm, patients):
+        algorithm_service.load_algorithm(client.session, default_algorithm)
+        client.session.commit()
+        per1 = client.post(
+            client.app.url_path_for("link-record"), json={"record": patients[0].to_dict(True)}
+        ).json()["person_reference_id"]
+
+        resp = client.post(self.path(client), json={"record": patients[0].to_dict(True)})
+        assert resp.status_code == status.HTTP_200_OK
+        payload = resp.json()
+        assert payload["match_grade"] == "certain"
+        assert payload["person_reference_id"] == per1
+        assert len(client.session.query(models.Patient).all()) == 1
+        profile = payload["profile"]
+        assert [p["label"] for p in profile["passes"]] == [
+            p.label for p in default_algorithm.passes
+        ]
+        first = profile["passes"][0]
+        assert first["persons"] == 1
+        assert first["patients"] == 1
+        assert first["persons_compared"] == 1
+        assert set(first["feature_seconds"]) == {"FIRST_NAME", "LAST_NAME"}
+        assert profile["total_seconds"] > 0
+
+
 class TestMatchFHIR:
     def path(self, client):
         return client.app.url_path_for("match-fhir")
@@ -421,3 +635,56 @@ class TestMatchFHIR:
         assert payload.get("patient_reference_id") is None
         assert len(payload["updated_bundle"]["entry"]) == 2
         assert len(client.session.query(models.Patient).all()) == 1
+
+
+class TestAsyncRouter:
+    @pytest.fixture
+    def async_client(self, session, async_session_maker):
+        async def get_async_session():
+            async with async_session_maker() as async_session:
+                yield async_session
+                await async_session.commit()
+
+        app = fastapi.FastAPI()
+        app.include_router(link_router.async_router)
+        app.dependency_overrides[get_async_session_dependency] = get_async_session
+        with TestClient(app, raise_server_exceptions=False) as c:
+            yield c
+
+    @pytest.fixture
+    def patients(self) -> list[schemas.PIIRecord]:
+        bundle = load_test_json_asset("simple_patient_bundle_to_link_with_mpi.json")
+        patients: list[schemas.PIIRecord] = []
+        for entry in bundle["entry"]:
+            if entry.get("resource", {}).get("resourceType", {}) == "Patient":
+                patients.append(fhir.fhir_record_to_pii_record(entry["resource"]))
+        return patients
+
+    def test_invalid_algorithm(self, async_client):
+        resp = async_client.post(
+            async_client.app.url_path_for("link-record"), json={"record": {}}
+        )
+        assert resp.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        assert resp.json()["detail"] == "No algorithm found"
+
+    def test_link_and_match(self, session, async_client, default_algorithm, patients):
+        algorithm_service.load_algorithm(session, default_algorithm)
+        session.commit()
+        resp = async_client.post(
+            async_client.app.url_path_for("link-record"),
+            json={"record": patients[0].to_dict(True)},
+        )
+        assert resp.status_code == status.HTTP_200_OK
+        linked = resp.json()
+        assert linked["match_grade"] == "certainly-not"
+        assert linked["patient_reference_id"] is not None
+
+        resp = async_client.post(
+            async_client.app.url_path_for("match-record"),
+            json={"record": patients[1].to_dict(True)},
+        )
+        assert resp.status_code == status.HTTP_200_OK
+        payload = resp.json()
+        assert payload["match_grade"] == "certain"
+        assert payload["person_reference_id"] == linked["person_reference_id"]
+        assert len(session.query(models.Patient).all()) == 1
@@ -408,6 +408,44 @@ class TestPIIRecord:
             "WHITE"
         ]
 
+    def test_feature_values(self):
+        record = pii.PIIRecord(
+            birth_date="1980-2-1",
+            sex="male",
+            race=["asian", "unknown"],
+            address=[
+                {"line": ["123 Main St"], "city": "Anytown", "state": "NY", "zip": "12345"},
+                {"line": ["456 Elm St"], "city": "Somecity", "county": "county"},
+            ],
+            name=[
+                pii.Name(family="O'Neil", given=["John", "L"], suffix=["Jr"]),
+                pii.Name(family="Smith", given=["Jane"]),
+            ],
+            telecom=[
+                pii.Telecom(value="555-123-4567", system="phone"),
+                pii.Telecom(value="test@email.com", system="email"),
+            ],
+            identifiers=[
+                {"type": "MR", "value": "123456", "authority": "NY"},
+                {"type": "SS", "value": "123-45-6789"},
+            ],
+        )
+        precomputed = record.model_copy().precompute_features()
+        for option in pii.Feature.all_options():
+            feature = pii.Feature.parse(option)
+            for prepend_suffix in (False, True):
+                expected = list(record.feature_iter(feature, prepend_suffix=prepend_suffix))
+                assert record.feature_values(feature, prepend_suffix) == expected
+                assert precomputed.feature_values(feature, prepend_suffix) == expected
+
+    def test_feature_values_from_patient(self):
+        record = pii.PIIRecord(name=[pii.Name(family="Doe", given=["John"])])
+        patient = Patient(data=record.to_data(), features={"FIRST_NAME": ["precomputed"]})
+        feature = pii.Feature(attribute=pii.FeatureAttribute.FIRST_NAME)
+        assert pii.PIIRecord.from_patient(patient).feature_values(feature) == ["precomputed"]
+        patient = Patient(data=record.to_data())
+        assert pii.PIIRecord.from_patient(patient).feature_values(feature) == ["john"]
+
     def test_feature_iter_given_name(self):
         record = pii.PIIRecord(
             name=[
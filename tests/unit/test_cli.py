@@ -0,0 +1,406 @@
+"""
+unit.test_cli.py
+~~~~~~~~~~~~~~~~
+
+This module contains the unit tests for the recordlinker.cli module.
+"""
+
+import concurrent.futures
+import io
+import json
+from unittest import mock
+
+import pytest
+from conftest import load_test_json_asset
+
+from recordlinker import cli
+from recordlinker import models
+from recordlinker import schemas
+from recordlinker.config import settings
+from recordlinker.database import blocking_index
+from recordlinker.database import mpi_service
+from recordlinker.hl7 import fhir
+
+
+@pytest.fixture
+def patients():
+    bundle = load_test_json_asset("simple_patient_bundle_to_link_with_mpi.json")
+    patients: list[schemas.PIIRecord] = []
+    for entry in bundle["entry"]:
+        if entry.get("resource", {}).get("resourceType", {}) == "Patient":
+            patients.append(fhir.fhir_record_to_pii_record(entry["resource"]))
+    return patients
+
+
+def ndjson(records: list[schemas.PIIRecord]) -> str:
+    return "\n".join(r.model_dump_json(exclude_none=True) for r in records) + "\n"
+
+
+class TestCsvRowToData:
+    def test_empty(self):
+        data = cli.csv_row_to_data({"external_id": "", "family": " "})
+        assert schemas.PIIRecord.model_validate(data) == schemas.PIIRecord()
+
+    def test_full(self):
+        row = {
+            "External_ID": "123",
+            "BIRTH_DATE": "1980-01-02",
+            "sex": "F",
+            "given": "Jo Ann",
+            "family": "Smith",
+            "suffix": "Jr",
+            "line": "123 Main St",
+            "city": "Springfield",
+            "state": "IL",
+            "postal_code": "62701",
+            "phone": "555-555-1234",
+            "email": "jo@example.com",
+            "ssn": "123-45-6789",
+            "mrn": "M1",
+        }
+        record = schemas.PIIRecord.model_validate(cli.csv_row_to_data(row))
+        assert record.external_id == "123"
+        assert str(record.birth_date) == "1980-01-02"
+        assert record.name[0].given == ["Jo", "Ann"]
+        assert record.name[0].family == "Smith"
+        assert record.address[0].line == ["123 Main ST"]
+        assert record.address[0].postal_code == "62701"
+        assert [t.system for t in record.telecom] == ["phone", "email"]
+        assert [i.type.value for i in record.identifiers] == ["SS", "MR"]
+
+
+class TestReadRecords:
+    def test_ndjson(self, patients):
+        records = list(cli.read_records(io.StringIO(ndjson(patients[:2])), "ndjson"))
+        assert [line for line, _ in records] == [1, 2]
+        assert [r for _, r in records] == patients[:2]
+
+    def test_ndjson_invalid(self, patients):
+        content = ndjson(patients[:1]) + "\nnot json\n" + ndjson(patients[1:2])
+        records = list(cli.read_records(io.StringIO(content), "ndjson"))
+        assert [line for line, _ in records] == [1, 2, 3]
+        assert isinstance(records[1][1], str)
+        assert records[2][1] == patients[1]
+
+    def test_csv(self):
+        content = "external_id,birth_date,family\n1,1980-01-02,Smith\n2,bad,Jones\n"
+        records = list(cli.read_records(io.StringIO(content), "csv"))
+        assert [line for line, _ in records] == [1, 2]
+        assert records[0][1].external_id == "1"
+        assert isinstance(records[1][1], str)
+
+    def test_start(self, patients):
+        records = list(cli.read_records(io.StringIO(ndjson(patients)), "ndjson", start=4))
+        assert [line for line, _ in records] == [5, 6]
+        assert [r for _, r in records] == patients[4:]
+
+
+class TestCheckpoint:
+    def test_missing(self, tmp_path):
+        assert cli.read_checkpoint(None) == 0
+        assert cli.read_checkpoint(tmp_path / "missing") == 0
+
+    def test_round_trip(self, tmp_path):
+        path = tmp_path / "link.ckpt"
+        cli.write_checkpoint(path, 42)
+        assert cli.read_checkpoint(path) == 42
+        assert not (tmp_path / "link.ckpt.tmp").exists()
+
+
+class TestRunLink:
+    def test_batches(self, session, default_algorithm, patients, tmp_path):
+        checkpoint = tmp_path / "link.ckpt"
+        output = io.StringIO()
+        records = cli.read_records(io.StringIO(ndjson(patients)), "ndjson")
+        with mock.patch.object(session, "commit", wraps=session.commit) as commit:
+            total = cli.run_link(
+                session, default_algorithm, records, output, batch_size=4, checkpoint=checkpoint
+            )
+        assert total == 6
+        assert commit.call_count == 2
+        assert cli.read_checkpoint(checkpoint) == 6
+        lines = [json.loads(line) for line in output.getvalue().splitlines()]
+        assert [line["line"] for line in lines] == [1, 2, 3, 4, 5, 6]
+        # Records later in the file link to Persons created earlier in the file
+        results = [line["result"] for line in lines]
+        assert results[1]["person_reference_id"] == results[0]["person_reference_id"]
+        assert session.query(models.Patient).count() == len(patients)
+
+
+def linked_record(birth_date: str, given: str, family: str, sex: str = "M") -> schemas.PIIRecord:
+    return schemas.PIIRecord(
+        birth_date=birth_date,
+        sex=sex,
+        name=[{"given": [given], "family": family}],
+        address=[{"line": ["1 Main St"], "postal_code": "12345"}],
+    )
+
+
+class TestBlockingGroups:
+    def test_missing_keys(self, default_algorithm):
+        record = schemas.PIIRecord(birth_date="1980-01-02")
+        groups = list(cli.blocking_groups(record, default_algorithm))
+        assert groups == [(0, (models.BlockingKey.BIRTHDATE,), ("1980-01-02",))]
+
+    def test_no_values(self, default_algorithm):
+        assert list(cli.blocking_groups(schemas.PIIRecord(), default_algorithm)) == []
+
+    def test_multiple_values(self, default_algorithm):
+        record = schemas.PIIRecord(
+            name=[{"given": ["John"], "family": "Smith"}, {"given": ["Johnny"], "family": "Jones"}]
+        )
+        groups = list(cli.blocking_groups(record, default_algorithm))
+        keys = (models.BlockingKey.FIRST_NAME, models.BlockingKey.LAST_NAME)
+        assert [g for _, k, g in groups if k == keys] == [
+            ("john", "jone"),
+            ("john", "smit"),
+        ]
+
+
+class TestShardRecords:
+    def test_invalid_record(self, default_algorithm):
+        shards = cli.shard_records([(1, "invalid"), (2, "invalid")], default_algorithm, 4)
+        assert shards == [[(1, "invalid")], [(2, "invalid")], [], []]
+
+    def test_later_pass(self, default_algorithm):
+        # The records only block together on the second pass, not by birth date
+        chunk = [
+            (1, linked_record("1980-01-02", "John", "Smith")),
+            (2, linked_record("1990-03-04", "Jane", "Jones", "F")),
+            (3, linked_record("1980-02-01", "John", "Smith")),
+            (4, "invalid"),
+        ]
+        shards = cli.shard_records(chunk, default_algorithm, 2)
+        assert [[line for line, _ in shard] for shard in shards] == [[1, 3], [2, 4]]
+
+    def test_transitive(self, default_algorithm):
+        # The first and last records are linked through the middle one
+        chunk = [
+            (1, linked_record("1980-01-02", "John", "Smith")),
+            (2, schemas.PIIRecord(birth_date="1970-05-06", sex="F")),
+            (3, schemas.PIIRecord(birth_date="1980-01-02", sex="M")),
+            (4, linked_record("1970-05-06", "Jane", "Jones", "F")),
+        ]
+        shards = cli.shard_records(chunk, default_algorithm, 2)
+        assert [[line for line, _ in shard] for shard in shards] == [[1, 3], [2, 4]]
+
+    def test_balanced(self, default_algorithm):
+        chunk = [(idx, schemas.PIIRecord(birth_date=f"1980-01-{idx:02d}")) for idx in range(1, 29)]
+        shards = cli.shard_records(chunk, default_algorithm, 4)
+        assert [len(shard) for shard in shards] == [7, 7, 7, 7]
+        assert shards == cli.shard_records(chunk, default_algorithm, 4)
+
+
+class TestRunLinkParallel:
+    def test_workers(self, session, default_algorithm, patients, tmp_path):
+        checkpoint = tmp_path / "link.ckpt"
+        output = io.StringIO()
+        records = cli.read_records(io.StringIO(ndjson(patients) + "not json\n"), "ndjson")
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=2,
+            initializer=cli.init_worker,
+            initargs=(settings.test_db_uri, default_algorithm),
+        ) as executor:
+            total = cli.run_link_parallel(
+                executor, records, output, 2, default_algorithm, batch_size=2, checkpoint=checkpoint
+            )
+        assert total == 7
+        assert cli.read_checkpoint(checkpoint) == 7
+        lines = [json.loads(line) for line in output.getvalue().splitlines()]
+        # the results are written in input order, regardless of the shard
+        assert [line["line"] for line in lines] == [1, 2, 3, 4, 5, 6, 7]
+        assert "error" in lines[6]
+        # Records that share a blocking value link to Persons created by the same worker
+        results = [line["result"] for line in lines[:6]]
+        assert results[1]["person_reference_id"] == results[0]["person_reference_id"]
+        assert results[3]["person_reference_id"] == results[0]["person_reference_id"]
+        assert session.query(models.Patient).count() == len(patients)
+
+    def test_matches_single_worker(self, session, default_algorithm):
+        # Records of the same individuals with different birth dates, that only
+        # block together on the second pass
+        records = [
+            linked_record("1980-01-02", "John", "Smith"),
+            linked_record("1990-03-04", "Jane", "Jones", "F"),
+            linked_record("1980-01-12", "John", "Smith"),
+            linked_record("1990-03-14", "Jane", "Jones", "F"),
+            linked_record("1980-01-02", "John", "Smith"),
+            linked_record("2001-07-08", "Ann", "Lee", "F"),
+            linked_record("1990-03-04", "Jane", "Jones", "F"),
+            linked_record("1980-01-20", "John", "Smith"),
+        ]
+
+        def persons(output: io.StringIO) -> list[int]:
+            ids: dict[str, int] = {}
+            lines = [json.loads(line) for line in output.getvalue().splitlines()]
+            return [
+                ids.setdefault(line["result"]["person_reference_id"], len(ids)) for line in lines
+            ]
+
+        single = io.StringIO()
+        cli.run_link(session, default_algorithm, enumerate(records, start=1), single, batch_size=2)
+        mpi_service.reset_mpi(session)
+        parallel = io.StringIO()
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=2,
+            initializer=cli.init_worker,
+            initargs=(settings.test_db_uri, default_algorithm),
+        ) as executor:
+            cli.run_link_parallel(
+                executor, enumerate(records, start=1), parallel, 2, default_algorithm, batch_size=2
+            )
+        assert persons(single) == [0, 1, 0, 1, 0, 2, 1, 0]
+        assert persons(parallel) == persons(single)
+
+
+class TestReadClusters:
+    def test_clusters(self, patients):
+        content = (
+            json.dumps({"records": [p.model_dump(mode="json") for p in patients[:2]]})
+            + "\n\nnot json\n"
+            + json.dumps({"records": [], "external_person_id": "p2"})
+            + "\n"
+        )
+        clusters = list(cli.read_clusters(io.StringIO(content)))
+        assert [line for line, _ in clusters] == [1, 2, 3]
+        assert clusters[0][1].records == patients[:2]
+        assert isinstance(clusters[1][1], str)
+        assert clusters[2][1].external_person_id == "p2"
+
+    def test_start(self):
+        content = "\n".join(
+            json.dumps({"records": [], "external_person_id": str(i)}) for i in range(3)
+        )
+        clusters = list(cli.read_clusters(io.StringIO(content), start=2))
+        assert [(line, c.external_person_id) for line, c in clusters] == [(3, "2")]
+
+
+class TestRunLoad:
+    def test_batches(self, session, patients, tmp_path):
+        checkpoint = tmp_path / "load.ckpt"
+        output = io.StringIO()
+        clusters = [
+            (1, schemas.Cluster(records=patients[:2], external_person_id="p1")),
+            (2, "invalid"),
+            (3, schemas.Cluster(records=patients[2:])),
+        ]
+        with mock.patch.object(session, "commit", wraps=session.commit) as commit:
+            total = cli.run_load(session, clusters, output, batch_size=2, checkpoint=checkpoint)
+        assert total == 3
+        assert commit.call_count == 2
+        assert cli.read_checkpoint(checkpoint) == 3
+        lines = [json.loads(line) for line in output.getvalue().splitlines()]
+        assert [line["line"] for line in lines] == [1, 2, 3]
+        assert lines[0]["result"]["external_person_id"] == "p1"
+        assert len(lines[0]["result"]["patients"]) == 2
+        assert lines[1]["error"] == "invalid"
+        assert len(lines[2]["result"]["patients"]) == 4
+        assert session.query(models.Person).count() == 2
+        assert session.query(models.Patient).count() == len(patients)
+
+
+class TestMain:
+    @mock.patch("recordlinker.database.algorithm_service.get_algorithm")
+    def test_invalid_algorithm(self, patched_subprocess, session, patients, tmp_path, capsys):
+        patched_subprocess.return_value = None
+        infile = tmp_path / "records.ndjson"
+        infile.write_text(ndjson(patients))
+        with mock.patch("recordlinker.cli.database.SessionMaker", return_value=session):
+            with pytest.raises(SystemExit):
+                cli.main(
+                    ["link", str(infile), "--output", str(tmp_path / "out"), "--algorithm", "BAD"]
+                )
+        assert "No algorithm found: BAD" in capsys.readouterr().err
+
+    def test_existing_output(self, patients, tmp_path, capsys):
+        infile = tmp_path / "records.ndjson"
+        infile.write_text(ndjson(patients))
+        outfile = tmp_path / "results.ndjson"
+        outfile.write_text("{}\n")
+        with pytest.raises(SystemExit):
+            cli.main(["link", str(infile), "--output", str(outfile)])
+        assert "already exists" in capsys.readouterr().err
+
+    def test_invalid_workers(self, patients, tmp_path, capsys):
+        infile = tmp_path / "records.ndjson"
+        infile.write_text(ndjson(patients))
+        with pytest.raises(SystemExit):
+            cli.main(["link", str(infile), "--output", str(tmp_path / "out"), "--workers", "0"])
+        assert "--workers must be a positive integer" in capsys.readouterr().err
+
+    @mock.patch("recordlinker.database.algorithm_service.default_algorithm")
+    def test_resume(self, patched_subprocess, default_algorithm, session, patients, tmp_path):
+        patched_subprocess.return_value = default_algorithm
+        infile = tmp_path / "records.ndjson"
+        infile.write_text(ndjson(patients))
+        outfile = tmp_path / "results.ndjson"
+        checkpoint = tmp_path / "link.ckpt"
+        # simulate an interrupted run that committed the first 4 records
+        cli.write_checkpoint(checkpoint, 4)
+        args = ["link", str(infile), "--output", str(outfile), "--checkpoint", str(checkpoint)]
+        with mock.patch("recordlinker.cli.database.SessionMaker", return_value=session):
+            cli.main(args + ["--batch-size", "1"])
+        lines = [json.loads(line) for line in outfile.read_text().splitlines()]
+        assert [line["line"] for line in lines] == [5, 6]
+        assert cli.read_checkpoint(checkpoint) == 6
+        assert session.query(models.Patient).count() == 2
+
+    @mock.patch("recordlinker.database.algorithm_service.default_algorithm")
+    def test_replay(self, patched_subprocess, default_algorithm, session, patients, tmp_path):
+        patched_subprocess.return_value = default_algorithm
+        infile = tmp_path / "records.ndjson"
+        infile.write_text(ndjson(patients))
+        outfile = tmp_path / "results.ndjson"
+        checkpoint = tmp_path / "link.ckpt"
+        # simulate a run interrupted after committing the first batch, but before
+        # writing its checkpoint
+        chunk = list(enumerate(patients[:4], start=1))
+        cli.link_stream_chunk(session, default_algorithm, chunk)
+        args = ["link", str(infile), "--output", str(outfile), "--checkpoint", str(checkpoint)]
+        with mock.patch("recordlinker.cli.database.SessionMaker", return_value=session):
+            cli.main(args + ["--batch-size", "5"])
+        lines = [json.loads(line) for line in outfile.read_text().splitlines()]
+        assert [line["line"] for line in lines] == [1, 2, 3, 4, 5, 6]
+        assert all(line["error"].startswith("already linked") for line in lines[:4])
+        assert all("result" in line for line in lines[4:])
+        assert cli.read_checkpoint(checkpoint) == 6
+        assert session.query(models.Patient).count() == 6
+
+    def test_load(self, session, patients, tmp_path):
+        infile = tmp_path / "clusters.ndjson"
+        infile.write_text(json.dumps({"records": [p.model_dump(mode="json") for p in patients]}))
+        outfile = tmp_path / "persons.ndjson"
+        with mock.patch("recordlinker.cli.database.SessionMaker", return_value=session):
+            cli.main(["load", str(infile), "--output", str(outfile)])
+        lines = [json.loads(line) for line in outfile.read_text().splitlines()]
+        assert len(lines) == 1
+        assert len(lines[0]["result"]["patients"]) == len(patients)
+        assert session.query(models.Patient).count() == len(patients)
+
+    def test_build_index(self, session, patients, tmp_path, capsys):
+        for record in patients:
+            mpi_service.insert_patient(session, record, person=models.Person())
+        output = tmp_path / "index.bin"
+        with mock.patch("recordlinker.cli.database.SessionMaker", return_value=session):
+            cli.main(["build-index", "--output", str(output)])
+        assert "blocking values to" in capsys.readouterr().out
+        assert len(blocking_index.BlockingIndex.from_snapshot(str(output))) > 0
+
+    def test_shutdown(self, patients, tmp_path):
+        infile = tmp_path / "records.ndjson"
+        infile.write_text(ndjson(patients))
+        with (
+            mock.patch.object(cli.indexer, "stop_indexer") as stop_indexer,
+            mock.patch.object(cli.compute, "shutdown_executor") as shutdown_executor,
+        ):
+            with pytest.raises(SystemExit):
+                cli.main(["link", str(infile), "--output", str(tmp_path / "out"), "--workers", "0"])
+        # the indexer and executor are stopped, even when the command fails
+        stop_indexer.assert_called_once_with()
+        shutdown_executor.assert_called_once_with()
+
+    def test_build_index_no_output(self, capsys):
+        with mock.patch.object(settings, "blocking_index_snapshot", None):
+            with pytest.raises(SystemExit):
+                cli.main(["build-index"])
+        assert "--output is required" in capsys.readouterr().err
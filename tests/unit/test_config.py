@@ -28,3 +28,9 @@ class TestSettings:
 
         obj = config.Settings(api_root_path="myapi/")
         assert obj.api_root_path == "/myapi"
+
+    def test_algorithm_cache_ttl(self):
+        assert config.Settings(algorithm_cache_ttl=0).algorithm_cache_ttl == 0
+
+        with pytest.raises(ValueError):
+            config.Settings(algorithm_cache_ttl=-1)
@@ -1,7 +1,10 @@
 import unittest.mock
 
+from fastapi.testclient import TestClient
 from sqlalchemy.exc import OperationalError
 
+from recordlinker import main
+
 
 def test_root(client):
     actual_response = client.get("/", follow_redirects=False)
@@ -30,3 +33,14 @@ def test_health_check_unavailable(client):
 def test_openapi(client):
     actual_response = client.get(client.app.openapi_url)
     assert actual_response.status_code == 200
+
+
+def test_lifespan_shutdown():
+    with (
+        unittest.mock.patch.object(main.indexer, "stop_indexer") as stop_indexer,
+        unittest.mock.patch.object(main.compute, "shutdown_executor") as shutdown_executor,
+    ):
+        with TestClient(main.app):
+            stop_indexer.assert_not_called()
+        stop_indexer.assert_called_once_with()
+        shutdown_executor.assert_called_once_with()
@@ -3,6 +3,7 @@ import unittest.mock
 import starlette.applications
 
 from recordlinker import middleware
+from recordlinker.linking import compute
 
 
 class TestCorrelationIdMiddleware:
@@ -59,3 +60,22 @@ class TestErrorHandler:
             assert "traceback" in mock_logger.error.call_args[1]["extra"]
         finally:
             client.app.router.routes = [r for r in client.app.router.routes if r.path != "/error"]
+
+
+class TestQueueFullHandler:
+    def test(self, client):
+        async def full_route():
+            raise compute.QueueFullError("compute queue is full")
+
+        try:
+            client.app.add_api_route("/full", full_route, methods=["GET"])
+            with unittest.mock.patch("recordlinker.middleware.ERROR_LOGGER") as mock_logger:
+                response = client.get("/full")
+            assert response.status_code == 503
+            assert response.json() == {"detail": "Service Unavailable"}
+            assert response.headers["Retry-After"] == "1"
+            assert mock_logger.warning.call_args[0] == ("compute queue full",)
+        finally:
+            client.app.router.routes = [
+                r for r in client.app.router.routes if getattr(r, "path", None) != "/full"
+            ]